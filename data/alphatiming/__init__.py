@@ -0,0 +1,10 @@
+"""
+Shared helpers for the BRKC Alpha Timing scrapers in data/.
+
+The scripts in data/ (build-csv.py, scrape-r2r3.py, scrape-practice.py)
+are run directly, so this package is importable from them without any
+install step.
+"""
+
+UA = "Mozilla/5.0"
+BASE = "https://results.alphatiming.co.uk/lorainohiokartplex/e"
@@ -0,0 +1,213 @@
+"""
+Lap analytics over the whole season, one row per driver-session.
+
+Laps come straight from the memory-mapped lap store (lapstore.py). Lap 1
+(the standing or rolling start) and laps without a time are left out, and
+so is any lap slower than OUTLIER_FACTOR times the driver's median for the
+session (spins, yellows, a trip through the pits). From what is left:
+
+  laps     laps counted
+  best     fastest lap, ms
+  median   median lap, ms
+  std      standard deviation, ms (population) - lower is more consistent
+  best3    best average over three consecutive counted laps, ms
+  fade     least-squares slope of lap time against lap number, ms per lap;
+           positive means the driver slowed as the session went on
+  gap      best minus the best of anyone in the same class and session, ms
+
+With NumPy installed every statistic is a grouped reduction over the flat
+lap array (bincount / ufunc.at over series ids, one lexsort for medians);
+without it the same numbers come from a plain loop over the store.
+
+    python3 -m alphatiming.analytics [--class NAME] [--session TYPE] [--out FILE]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+
+from .csvfiles import csv_writer
+from .lapstore import COLUMNS, open_store
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+OUTLIER_FACTOR = 1.15
+STATS = ('laps', 'best', 'median', 'std', 'best3', 'fade', 'gap')
+HEADER = ['Round', 'Date', 'Class', 'Session', 'Driver', 'Laps', 'Best', 'Median',
+          'Std', 'Best3', 'Fade', 'Gap']
+
+
+def _series_stats(laps):
+    """Stats (without gap) for one series of ms laps; None where undefined."""
+    counted = [(n, ms) for n, ms in enumerate(laps, 1) if n > 1 and ms > 0]
+    if counted:
+        median = statistics.median(ms for _, ms in counted)
+        limit = OUTLIER_FACTOR * median
+        counted = [(n, ms) for n, ms in counted if ms <= limit]
+    if not counted:
+        return {'laps': 0, 'best': None, 'median': None, 'std': None,
+                'best3': None, 'fade': None}
+
+    times = [ms for _, ms in counted]
+    k = len(counted)
+    best3 = None
+    for i in range(k - 2):
+        if counted[i + 2][0] - counted[i][0] == 2:
+            avg = (times[i] + times[i + 1] + times[i + 2]) / 3
+            if best3 is None or avg < best3:
+                best3 = avg
+
+    fade = None
+    if k >= 2:
+        sx = sum(n for n, _ in counted)
+        sy = sum(times)
+        sxx = sum(n * n for n, _ in counted)
+        sxy = sum(n * ms for n, ms in counted)
+        denom = k * sxx - sx * sx
+        if denom:
+            fade = (k * sxy - sx * sy) / denom
+
+    return {'laps': k, 'best': min(times), 'median': float(statistics.median(times)),
+            'std': statistics.pstdev(times), 'best3': best3, 'fade': fade}
+
+
+def _stats_python(store):
+    return [_series_stats(store.series_laps(i)) for i in range(len(store))]
+
+
+def _grouped_median(values, gid, n):
+    """Median of values per group id (0..n-1); NaN for empty groups."""
+    order = np.lexsort((values, gid))
+    values, gid = values[order], gid[order]
+    count = np.bincount(gid, minlength=n)
+    start = np.concatenate(([0], np.cumsum(count)[:-1]))
+    median = np.full(n, np.nan)
+    has = count > 0
+    lo = start[has] + (count[has] - 1) // 2
+    hi = start[has] + count[has] // 2
+    median[has] = (values[lo] + values[hi]) / 2
+    return median
+
+
+def _stats_numpy(store):
+    laps, offsets = store.as_numpy()
+    laps = laps.astype(np.int64)
+    offsets = offsets.astype(np.int64)
+    n = len(offsets) - 1
+    sizes = np.diff(offsets)
+    gid = np.repeat(np.arange(n), sizes)
+    lapno = np.arange(len(laps)) - np.repeat(offsets[:-1], sizes) + 1
+
+    mask = (lapno > 1) & (laps > 0)
+    median = _grouped_median(laps[mask], gid[mask], n)
+    with np.errstate(invalid='ignore'):
+        mask &= laps <= OUTLIER_FACTOR * median[gid]
+
+    g, y, x = gid[mask], laps[mask], lapno[mask]
+    count = np.bincount(g, minlength=n)
+    has = count > 0
+    safe = np.maximum(count, 1)
+
+    best = np.full(n, np.iinfo(np.int64).max)
+    np.minimum.at(best, g, y)
+    mean = np.bincount(g, weights=y, minlength=n) / safe
+    std = np.sqrt(np.bincount(g, weights=(y - mean[g]) ** 2, minlength=n) / safe)
+    median = _grouped_median(y, g, n)
+
+    sx = np.bincount(g, weights=x, minlength=n)
+    sy = np.bincount(g, weights=y, minlength=n)
+    sxx = np.bincount(g, weights=x * x, minlength=n)
+    sxy = np.bincount(g, weights=x * y, minlength=n)
+    denom = count * sxx - sx * sx
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fade = np.where((count >= 2) & (denom != 0), (count * sxy - sx * sy) / denom, np.nan)
+
+    best3 = np.full(n, np.inf)
+    if len(laps) >= 3:
+        ok = mask[:-2] & mask[1:-1] & mask[2:] & (gid[:-2] == gid[2:])
+        window = (laps[:-2] + laps[1:-1] + laps[2:]) / 3
+        np.minimum.at(best3, gid[:-2][ok], window[ok])
+
+    def value(a, i):
+        v = a[i].item()
+        return None if v != v or v in (float('inf'), np.iinfo(np.int64).max) else v
+
+    rows = []
+    for i in range(n):
+        if not has[i]:
+            rows.append({'laps': 0, 'best': None, 'median': None, 'std': None,
+                         'best3': None, 'fade': None})
+            continue
+        rows.append({'laps': int(count[i]), 'best': int(best[i]), 'median': value(median, i),
+                     'std': value(std, i), 'best3': value(best3, i), 'fade': value(fade, i)})
+    return rows
+
+
+def lap_stats(store, use_numpy=None):
+    """
+    One dict per series of store: round, date, class, session, driver and
+    the STATS above (None where a statistic is undefined).
+    """
+    if use_numpy is None:
+        use_numpy = np is not None
+    per_series = _stats_numpy(store) if use_numpy else _stats_python(store)
+
+    rows = []
+    class_best = {}
+    for i, stats in enumerate(per_series):
+        row = {c: store.field(c, i) for c in COLUMNS}
+        row.update(stats)
+        rows.append(row)
+        if stats['best'] is not None:
+            key = (row['round'], row['class'], row['session'])
+            if key not in class_best or stats['best'] < class_best[key]:
+                class_best[key] = stats['best']
+    for row in rows:
+        best = row['best']
+        row['gap'] = None if best is None else best - class_best[(row['round'], row['class'], row['session'])]
+    return rows
+
+
+def _fmt(v):
+    if v is None:
+        return ''
+    return str(v) if isinstance(v, int) else f"{v:.1f}"
+
+
+def write_table(rows, f):
+    writer = csv_writer(f)
+    writer.writerow(HEADER)
+    for r in rows:
+        writer.writerow([r['round'], r['date'], r['class'], r['session'], r['driver']]
+                        + [_fmt(r[s]) for s in STATS])
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog='python3 -m alphatiming.analytics')
+    ap.add_argument('--class', dest='class_name', help="only this class")
+    ap.add_argument('--session', help="only this session type (P, Q, H1, ...)")
+    ap.add_argument('--out', help="write the table here instead of stdout")
+    ap.add_argument('--no-numpy', action='store_true', help="use the pure Python path")
+    args = ap.parse_args(argv)
+
+    data_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    store = open_store(data_dir)
+    rows = lap_stats(store, use_numpy=False if args.no_numpy else None)
+    if args.class_name:
+        rows = [r for r in rows if r['class'] == args.class_name]
+    if args.session:
+        rows = [r for r in rows if r['session'] == args.session]
+    if args.out:
+        with open(args.out, 'w', newline='', encoding='utf-8') as f:
+            write_table(rows, f)
+    else:
+        write_table(rows, sys.stdout)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
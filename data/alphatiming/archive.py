@@ -0,0 +1,307 @@
+"""
+Raw page archive: every result and laptimes page the pipeline fetches.
+
+Pages are kept so a parser fix can be applied to the whole season again
+without going back to the timing site. One pack per event under
+data/archive/:
+
+    <event_id>.pack   append-only; each page is its own gzip member
+                      (mtime 0), so the pack is also a valid .gz stream
+    <event_id>.idx    fixed-width index, one entry per page:
+
+        header  '<8sI4x'          magic, entry size
+        entry   '<QBBxxIQII16s'   session id, tab, codec, fetched (unix
+                                  time), offset and length in the pack,
+                                  raw length, first 16 bytes of the
+                                  page's SHA-256
+
+The index is memory-mapped; entry i lives at a fixed offset, and a dict
+of (session id, tab) -> newest entry is built from it on open, so looking
+a page up is O(1) and reading it is one pread plus a decompress. A page
+identical to the newest copy already archived is not stored again. A
+crash can only leave bytes past the last indexed entry, which are
+ignored.
+
+Codec 1 (zstd frames) is read and written when the zstandard package is
+installed and BRKC_ARCHIVE_CODEC=zstd; gzip is the default.
+
+replay_fetch() is a drop-in for client.fetch_url that serves archived
+pages, so the normal parse stage runs with no network:
+
+    python3 -m alphatiming.pipeline --replay [--round 4]    # re-parse from the archive
+    python3 -m alphatiming.archive stats                    # what is archived
+    python3 -m alphatiming.archive import                   # seed from the HTTP cache
+    python3 -m alphatiming.archive verify                   # check every page's hash
+    python3 -m alphatiming.archive cat SESSION_ID [TAB]     # print a page
+"""
+
+import gzip
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+from .fetch import TABS
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ARCHIVE_DIR = "archive"
+MAGIC = b'BRKCARC1'
+HEADER = struct.Struct('<8sI4x')
+ENTRY = struct.Struct('<QBBxxIQII16s')
+
+GZIP, ZSTD = 0, 1
+TAB_CODES = {tab: i for i, tab in enumerate(TABS)}
+
+
+def digest(body):
+    return hashlib.sha256(body).digest()[:16]
+
+
+def compress(body, codec):
+    if codec == ZSTD:
+        return zstandard.ZstdCompressor(level=10).compress(body)
+    return gzip.compress(body, compresslevel=9, mtime=0)
+
+
+def decompress(data, codec):
+    if codec == ZSTD:
+        if zstandard is None:
+            raise RuntimeError("page was archived with zstd; install zstandard to read it")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def default_codec():
+    if os.environ.get('BRKC_ARCHIVE_CODEC') == 'zstd' and zstandard is not None:
+        return ZSTD
+    return GZIP
+
+
+class EventPack:
+    """The pack and index of one event."""
+
+    def __init__(self, root, event_id):
+        self.event_id = event_id
+        self.pack_path = os.path.join(root, f"{event_id}.pack")
+        self.idx_path = os.path.join(root, f"{event_id}.idx")
+        self.latest = {}
+        self._mmap = None
+        self._mapped = 0
+        self._count = 0
+        self._lock = threading.RLock()
+        self._map()
+        for i in range(self._count):
+            sid, tab = ENTRY.unpack_from(self._mmap, HEADER.size + i * ENTRY.size)[:2]
+            self.latest[(sid, tab)] = i
+
+    def _map(self):
+        """(Re)map the index; entries past a torn tail are ignored."""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        try:
+            size = os.path.getsize(self.idx_path)
+        except OSError:
+            size = 0
+        if size < HEADER.size:
+            self._mapped = self._count = 0
+            return
+        with open(self.idx_path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, entry_size = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or entry_size != ENTRY.size:
+            raise ValueError(f"{self.idx_path} is not a page archive index")
+        self._mapped = self._count = (size - HEADER.size) // ENTRY.size
+
+    def __len__(self):
+        return self._count
+
+    def entry(self, i):
+        """(session id, tab, codec, fetched, offset, length, raw length, hash)"""
+        with self._lock:
+            if i >= self._mapped:
+                self._map()
+            return ENTRY.unpack_from(self._mmap, HEADER.size + i * ENTRY.size)
+
+    def entries(self):
+        for i in range(len(self)):
+            yield self.entry(i)
+
+    def read_entry(self, i):
+        _, _, codec, _, offset, length, _, _ = self.entry(i)
+        fd = os.open(self.pack_path, os.O_RDONLY)
+        try:
+            data = os.pread(fd, length, offset)
+        finally:
+            os.close(fd)
+        return decompress(data, codec)
+
+    def get(self, session_id, tab):
+        """Newest archived page body (bytes), or None."""
+        i = self.latest.get((session_id, TAB_CODES[tab]))
+        return None if i is None else self.read_entry(i)
+
+    def put(self, session_id, tab, body, codec=None, fetched=None):
+        """Archive a page (bytes). Returns False if it was already the newest copy."""
+        tab_code = TAB_CODES[tab]
+        h = digest(body)
+        with self._lock:
+            i = self.latest.get((session_id, tab_code))
+            if i is not None and self.entry(i)[7] == h:
+                return False
+            codec = default_codec() if codec is None else codec
+            data = compress(body, codec)
+            with open(self.pack_path, 'ab') as f:
+                offset = f.tell()
+                f.write(data)
+            new_index = not os.path.exists(self.idx_path) or self._count == 0
+            with open(self.idx_path, 'r+b' if not new_index else 'wb') as f:
+                if new_index:
+                    f.write(HEADER.pack(MAGIC, ENTRY.size))
+                f.seek(HEADER.size + self._count * ENTRY.size)
+                f.truncate()
+                f.write(ENTRY.pack(session_id, tab_code, codec,
+                                   int(fetched if fetched is not None else time.time()),
+                                   offset, len(data), len(body), h))
+            self.latest[(session_id, tab_code)] = self._count
+            self._count += 1
+            return True
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+
+class Archive:
+    """All event packs under data_dir/archive/."""
+
+    def __init__(self, data_dir):
+        self.root = os.path.join(data_dir, ARCHIVE_DIR)
+        self._packs = {}
+        self._lock = threading.Lock()
+
+    def pack(self, event_id):
+        event_id = int(event_id)
+        with self._lock:
+            pack = self._packs.get(event_id)
+            if pack is None:
+                os.makedirs(self.root, exist_ok=True)
+                pack = self._packs[event_id] = EventPack(self.root, event_id)
+            return pack
+
+    def events(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(int(name[:-4]) for name in os.listdir(self.root) if name.endswith('.idx'))
+
+    def put(self, event_id, session_id, tab, text):
+        return self.pack(event_id).put(int(session_id), tab, text.encode('utf-8'))
+
+    def get(self, event_id, session_id, tab):
+        body = self.pack(event_id).get(int(session_id), tab)
+        return None if body is None else body.decode('utf-8')
+
+    def has_session(self, event_id, session_id):
+        pack = self.pack(event_id)
+        return all((int(session_id), TAB_CODES[tab]) in pack.latest for tab in TABS)
+
+    def replay_fetch(self, url):
+        """fetch_url stand-in: the archived copy of a session page."""
+        from .retry import FetchError
+
+        parts = urlsplit(url).path.rstrip('/').split('/')
+        if len(parts) < 4 or parts[-3] != 's' or parts[-1] not in TAB_CODES:
+            raise FetchError('offline', url, "only session pages are archived")
+        text = self.get(parts[-4], parts[-2], parts[-1])
+        if text is None:
+            raise FetchError('offline', url, "not in the archive")
+        return text
+
+    def close(self):
+        with self._lock:
+            for pack in self._packs.values():
+                pack.close()
+            self._packs.clear()
+
+
+def import_cache(archive, cache_root):
+    """Archive every cached session page. Returns pages added."""
+    added = 0
+    for dirpath, _, files in os.walk(cache_root):
+        for name in sorted(files):
+            if not name.endswith('.json'):
+                continue
+            with open(os.path.join(dirpath, name), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            parts = urlsplit(meta.get('url', '')).path.rstrip('/').split('/')
+            if len(parts) < 4 or parts[-3] != 's' or parts[-1] not in TAB_CODES:
+                continue
+            with open(os.path.join(dirpath, name[:-5] + '.gz'), 'rb') as f:
+                body = gzip.decompress(f.read())
+            added += archive.pack(parts[-4]).put(int(parts[-2]), parts[-1], body,
+                                                 fetched=meta.get('fetched'))
+    return added
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    data_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    archive = Archive(data_dir)
+    command = argv[0] if argv else 'stats'
+
+    if command == 'stats':
+        total_pages = total_raw = total_packed = 0
+        for event_id in archive.events():
+            pack = archive.pack(event_id)
+            sessions = {e[0] for e in pack.entries()}
+            raw = sum(e[6] for e in pack.entries())
+            packed = os.path.getsize(pack.pack_path)
+            print(f"  {event_id}: {len(sessions)} sessions, {len(pack)} pages, "
+                  f"{raw / 1e6:.1f} MB raw, {packed / 1e6:.1f} MB packed")
+            total_pages += len(pack)
+            total_raw += raw
+            total_packed += packed
+        print(f"{total_pages} pages, {total_raw / 1e6:.1f} MB raw, {total_packed / 1e6:.1f} MB packed")
+    elif command == 'import':
+        from .cache import DEFAULT_DIR
+        root = os.environ.get('BRKC_CACHE_DIR', DEFAULT_DIR)
+        print(f"{import_cache(archive, root)} pages added from {root}")
+    elif command == 'verify':
+        bad = 0
+        for event_id in archive.events():
+            pack = archive.pack(event_id)
+            for i in range(len(pack)):
+                entry = pack.entry(i)
+                if digest(pack.read_entry(i)) != entry[7]:
+                    bad += 1
+                    print(f"  {event_id}: entry {i} (sid={entry[0]}) does not match its hash")
+        print("OK" if not bad else f"{bad} bad pages")
+        return 1 if bad else 0
+    elif command == 'cat' and len(argv) >= 2:
+        session_id = int(argv[1])
+        tab = argv[2] if len(argv) > 2 else 'result'
+        for event_id in archive.events():
+            body = archive.pack(event_id).get(session_id, tab)
+            if body is not None:
+                sys.stdout.write(body.decode('utf-8'))
+                return 0
+        print(f"sid={session_id} {tab} is not archived", file=sys.stderr)
+        return 1
+    else:
+        print('\n'.join(__doc__.strip().splitlines()[-5:]), file=sys.stderr)
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,325 @@
+"""
+Offline benchmark suite for the parse and write paths.
+
+    python3 -m alphatiming.bench record [--from-cache]   # (re)build the fixture corpus
+    python3 -m alphatiming.bench [--save] [--threshold 0.2] [--repeat 5]
+
+The corpus, data/bench/fixtures.jsonl.gz, has one line per session:
+{"name", "session", "result", "laptimes"}, with the session in SESSIONS
+form. `record` renders it from the committed CSVs (brkc-results.csv and
+the long lap file), so it covers every session type the season has (P, Q,
+H1/H2, PF, F), multi-class tables with per-class sub-results, and DNS
+rows. Every fifth session also marks its last finisher DNF, and every
+fourth result page drops its header row so the heuristic cell mapping is
+exercised too. With --from-cache, real result and laptimes pages already
+in the HTTP cache are added as well.
+
+Measurements (best of --repeat):
+
+  parse_results    rows/sec over every result page
+  parse_laptimes   laps/sec over every laptimes page
+  write            rows/sec for Ingest.commit of the parsed corpus
+  end_to_end       seconds for a full Pipeline rebuild from the corpus
+  peak_memory      peak traced Python allocations (MB) in that rebuild
+
+Results are compared with data/bench/baseline.json. The run exits with 1
+when a metric is worse than its baseline by more than the threshold;
+--save replaces the baseline. Baselines are machine-specific: record them
+on the machine that runs the comparison.
+"""
+
+import argparse
+import gzip
+import html
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+from urllib.parse import urlsplit
+
+from .cache import DEFAULT_DIR
+from .csvfiles import read_rows, row_key
+from .fetch import session_url
+from .ingest import Ingest
+from .longlaps import LONG_NAME, iter_series
+from .parse import parse_laptimes, parse_results
+
+DATA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(DATA_DIR, "bench")
+FIXTURES = os.path.join(BENCH_DIR, "fixtures.jsonl.gz")
+BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+DEFAULT_THRESHOLD = 0.2
+
+# Metric -> True when higher is better
+METRICS = {
+    'parse_results_rows_per_sec': True,
+    'parse_laptimes_laps_per_sec': True,
+    'write_rows_per_sec': True,
+    'end_to_end_sec': False,
+    'peak_memory_mb': False,
+}
+
+RESULT_HEADER = ('Pos', '', 'No.', 'Name', 'Cls', 'Laps', '', 'Avg Speed', 'Gap',
+                 'Best', 'On', '', 'Team')
+_PAGE_TOP = ('<!DOCTYPE html>\n<html><head><title>Alpha Timing</title></head><body>\n'
+             + '<div class="at-nav"><a href="/e">Event</a></div>\n' * 40)
+_PAGE_END = '<footer>' + '<p>Alpha Timing</p>\n' * 20 + '</footer></body></html>\n'
+
+
+def _td(value):
+    return f'<td>\n  <span>{html.escape(value)}</span>\n</td>'
+
+
+def render_result_page(rows, with_header=True, dnf_last=False):
+    """A result tab like Alpha Timing's from brkc-results.csv rows."""
+    out = [_PAGE_TOP, '<table class="at-session-results-table">']
+    if with_header:
+        out.append('<thead><tr>' + ''.join(f'<th>{h}</th>' for h in RESULT_HEADER)
+                   + '</tr></thead>')
+    out.append('<tbody><tr><td colspan="13"><strong>Full Result</strong></td></tr>')
+    finishers = [i for i, r in enumerate(rows) if r[4].isdigit()]
+    dnf = finishers[-1] if dnf_last and len(finishers) > 1 else None
+    in_class = False
+    for i, row in enumerate(rows):
+        _, _, class_name, _, pos, kart, driver, code, laps, speed, gap, best, best_on, team = row
+        if not code and not in_class and any(r[7] for r in rows):
+            out.append(f'<tr><td colspan="13">{html.escape(class_name)} Result</td></tr>')
+            in_class = True
+        if i == dnf:
+            pos, speed, gap = 'DNF', '', ''
+        cells = [pos, '<i class="at-up"></i>', kart, driver, code, laps, '', speed, gap,
+                 best, best_on, '', team]
+        out.append('<tr class="at-row">' + ''.join(
+            _td(c) if not c.startswith('<') else f'<td>{c}</td>' for c in cells) + '</tr>')
+    out.append('</tbody></table>')
+    out.append(_PAGE_END)
+    return '\n'.join(out)
+
+
+def render_laptimes_page(series):
+    """A laptimes tab: one chart dataset per driver, laps in seconds."""
+    datasets = []
+    for driver, laps_ms in series:
+        data = ','.join(f'{ms / 1000:.3f}' if ms else 'null' for ms in laps_ms)
+        datasets.append(f'{{label:"{driver}",fill:false,borderColor:"#c00",data:[{data}]}}')
+    return (_PAGE_TOP + '<canvas id="lapChart"></canvas>\n<script>\nvar ctx = 1;\n'
+            'var chart = {type:"line",data:{datasets:[' + ',\n'.join(datasets)
+            + ']}};\n</script>\n' + _PAGE_END)
+
+
+def _runs(rows, key):
+    run = []
+    for row in rows:
+        if run and key(row) != key(run[0]):
+            yield run
+            run = []
+        run.append(row)
+    if run:
+        yield run
+
+
+def generate_fixtures(data_dir=DATA_DIR):
+    """Fixture dicts rendered from data_dir's CSVs, one per session key."""
+    _, rows = read_rows(os.path.join(data_dir, "brkc-results.csv"))
+    laps = {}
+    for round_name, _, class_name, session_type, driver, laps_ms in iter_series(
+            os.path.join(data_dir, LONG_NAME)):
+        laps.setdefault((round_name, class_name, session_type), []).append((driver, laps_ms))
+
+    fixtures = []
+    for n, run in enumerate(_runs(rows, row_key)):
+        round_name, date, class_name, session_type = run[0][:4]
+        session = (round_name, date, 0, n + 1, class_name, session_type)
+        fixtures.append({
+            'name': f"{round_name} - {class_name} {session_type}",
+            'session': session,
+            'result': render_result_page(run, with_header=n % 4 != 3, dnf_last=n % 5 == 4),
+            'laptimes': render_laptimes_page(laps.get(row_key(run[0]), [])),
+        })
+    return fixtures
+
+
+def cached_fixtures(root=None):
+    """Result/laptimes page pairs from the HTTP cache."""
+    root = root or os.environ.get('BRKC_CACHE_DIR', DEFAULT_DIR)
+    pages = {}
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            if not name.endswith('.json'):
+                continue
+            with open(os.path.join(dirpath, name), 'r', encoding='utf-8') as f:
+                url = json.load(f).get('url', '')
+            parts = urlsplit(url).path.rstrip('/').split('/')
+            if len(parts) < 4 or parts[-3] != 's' or parts[-1] not in ('result', 'laptimes'):
+                continue
+            with open(os.path.join(dirpath, name[:-5] + '.gz'), 'rb') as f:
+                body = gzip.decompress(f.read()).decode('utf-8', errors='replace')
+            pages.setdefault((parts[-4], parts[-2]), {})[parts[-1]] = body
+    fixtures = []
+    for (event_id, session_id), tabs in sorted(pages.items()):
+        if len(tabs) == 2:
+            fixtures.append({
+                'name': f"cached {event_id}/{session_id}",
+                'session': ('Cached', '', int(event_id), int(session_id), 'Cached', 'P'),
+                'result': tabs['result'], 'laptimes': tabs['laptimes'],
+            })
+    return fixtures
+
+
+def save_fixtures(fixtures, path=FIXTURES):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    with gzip.GzipFile(tmp, 'wb', 9, mtime=0) as f:
+        for fixture in fixtures:
+            f.write(json.dumps(fixture, separators=(',', ':')).encode('utf-8') + b'\n')
+    os.replace(tmp, path)
+
+
+def load_fixtures(path=FIXTURES):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def best_of(repeat, fn):
+    """Best seconds per call; short calls are looped for at least 0.2s per sample."""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number
+
+
+def rebuild(fixtures, data_dir):
+    """Full pipeline rebuild of data_dir with pages served from the corpus."""
+    from .pipeline import Pipeline
+
+    pages = {}
+    for fx in fixtures:
+        _, _, event_id, session_id = fx['session'][:4]
+        pages[session_url(event_id, session_id, 'result')] = fx['result']
+        pages[session_url(event_id, session_id, 'laptimes')] = fx['laptimes']
+    sessions = [tuple(fx['session']) for fx in fixtures]
+    Pipeline(data_dir, rate=1e9, parse_workers=1, rebuild=True, fetch=pages.get,
+             log=lambda *a: None, report_dir=os.path.join(data_dir, 'reports')).run(sessions)
+
+
+def run(fixtures, repeat):
+    results = [fx['result'] for fx in fixtures]
+    laptimes = [fx['laptimes'] for fx in fixtures]
+    n_rows = sum(len(parse_results(p)) for p in results)
+    n_laps = sum(len(laps) for p in laptimes for laps in parse_laptimes(p).values())
+    metrics = {
+        'parse_results_rows_per_sec': n_rows / best_of(repeat, lambda: [parse_results(p) for p in results]),
+        'parse_laptimes_laps_per_sec': n_laps / best_of(repeat, lambda: [parse_laptimes(p) for p in laptimes]),
+    }
+
+    parsed = [(tuple(fx['session']), parse_results(fx['result']), parse_laptimes(fx['laptimes']))
+              for fx in fixtures]
+    n_written = 0
+    write_times = []
+    for _ in range(repeat):
+        tmp = tempfile.mkdtemp(prefix='brkc-bench-')
+        try:
+            ingest = Ingest(tmp)
+            for session, drivers, lt_data in parsed:
+                ingest.add(session, drivers, lt_data)
+            t0 = time.perf_counter()
+            n_results, n_laptimes = ingest.commit()
+            write_times.append(time.perf_counter() - t0)
+            n_written = n_results + n_laptimes
+        finally:
+            shutil.rmtree(tmp)
+    metrics['write_rows_per_sec'] = n_written / min(write_times)
+
+    e2e = []
+    peak = 0
+    for i in range(repeat):
+        tmp = tempfile.mkdtemp(prefix='brkc-bench-')
+        try:
+            if i == 0:
+                tracemalloc.start()
+            t0 = time.perf_counter()
+            rebuild(fixtures, tmp)
+            elapsed = time.perf_counter() - t0
+            if i == 0:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            else:
+                e2e.append(elapsed)
+        finally:
+            shutil.rmtree(tmp)
+    metrics['end_to_end_sec'] = min(e2e) if e2e else elapsed
+    metrics['peak_memory_mb'] = peak / 1e6
+    return metrics, {'pages': len(fixtures), 'rows': n_rows, 'laps': n_laps, 'written': n_written}
+
+
+def compare(metrics, baseline, threshold):
+    """[(metric, value, baseline, change, regressed), ...]"""
+    report = []
+    for name, higher_is_better in METRICS.items():
+        value = metrics[name]
+        base = baseline.get(name)
+        if not base:
+            report.append((name, value, None, None, False))
+            continue
+        change = (value - base) / base
+        worse = -change if higher_is_better else change
+        report.append((name, value, base, change, worse > threshold))
+    return report
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog='python3 -m alphatiming.bench')
+    ap.add_argument('command', nargs='?', default='run', choices=('run', 'record'))
+    ap.add_argument('--from-cache', action='store_true', help="record: add pages from the HTTP cache")
+    ap.add_argument('--save', action='store_true', help="run: write the results as the new baseline")
+    ap.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                    help="allowed fractional slowdown before failing (default 0.2)")
+    ap.add_argument('--repeat', type=int, default=5)
+    args = ap.parse_args(argv)
+
+    if args.command == 'record':
+        fixtures = generate_fixtures()
+        if args.from_cache:
+            fixtures += cached_fixtures()
+        save_fixtures(fixtures)
+        print(f"{len(fixtures)} sessions -> {FIXTURES}")
+        return 0
+
+    if not os.path.exists(FIXTURES):
+        print(f"No fixtures at {FIXTURES}; run `python3 -m alphatiming.bench record` first")
+        return 1
+    fixtures = load_fixtures()
+    metrics, counts = run(fixtures, max(2, args.repeat))
+    print(f"{counts['pages']} sessions, {counts['rows']} result rows, {counts['laps']} laps, "
+          f"best of {max(2, args.repeat)}")
+
+    baseline = {}
+    if os.path.exists(BASELINE):
+        with open(BASELINE, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    report = compare(metrics, baseline, args.threshold)
+    for name, value, base, change, regressed in report:
+        line = f"  {name:28s} {value:14,.2f}"
+        if base is not None:
+            line += f"   baseline {base:14,.2f}  {change:+7.1%}"
+            if regressed:
+                line += "  REGRESSION"
+        print(line)
+
+    if args.save:
+        with open(BASELINE, 'w', encoding='utf-8') as f:
+            json.dump({k: round(v, 3) for k, v in metrics.items()}, f, indent=1, sort_keys=True)
+            f.write('\n')
+        print(f"Baseline saved to {BASELINE}")
+        return 0
+    if any(r[4] for r in report):
+        print(f"Regression beyond {args.threshold:.0%} of baseline")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
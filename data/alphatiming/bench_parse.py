@@ -0,0 +1,158 @@
+"""
+Compare the streaming parse_results against the old regex version.
+
+    python3 -m alphatiming.bench_parse [PAGE ...]
+    python3 -m alphatiming.bench_parse --check
+
+Pages are saved result-tab HTML files. With no arguments every cached
+result page in the HTTP cache (BRKC_CACHE_DIR) is used. The streaming
+tokenizer with heuristic cell mapping must produce the same rows as the
+regex version; the script reports rows/sec for each, plus the header
+column-map path and how many of its rows differ from the heuristics.
+
+--check parses data/bench/result-page.html, an excerpt in the layout of a
+real result tab, and compares the rows with data/bench/result-page.json.
+The bench fixtures are rendered from our own CSVs, so they cannot show
+that the header labels match the site's; this page does. The check also
+fails if the heuristics read the page's Cls and Team columns correctly,
+since then the page no longer shows what the column map is for.
+"""
+
+import gzip
+import json
+import os
+import re
+import sys
+import time
+
+from .cache import DEFAULT_DIR
+from .parse import driver_from_cells, parse_results
+
+BENCH_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bench")
+CHECK_PAGE = os.path.join(BENCH_DIR, "result-page.html")
+CHECK_ROWS = os.path.join(BENCH_DIR, "result-page.json")
+
+
+def parse_results_regex(html):
+    """parse_results as it was in the scrapers: several regex passes."""
+    drivers = []
+    table_match = re.findall(
+        r'<table class="at-session-results-table"[^>]*>([\s\S]*?)</table>', html
+    )
+    if not table_match:
+        return drivers
+    rows = re.findall(r'<tr[^>]*>([\s\S]*?)</tr>', table_match[0])
+    for row in rows:
+        if '<th' in row:
+            continue
+        tds = re.findall(r'<td[^>]*>([\s\S]*?)</td>', row)
+        if not tds:
+            continue
+        cells = []
+        for td in tds:
+            text = re.sub(r'<[^>]+>', '', td).strip()
+            cells.append(' '.join(text.split()))
+        if len(cells) <= 2:
+            continue
+        if cells[0] in ('Full Result', '') and any('Result' in c for c in cells):
+            continue
+        if any('Result' in c for c in cells[:2]):
+            continue
+        driver = driver_from_cells(cells)
+        if driver is not None:
+            drivers.append(driver)
+    return drivers
+
+
+def cached_result_pages(root=None):
+    root = root or os.environ.get('BRKC_CACHE_DIR', DEFAULT_DIR)
+    pages = []
+    if not os.path.isdir(root):
+        return pages
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            if not name.endswith('.json'):
+                continue
+            with open(os.path.join(dirpath, name), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if not meta.get('url', '').endswith('/result'):
+                continue
+            with open(os.path.join(dirpath, name[:-5] + '.gz'), 'rb') as f:
+                pages.append(gzip.decompress(f.read()).decode('utf-8', errors='replace'))
+    return pages
+
+
+def bench(fn, pages, repeat):
+    best = None
+    rows = 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        rows = sum(len(fn(p)) for p in pages)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return rows, best
+
+
+def check(page_path=CHECK_PAGE, rows_path=CHECK_ROWS):
+    """Check parse_results against the expected rows of a saved page; returns 0 or 1."""
+    with open(page_path, 'r', encoding='utf-8') as f:
+        page = f.read()
+    with open(rows_path, 'r', encoding='utf-8') as f:
+        expected = json.load(f)
+    rows = parse_results(page)
+    failed = len(rows) != len(expected)
+    if failed:
+        print(f"{len(rows)} rows parsed, {len(expected)} expected")
+    for i, (got, want) in enumerate(zip(rows, expected), 1):
+        for field, value in want.items():
+            if got.get(field) != value:
+                print(f"row {i}: {field} is {got.get(field)!r}, expected {value!r}")
+                failed = True
+
+    missed = {field for got, want in zip(parse_results(page, use_header=False), expected)
+              for field in ('cls', 'team') if got[field] != want[field]}
+    if missed != {'cls', 'team'}:
+        print("The heuristics read every Cls and Team cell correctly: "
+              "the page no longer exercises the header column map")
+        failed = True
+    print(f"{os.path.basename(page_path)}: {len(rows)} rows, {'FAILED' if failed else 'ok'}")
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv == ['--check']:
+        return check()
+    if argv:
+        pages = []
+        for path in argv:
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                pages.append(f.read())
+    else:
+        pages = cached_result_pages()
+    if not pages:
+        print("No result pages found (pass saved pages or fill the HTTP cache first)")
+        return 1
+
+    def heuristic(page):
+        return parse_results(page, use_header=False)
+
+    remapped = 0
+    for page in pages:
+        if heuristic(page) != parse_results_regex(page):
+            print("Streaming and regex parsers disagree on at least one page")
+            return 1
+        remapped += sum(a != b for a, b in zip(parse_results(page), heuristic(page)))
+
+    repeat = 5
+    print(f"{len(pages)} pages, {sum(len(p) for p in pages) / 1e6:.1f} MB, best of {repeat}")
+    for label, fn in [('regex', parse_results_regex), ('streaming', heuristic),
+                      ('header map', parse_results)]:
+        rows, elapsed = bench(fn, pages, repeat)
+        print(f"  {label:10s} {rows} rows in {elapsed * 1000:.1f} ms  ({rows / elapsed:,.0f} rows/sec)")
+    print(f"  {remapped} rows mapped differently by the header than by the heuristics")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
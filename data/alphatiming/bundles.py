@@ -0,0 +1,215 @@
+"""
+Per-class, per-round JSON shards for the BRKC pages.
+
+    data/bundles/manifest.json
+    data/bundles/<class>/<round>.<hash>.json     (+ .json.gz, .json.br)
+    data/bundles/standings/<class>.<hash>.json   (+ .json.gz, .json.br)
+
+A round shard holds every session of one class in one round with only the
+fields the pages show: results rows, and each driver's lap times in ms.
+Shard names carry the first 12 hex digits of the content's SHA-256, so they
+can be served with a long-lived cache header. manifest.json, the only file
+that must be revalidated, lists each shard's path, hash and sizes by class
+and round. A page loads the manifest, then fetches only the shard it renders.
+
+Each shard gets a gzip -9 sibling, and a brotli one when the brotli module
+is installed. A shard whose content has not changed is not rewritten, and
+shards that are no longer listed are deleted.
+
+Round shards are built from the partitioned store (partitions.py) when it
+has a catalog. Each manifest entry records its partition and that
+partition's hash; partitions whose hash still matches keep their entries
+and are not read at all, so only rounds that changed are rebuilt.
+
+    python3 -m alphatiming.bundles
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+
+from .csvfiles import iter_rows
+from .longlaps import LONG_NAME, iter_series
+from .partitions import PartitionStore
+from .standings import STANDINGS_NAME
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BUNDLE_DIR = "bundles"
+MANIFEST = "manifest.json"
+HASH_LEN = 12
+SESSION_ORDER = ('P', 'Q', 'H1', 'H2', 'PF', 'F')
+
+
+def slug(text):
+    """'206 Mini/Cadet / T4 Mini' -> '206-mini-cadet-t4-mini'"""
+    return re.sub(r'[^a-z0-9]+', '-', text.lower()).strip('-')
+
+
+def result_fields(row):
+    """Display fields of a brkc-results.csv row."""
+    _, _, _, _, pos, kart, driver, class_code, laps, speed, gap, best, best_on, team = row
+    return {'pos': pos, 'kart': kart, 'driver': driver, 'class': class_code,
+            'laps': laps, 'speed': speed, 'gap': gap, 'best': best,
+            'best_on': best_on, 'team': team}
+
+
+def round_shards(data_dir, store=None, names=None):
+    """
+    {(class, round): shard dict} from the results CSV and the long lap
+    file, or from the named partitions of store.
+    """
+    if store is not None:
+        rows, series = store.iter_results(names), store.iter_series(names)
+    else:
+        rows = iter_rows(os.path.join(data_dir, "brkc-results.csv"))
+        series = iter_series(os.path.join(data_dir, LONG_NAME))
+    shards = {}
+
+    def session(round_name, date, class_name, session_type):
+        shard = shards.setdefault((class_name, round_name), {
+            'class': class_name, 'round': round_name, 'date': date, 'sessions': {},
+        })
+        return shard['sessions'].setdefault(session_type, {'results': [], 'laps': []})
+
+    for row in rows:
+        session(row[0], row[1], row[2], row[3])['results'].append(result_fields(row))
+    for round_name, date, class_name, session_type, driver, laps_ms in series:
+        session(round_name, date, class_name, session_type)['laps'].append(
+            {'driver': driver, 'ms': laps_ms})
+
+    for shard in shards.values():
+        shard['sessions'] = {
+            t: shard['sessions'][t]
+            for t in sorted(shard['sessions'], key=lambda t: (SESSION_ORDER + (t,)).index(t))
+        }
+    return shards
+
+
+def encode(obj):
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+class BundleWriter:
+    """Writes content-addressed shards under root and tracks them for the manifest."""
+
+    def __init__(self, root):
+        self.root = root
+        self.entries = []
+        self.written = 0
+
+    def add(self, directory, name, obj, **meta):
+        body = encode(obj)
+        digest = hashlib.sha256(body).hexdigest()
+        rel = f"{directory}/{name}.{digest[:HASH_LEN]}.json"
+        path = os.path.join(self.root, rel)
+        gz = gzip.compress(body, 9, mtime=0)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._write(path + '.gz', gz)
+            if brotli is not None:
+                self._write(path + '.br', brotli.compress(body))
+            self._write(path, body)
+            self.written += 1
+        self.entries.append(dict(meta, path=rel, hash=digest, bytes=len(body), gz_bytes=len(gz)))
+
+    @staticmethod
+    def _write(path, data):
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def prune(self):
+        """Delete shard files no longer referenced by the manifest."""
+        keep = {e['path'] for e in self.entries}
+        removed = 0
+        for dirpath, _, files in os.walk(self.root):
+            for name in files:
+                if name == MANIFEST:
+                    continue
+                rel = os.path.relpath(os.path.join(dirpath, name), self.root).replace(os.sep, '/')
+                base = re.sub(r'\.(gz|br|tmp)$', '', rel)
+                if base not in keep:
+                    os.remove(os.path.join(dirpath, name))
+                    removed += 1
+        return removed
+
+
+def kept_round_entries(root, store):
+    """Round entries of the current manifest whose partition is unchanged."""
+    try:
+        with open(os.path.join(root, MANIFEST), 'r', encoding='utf-8') as f:
+            entries = json.load(f)['shards']
+    except (OSError, ValueError, KeyError):
+        return []
+    kept, stale = [], set()
+    for e in entries:
+        partition = store.partitions.get(e.get('partition'))
+        if e['kind'] != 'round' or partition is None or partition['hash'] != e.get('source'):
+            continue
+        if os.path.exists(os.path.join(root, e['path'])):
+            kept.append(e)
+        else:
+            stale.add(e['partition'])
+    return [e for e in kept if e['partition'] not in stale]
+
+
+def write_bundles(data_dir):
+    """Rebuild data/bundles; returns (shards, shards written, files removed)."""
+    root = os.path.join(data_dir, BUNDLE_DIR)
+    writer = BundleWriter(root)
+    store = PartitionStore(data_dir)
+    if store.exists():
+        kept = kept_round_entries(root, store)
+        clean = {e['partition'] for e in kept}
+        for name in store.select():
+            if name in clean:
+                continue
+            source = store.partitions[name]['hash']
+            for (class_name, round_name), shard in sorted(round_shards(data_dir, store, [name]).items()):
+                writer.add(slug(class_name), slug(round_name), shard, kind='round',
+                           partition=name, source=source, season=store.partitions[name]['season'],
+                           **{'class': class_name, 'round': round_name})
+        writer.entries.extend(kept)
+        writer.entries.sort(key=lambda e: (e['class'], e['round'], e['season']))
+    else:
+        for (class_name, round_name), shard in sorted(round_shards(data_dir).items()):
+            writer.add(slug(class_name), slug(round_name), shard,
+                       kind='round', **{'class': class_name, 'round': round_name})
+
+    standings_path = os.path.join(data_dir, STANDINGS_NAME)
+    if os.path.exists(standings_path):
+        with open(standings_path, 'r', encoding='utf-8') as f:
+            standings = json.load(f)
+        for class_name, table in sorted(standings['classes'].items()):
+            writer.add('standings', slug(class_name),
+                       {'class': class_name, 'best_of': standings['best_of'], 'table': table},
+                       kind='standings', **{'class': class_name})
+
+    manifest = {'version': hashlib.sha256(encode(writer.entries)).hexdigest()[:HASH_LEN],
+                'shards': writer.entries}
+    os.makedirs(root, exist_ok=True)
+    BundleWriter._write(os.path.join(root, MANIFEST),
+                        json.dumps(manifest, indent=1, ensure_ascii=False).encode('utf-8') + b'\n')
+    return len(writer.entries), writer.written, writer.prune()
+
+
+def main(argv=None):
+    data_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    total, written, removed = write_bundles(data_dir)
+    print(f"{total} shards ({written} written, {removed} stale files removed) -> "
+          f"{os.path.join(data_dir, BUNDLE_DIR)}")
+    if brotli is None:
+        print("brotli is not installed; only .gz siblings were written")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,275 @@
+"""
+On-disk HTTP response cache.
+
+Entries are keyed by the SHA-256 of the URL. Each entry is a gzip-compressed
+body (<key>.gz) plus a small JSON sidecar (<key>.json) holding the status
+and the ETag / Last-Modified validators and Content-Type. A cached URL is
+revalidated with If-None-Match / If-Modified-Since, so unchanged pages from
+past rounds come back as a bodiless 304; a body served from the cache is
+decoded with the charset of its stored Content-Type.
+
+Freshness: the sidecar also records when the body last changed and when
+it was last checked (stored, or confirmed by a 304 or an identical 200).
+A page that had not changed for at least the TTL when it was checked
+belongs to a finished session, so for a TTL after that check it is served
+without any request at all. Pages that are still changing are always
+revalidated, and callers that must see every change (live polling, event
+pages) pass ttl=0.
+
+The cache is bounded by total compressed size; the least recently used
+entries (by sidecar mtime, touched on every hit) are evicted first.
+
+Environment:
+  BRKC_CACHE_DIR    cache location (default data/.cache/http)
+  BRKC_CACHE_MB     size bound in MB (default 256)
+  BRKC_CACHE_TTL    freshness lifetime of settled pages in hours (default
+                    24; 0 revalidates every page)
+  BRKC_NO_CACHE=1   bypass the cache entirely
+  BRKC_OFFLINE=1    cache-only mode, never touch the network
+"""
+
+import codecs
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+from .metrics import METRICS
+
+DEFAULT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache', 'http')
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_TTL = 24 * 3600
+
+
+class CacheMiss(LookupError):
+    """Raised in offline mode when a URL has no cached copy."""
+
+
+def charset(content_type, default='utf-8'):
+    """'text/html; charset=ISO-8859-1' -> 'iso8859-1'; default if none or unknown."""
+    for param in (content_type or '').split(';')[1:]:
+        name, _, value = param.partition('=')
+        if name.strip().lower() == 'charset':
+            try:
+                return codecs.lookup(value.strip().strip('"')).name
+            except LookupError:
+                break
+    return default
+
+
+class Response:
+    """Cached response, shaped like client.Response."""
+
+    __slots__ = ('url', 'status', 'headers', 'body', 'from_cache')
+
+    def __init__(self, url, status, headers, body, from_cache):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.from_cache = from_cache
+
+    @property
+    def text(self):
+        return self.body.decode(charset(self.headers.get('content-type')), errors='replace')
+
+
+class HTTPCache:
+    def __init__(self, root=DEFAULT_DIR, max_bytes=DEFAULT_MAX_BYTES, offline=False, ttl=DEFAULT_TTL):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._size = None
+
+    @staticmethod
+    def key(url):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.root, key[:2], key)
+        return base + '.gz', base + '.json'
+
+    def lookup(self, url):
+        """Return (meta, body) for a cached URL, or (None, None)."""
+        body_path, meta_path = self._paths(self.key(url))
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            with open(body_path, 'rb') as f:
+                body = gzip.decompress(f.read())
+        except (OSError, ValueError, EOFError):
+            return None, None
+        if meta.get('url') != url:
+            return None, None
+        return meta, body
+
+    def touch(self, url):
+        _, meta_path = self._paths(self.key(url))
+        try:
+            os.utime(meta_path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def fresh(meta, ttl, now=None):
+        """True while a settled entry may be served without revalidating it."""
+        if not ttl:
+            return False
+        checked = meta.get('checked', meta.get('fetched', 0))
+        changed = meta.get('changed', meta.get('fetched', 0))
+        now = time.time() if now is None else now
+        return checked - changed >= ttl and now - checked < ttl
+
+    def checked(self, url, meta):
+        """Record that the cached body of url is still current (also a touch)."""
+        _, meta_path = self._paths(self.key(url))
+        meta = dict(meta, changed=meta.get('changed', meta.get('fetched')), checked=time.time())
+        tmp = f"{meta_path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            os.replace(tmp, meta_path)
+        except OSError:
+            pass
+
+    def store(self, url, status, headers, body, changed=None):
+        """Cache a response; changed is when this body was first seen (default now)."""
+        key = self.key(url)
+        body_path, meta_path = self._paths(key)
+        os.makedirs(os.path.dirname(body_path), exist_ok=True)
+        packed = gzip.compress(body, compresslevel=6)
+        now = time.time()
+        meta = {
+            'url': url,
+            'status': status,
+            'etag': headers.get('etag'),
+            'last_modified': headers.get('last-modified'),
+            'content_type': headers.get('content-type'),
+            'fetched': now,
+            'checked': now,
+            'changed': changed or now,
+            'size': len(packed),
+        }
+        with self._lock:
+            total = self._total_size()
+            old = self._entry_size(body_path)
+            # Write to temp names then rename so a crash never leaves a
+            # body that does not match its validators.
+            tmp_body, tmp_meta = body_path + '.tmp', meta_path + '.tmp'
+            with open(tmp_body, 'wb') as f:
+                f.write(packed)
+            with open(tmp_meta, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            os.replace(tmp_body, body_path)
+            os.replace(tmp_meta, meta_path)
+            self._size = total - old + len(packed)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entry_size(self, body_path):
+        try:
+            return os.path.getsize(body_path)
+        except OSError:
+            return 0
+
+    def _entries(self):
+        if not os.path.isdir(self.root):
+            return
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith('.json'):
+                    body_path = entry.path[:-5] + '.gz'
+                    yield entry.stat().st_mtime, entry.path, body_path, self._entry_size(body_path)
+
+    def _total_size(self):
+        if self._size is None:
+            self._size = sum(size for _, _, _, size in self._entries())
+        return self._size
+
+    def _evict(self):
+        # Drop least recently used entries until we are at 90% of the
+        # bound, so eviction does not run again on the very next store.
+        target = self.max_bytes * 0.9
+        for _, meta_path, body_path, size in sorted(self._entries()):
+            if self._size <= target:
+                break
+            for path in (meta_path, body_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._size -= size
+
+    def get(self, client, url, ttl=None):
+        """
+        Fetch url through the cache using client (a client.HTTPClient).
+        A fresh entry (see fresh; ttl defaults to the cache's) is served
+        without a request.
+
+        Offline mode raises CacheMiss for URLs that are not cached.
+        """
+        meta, body = self.lookup(url)
+        if self.offline or (meta is not None and self.fresh(meta, self.ttl if ttl is None else ttl)):
+            if meta is None:
+                METRICS.inc('cache_misses')
+                raise CacheMiss(url)
+            METRICS.inc('cache_hits')
+            self.touch(url)
+            return Response(url, meta['status'], cached_headers(meta), body, True)
+
+        headers = {}
+        if meta is not None:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        resp = client.get(url, headers=headers)
+        if resp.status == 304 and meta is not None:
+            METRICS.inc('cache_hits')
+            self.checked(url, meta)
+            return Response(url, meta['status'], cached_headers(meta, resp.headers), body, True)
+        METRICS.inc('cache_misses')
+        if resp.status == 200:
+            # A server without validators sends the same page again in full
+            unchanged = meta is not None and resp.body == body
+            self.store(url, resp.status, resp.headers, resp.body,
+                       meta.get('changed', meta.get('fetched')) if unchanged else None)
+        return Response(url, resp.status, resp.headers, resp.body, False)
+
+
+def cached_headers(meta, headers=None):
+    """Headers for a body served from the cache: its own Content-Type wins."""
+    headers = dict(headers or {})
+    if meta.get('content_type'):
+        headers['content-type'] = meta['content_type']
+    return headers
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def default_cache():
+    """
+    Process-wide cache configured from the environment, or None when
+    BRKC_NO_CACHE is set.
+    """
+    global _default_cache
+    if os.environ.get('BRKC_NO_CACHE') == '1':
+        return None
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = HTTPCache(
+                root=os.environ.get('BRKC_CACHE_DIR', DEFAULT_DIR),
+                max_bytes=int(float(os.environ.get('BRKC_CACHE_MB', 256)) * 1024 * 1024),
+                offline=os.environ.get('BRKC_OFFLINE') == '1',
+                ttl=float(os.environ.get('BRKC_CACHE_TTL', DEFAULT_TTL / 3600)) * 3600,
+            )
+        return _default_cache
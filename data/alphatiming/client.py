@@ -0,0 +1,230 @@
+"""
+Keep-alive HTTP client for results.alphatiming.co.uk.
+
+Replaces the old one-`curl`-process-per-page fetch. Connections are pooled
+per host and reused between requests, responses are requested with
+gzip/deflate compression and decoded here, and redirects are followed the
+same way `curl -L` did.
+"""
+
+import http.client
+import threading
+import time
+import zlib
+from urllib.parse import urljoin, urlsplit
+
+from . import UA, retry
+from .cache import CacheMiss, charset, default_cache
+from .metrics import METRICS
+from .retry import FetchError, check_status
+
+MAX_REDIRECTS = 5
+
+# Errors that mean a pooled keep-alive connection was closed by the server
+# while it sat idle. The request is retried once on a fresh connection.
+STALE_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    ConnectionResetError,
+    BrokenPipeError,
+)
+
+
+def url_tab(url):
+    """'result', 'laptimes' or 'event': the page kind, for metrics."""
+    tab = urlsplit(url).path.rstrip('/').rsplit('/', 1)[-1]
+    return tab if tab in ('result', 'laptimes') else 'event'
+
+
+class Response:
+    """A fully read HTTP response."""
+
+    __slots__ = ('url', 'status', 'headers', 'body')
+
+    def __init__(self, url, status, headers, body):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    @property
+    def text(self):
+        return self.body.decode(charset(self.headers.get('content-type')), errors='replace')
+
+
+def decode_body(body, encoding):
+    """Undo Content-Encoding gzip/deflate."""
+    encoding = (encoding or '').strip().lower()
+    if encoding in ('gzip', 'x-gzip'):
+        return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        try:
+            return zlib.decompress(body)
+        except zlib.error:
+            # Some servers send raw deflate without the zlib header
+            return zlib.decompress(body, -zlib.MAX_WBITS)
+    return body
+
+
+class HTTPClient:
+    """
+    Thread-safe HTTP client with a per-host keep-alive connection pool.
+
+    connect_timeout bounds the TCP/TLS handshake, timeout bounds each read.
+    At most max_idle connections per host are kept open between requests.
+    """
+
+    def __init__(self, user_agent=UA, timeout=30, connect_timeout=10, max_idle=8):
+        self.user_agent = user_agent
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _checkout(self, scheme, netloc):
+        key = (scheme, netloc)
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(netloc, timeout=self.connect_timeout)
+        else:
+            conn = http.client.HTTPConnection(netloc, timeout=self.connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(self.timeout)
+        return conn, False
+
+    def _checkin(self, scheme, netloc, conn):
+        key = (scheme, netloc)
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def _request(self, url, headers):
+        parts = urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        req_headers = {
+            'User-Agent': self.user_agent,
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive',
+        }
+        if headers:
+            req_headers.update(headers)
+
+        started = time.perf_counter()
+        conn, reused = self._checkout(parts.scheme, parts.netloc)
+        try:
+            conn.request('GET', path, headers=req_headers)
+            resp = conn.getresponse()
+            body = resp.read()
+        except STALE_ERRORS:
+            conn.close()
+            if not reused:
+                raise
+            METRICS.inc('http_retries')
+            conn, _ = self._checkout_fresh(parts.scheme, parts.netloc)
+            try:
+                conn.request('GET', path, headers=req_headers)
+                resp = conn.getresponse()
+                body = resp.read()
+            except Exception:
+                conn.close()
+                raise
+        except Exception:
+            conn.close()
+            raise
+
+        resp_headers = {k.lower(): v for k, v in resp.getheaders()}
+        if resp.will_close:
+            conn.close()
+        else:
+            self._checkin(parts.scheme, parts.netloc, conn)
+
+        METRICS.observe('http_request_seconds', time.perf_counter() - started, url_tab(url))
+        METRICS.inc('http_requests')
+        METRICS.inc('http_bytes', len(body))
+        body = decode_body(body, resp_headers.get('content-encoding'))
+        METRICS.inc('http_bytes_decoded', len(body))
+        return Response(url, resp.status, resp_headers, body)
+
+    def _checkout_fresh(self, scheme, netloc):
+        # Drop every idle connection to this host; if one went stale the
+        # rest were most likely closed by the same server-side timeout.
+        with self._lock:
+            for conn in self._idle.pop((scheme, netloc), []):
+                conn.close()
+        return self._checkout(scheme, netloc)
+
+    def get(self, url, headers=None):
+        """GET url, following redirects. Returns a Response."""
+        for _ in range(MAX_REDIRECTS + 1):
+            resp = self._request(url, headers)
+            if resp.status in (301, 302, 303, 307, 308) and 'location' in resp.headers:
+                url = urljoin(url, resp.headers['location'])
+                continue
+            return resp
+        raise http.client.HTTPException(f"Too many redirects fetching {url}")
+
+    def close(self):
+        with self._lock:
+            pools = list(self._idle.values())
+            self._idle.clear()
+        for idle in pools:
+            for conn in idle:
+                conn.close()
+
+
+_default_client = None
+_default_lock = threading.Lock()
+
+
+def default_client():
+    """Process-wide shared client used by fetch_url."""
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = HTTPClient()
+        return _default_client
+
+
+def fetch_url(url, ttl=None):
+    """
+    Fetch a page and return its body as text.
+
+    Goes through the on-disk response cache unless BRKC_NO_CACHE=1; ttl
+    overrides the cache's freshness lifetime (0: always revalidate).
+    Failures are retried under the host's circuit breaker and concurrency
+    limit (see retry.py); a page that still cannot be had, a non-2xx
+    status included, raises FetchError instead of coming back empty.
+    """
+    cache = default_cache()
+
+    def request():
+        try:
+            if cache is None:
+                resp = default_client().get(url)
+            else:
+                resp = cache.get(default_client(), url, ttl)
+        except CacheMiss:
+            raise FetchError('offline', url, "not in the cache") from None
+        return check_status(resp).text
+
+    try:
+        return retry.call(request, url)
+    except FetchError as err:
+        METRICS.inc('fetch_errors')
+        METRICS.inc(f'fetch_errors_{err.kind}')
+        raise
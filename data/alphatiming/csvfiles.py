@@ -0,0 +1,172 @@
+"""
+Column layout of brkc-results.csv and brkc-laptimes.csv.
+
+A session is the (round, date, event_id, session_id, class, session_type)
+tuple used in the scrapers' SESSIONS lists. Rows in both CSVs are
+identified by their Round, Class and Session columns (session_key() and
+row_key()). Dates are left out because some were corrected by hand in the
+CSVs after scraping.
+
+The site serves these files as they are, so they are never written in
+place. atomic_write() writes a temp file next to the target and renames
+it over the target only once it is complete, so readers see the old file
+or the new one, never a torn one. staged_append() does the same for new
+rows at the end: the temp file starts as a byte copy of the target.
+"""
+
+import csv
+import io
+import os
+import re
+from contextlib import contextmanager
+
+RESULTS_HEADER = ['Round', 'Date', 'Class', 'Session', 'Pos', 'Kart#',
+                  'Driver', 'Class Code', 'Laps', 'Avg Speed', 'Gap',
+                  'Best Lap', 'Best On Lap', 'Team']
+LAPTIMES_PREFIX = ['Round', 'Date', 'Class', 'Session', 'Driver']
+
+
+def session_key(session):
+    """(round, class, session_type) for a SESSIONS tuple."""
+    round_name, _, _, _, class_name, session_type = session
+    return (round_name, class_name, session_type)
+
+
+def row_key(row):
+    """(round, class, session_type) for a row of either CSV."""
+    return (row[0], row[2], row[3])
+
+
+def round_no(round_name):
+    """'Round 4' -> 4; 0 when the name has no number."""
+    m = re.search(r'\d+', round_name)
+    return int(m.group()) if m else 0
+
+
+def csv_writer(f):
+    """csv.writer with the plain \\n line endings the committed CSVs use."""
+    return csv.writer(f, lineterminator='\n')
+
+
+@contextmanager
+def atomic_write(path):
+    """
+    Open path for writing (text, utf-8, newline='') via path + '.tmp'.
+    The temp file replaces path when the block exits normally and is
+    removed if it raises, so readers see the old file or the new one.
+    """
+    tmp = path + '.tmp'
+    f = open(tmp, 'w', newline='', encoding='utf-8')
+    try:
+        with f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def _whole_lines(f):
+    """Length of binary file f up to and including its last newline."""
+    end = f.seek(0, os.SEEK_END)
+    while end:
+        start = max(0, end - 65536)
+        f.seek(start)
+        i = f.read(end - start).rfind(b'\n')
+        if i >= 0:
+            return start + i + 1
+        end = start
+    return 0
+
+
+@contextmanager
+def staged_append(path, header):
+    """
+    atomic_write() for adding rows at the end of path: the temp file is
+    first filled with a byte copy of path (or header, if it has no rows
+    yet), and the block writes after that. A last line without its
+    newline, left by a writer that did not use these helpers, is not
+    copied.
+    """
+    with atomic_write(path) as dst:
+        try:
+            src = open(path, 'rb')
+        except FileNotFoundError:
+            src = None
+        size = 0
+        if src is not None:
+            with src:
+                size = _whole_lines(src)
+                src.seek(0)
+                left = size
+                while left:
+                    chunk = src.read(min(left, 1 << 20))
+                    dst.buffer.write(chunk)
+                    left -= len(chunk)
+        if not size:
+            csv_writer(dst).writerow(header)
+        yield dst
+
+
+def laptimes_header(max_laps):
+    return LAPTIMES_PREFIX + [f'L{i+1}' for i in range(max_laps)]
+
+
+def result_row(session, d):
+    """CSV row for one parsed result dict."""
+    round_name, date, _, _, class_name, session_type = session
+    return [
+        round_name, date, class_name, session_type, d.get('pos'), d.get('no'),
+        d.get('name'), d.get('cls'), d.get('laps'), d.get('avg_speed'),
+        d.get('gap'), d.get('best'), d.get('best_on'), d.get('team'),
+    ]
+
+
+def format_lap(ms):
+    """72495 -> '1:12.495'; 0 -> ''"""
+    if ms <= 0:
+        return ''
+    mins, rem = divmod(ms, 60000)
+    return f"{mins}:{rem // 1000:02d}.{rem % 1000:03d}"
+
+
+def parse_lap(text):
+    """'1:12.495' or '72.495' -> 72495; '' -> 0"""
+    if not text:
+        return 0
+    mins, _, secs = text.rpartition(':')
+    return int(mins or 0) * 60000 + round(float(secs) * 1000)
+
+
+def read_rows(path):
+    """Return (header, rows) of a CSV, or (None, []) if it does not exist."""
+    try:
+        with open(path, 'r', newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            return header, list(reader)
+    except FileNotFoundError:
+        return None, []
+
+
+def iter_rows(path, offset=0):
+    """
+    Stream the rows of a CSV after its header; nothing if it does not
+    exist. With offset, start at that byte offset (the end of an earlier
+    read) instead.
+    """
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return
+    with f:
+        f.seek(offset)
+        reader = csv.reader(io.TextIOWrapper(f, encoding='utf-8', newline=''))
+        if not offset:
+            next(reader, None)
+        yield from reader
@@ -0,0 +1,172 @@
+"""
+Session discovery: build SESSIONS lists by crawling event pages.
+
+Events are listed in data/brkc-events.csv (Round, Date, Event, Types). An
+empty Types column takes every session of the event; otherwise it is a
+space-separated list of session types to keep (e.g. "P" for a practice
+day). Event pages are fetched concurrently through the shared client and
+cache, and sessions are pulled out with the same line rules as
+extract-sessions.awk: a line linking to /s/<id> sets the id, and the line
+after an at-session-list-name marker holds the session name.
+
+Each name is classified into P / Q / H1 / H2 / PF / F, and the class is
+what is left of the name once the session words are removed. Sessions
+whose type cannot be worked out are left out.
+
+The discovered catalog is cached in data/.cache/catalog.json, so a past
+event is only crawled once; pass refresh=True (or --refresh) to crawl
+again, e.g. while an event is still running, or a set of event ids to
+crawl just those again.
+
+    python3 -m alphatiming.discover [--refresh] [EVENT_ID ...]
+"""
+
+import csv
+import json
+import os
+import re
+import sys
+
+from .client import fetch_url
+from .fetch import fetch_pages
+from .retry import FetchError
+
+DATA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EVENTS_FILE = os.path.join(DATA_DIR, "brkc-events.csv")
+CATALOG_FILE = os.path.join(DATA_DIR, ".cache", "catalog.json")
+
+_SESSION_HREF = re.compile(r'href=.*/s/[0-9]+')
+_SESSION_ID = re.compile(r'/s/([0-9]+)')
+
+# Checked in order: "Pre-Final" must win over "Final", "Heat 2" over "Heat"
+SESSION_TYPES = [
+    ('PF', re.compile(r'\bpre[- ]?finals?\b', re.I)),
+    ('H', re.compile(r'\bheat\s*(\d+)\b', re.I)),
+    ('H', re.compile(r'\bh(\d)\b', re.I)),
+    ('F', re.compile(r'\bfinals?\b', re.I)),
+    ('Q', re.compile(r'\bqual(?:i|ifying|ification)?\b', re.I)),
+    ('P', re.compile(r'\b(?:practice|warm[- ]?up)\b(?:\s*\d+[a-z]?)?', re.I)),
+]
+
+
+def extract_sessions(html):
+    """[(session_id, name), ...] from an event page, as extract-sessions.awk does."""
+    sessions = []
+    session_id = ''
+    lines = html.splitlines()
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if _SESSION_HREF.search(line):
+            session_id = _SESSION_ID.search(line).group(1)
+        if 'at-session-list-name' in line:
+            i += 1
+            name = lines[i].strip() if i < len(lines) else ''
+            if session_id and name:
+                sessions.append((int(session_id), name))
+                session_id = ''
+        i += 1
+    return sessions
+
+
+def classify(name):
+    """'T4 Junior Heat 1' -> ('T4 Junior', 'H1'); unknown -> (name, None)"""
+    for stype, pattern in SESSION_TYPES:
+        m = pattern.search(name)
+        if m:
+            if stype == 'H':
+                stype = f'H{m.group(1)}'
+            class_name = (name[:m.start()] + name[m.end():]).strip(' -:')
+            return ' '.join(class_name.split()), stype
+    return name, None
+
+
+def read_events(path=EVENTS_FILE):
+    """[(round, date, event_id, types or None), ...] from brkc-events.csv"""
+    with open(path, 'r', newline='', encoding='utf-8') as f:
+        return [
+            (row['Round'], row['Date'], int(row['Event']),
+             set(row['Types'].split()) or None)
+            for row in csv.DictReader(f)
+        ]
+
+
+def event_url(event_id):
+    from . import BASE
+    return f"{BASE}/{event_id}"
+
+
+def load_catalog(path=CATALOG_FILE):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_catalog(catalog, path=CATALOG_FILE):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(catalog, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def _event_page(url):
+    # An event page that cannot be fetched keeps its cached catalog entry.
+    # It is only crawled to pick up new sessions, so it is always revalidated
+    try:
+        return fetch_url(url, ttl=0)
+    except FetchError as exc:
+        print(f"warning: {exc}", file=sys.stderr)
+        return ''
+
+
+def discover(events=None, refresh=False, catalog_path=CATALOG_FILE):
+    """
+    Return a SESSIONS list of (round, date, event_id, session_id, class,
+    session_type) for the given events (default: brkc-events.csv), in
+    event order and page order within each event.
+    """
+    if events is None:
+        events = read_events()
+    catalog = load_catalog(catalog_path)
+
+    to_crawl = sorted({
+        e[2] for e in events
+        if str(e[2]) not in catalog or refresh is True or (refresh and e[2] in refresh)
+    })
+    if to_crawl:
+        pages = fetch_pages([event_url(event_id) for event_id in to_crawl], fetch=_event_page)
+        for event_id, html in zip(to_crawl, pages):
+            found = extract_sessions(html)
+            if found:
+                catalog[str(event_id)] = found
+        save_catalog(catalog, catalog_path)
+
+    sessions = []
+    seen = set()
+    for round_name, date, event_id, types in events:
+        for session_id, name in catalog.get(str(event_id), []):
+            class_name, stype = classify(name)
+            if stype is None or (types and stype not in types) or session_id in seen:
+                continue
+            seen.add(session_id)
+            sessions.append((round_name, date, event_id, session_id, class_name, stype))
+    return sessions
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    refresh = '--refresh' in argv
+    ids = {int(a) for a in argv if a.isdigit()}
+    events = read_events()
+    if ids:
+        events = [e for e in events if e[2] in ids]
+    for session in discover(events, refresh=refresh):
+        print(session)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
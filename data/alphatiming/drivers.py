@@ -0,0 +1,297 @@
+"""
+Driver identities: one id per driver across results and laptimes.
+
+Result pages name drivers in a table cell, the laptimes chart in its
+dataset labels, and the two do not always agree (case, spacing,
+punctuation, the odd misspelling). Every name is reduced to a key by
+normalize() - accents, case, apostrophes and dots dropped, whitespace
+collapsed - and keys are mapped to driver ids. Known misspellings are
+listed in data/brkc-aliases.csv (Alias, Driver), which points the alias's
+key at the driver's id.
+
+A trigram index over the keys is kept up to date as drivers are added, so
+candidates() finds close spellings by scoring only the drivers that share
+a trigram with the name, not the whole field.
+
+join() hash-joins brkc-results.csv to the lap store, read as
+model.ResultRow and model.LapSeries records: the result rows are put in a
+dict by (round, class, session, driver id), and each lap series then
+looks up its row in O(1). Result pages list the overall order (with
+class codes) and then each class again (without them); when a session has
+coded rows only those are used. A driver with more than one row under the
+same key (two practice sessions of a class on one day) is paired in file
+order. Lap series left unmatched within a session are paired with the
+unmatched result rows that are similar enough. That pairing holds for
+the session only: the spelling is not added to the index (a close name
+may be another driver), but kept in `proposed` as {alias: driver}, the
+layout of brkc-aliases.csv, for someone to review. Every joined
+DriverSession is indexed by driver, so a driver's season is one dict
+lookup; it is kept in (date, round) order.
+
+    python3 -m alphatiming.drivers                # drivers and session counts
+    python3 -m alphatiming.drivers NAME           # one driver's season
+    python3 -m alphatiming.drivers --duplicates   # similar names worth an alias
+    python3 -m alphatiming.drivers --proposed     # lap-chart spellings paired by similarity
+"""
+
+import argparse
+import csv
+import os
+import sys
+import unicodedata
+from array import array
+from collections import Counter, defaultdict
+
+from .csvfiles import format_lap, round_no
+from .lapstore import open_store
+from .model import Loader
+
+ALIASES_NAME = "brkc-aliases.csv"
+RESULTS_NAME = "brkc-results.csv"
+
+# Jaccard similarity of trigram sets
+CANDIDATE_THRESHOLD = 0.4
+MATCH_THRESHOLD = 0.5
+
+
+def normalize(name):
+    """'  Clay  O'Brien ' -> 'clay obrien'"""
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(c for c in name if not unicodedata.combining(c))
+    name = name.lower().replace("'", '').replace('’', '').replace('.', '')
+    name = name.replace('-', ' ')
+    return ' '.join(name.split())
+
+
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def read_aliases(path):
+    """{alias: driver} from brkc-aliases.csv; {} if there is none."""
+    try:
+        with open(path, 'r', newline='', encoding='utf-8') as f:
+            return {row['Alias']: row['Driver'] for row in csv.DictReader(f)}
+    except FileNotFoundError:
+        return {}
+
+
+def season_order(ds):
+    return (ds.date, round_no(ds.round))
+
+
+class DriverSession:
+    """
+    One driver in one session: their result (a model.ResultRow, None when
+    they only appear in the lap chart) joined to their laps.
+    """
+
+    __slots__ = ('info', 'driver', 'driver_id', 'result', 'laps')
+
+    def __init__(self, info, driver, driver_id, result=None, laps=None):
+        self.info = info
+        self.driver = driver
+        self.driver_id = driver_id
+        self.result = result
+        self.laps = laps if laps is not None else array('i')
+
+    round = property(lambda self: self.info.round)
+    date = property(lambda self: self.info.date)
+    class_name = property(lambda self: self.info.class_name)
+    session = property(lambda self: self.info.session_type)
+    key = property(lambda self: self.info.key)
+    pos = property(lambda self: self.result.pos if self.result else 0)
+    status = property(lambda self: self.result.status if self.result else '')
+    kart = property(lambda self: self.result.kart if self.result else '')
+    class_code = property(lambda self: self.result.class_code if self.result else '')
+    team = property(lambda self: self.result.team if self.result else '')
+
+    def __repr__(self):
+        return (f"DriverSession({self.round!r}, {self.class_name!r}, {self.session!r}, "
+                f"{self.driver!r}, pos={self.pos or self.status!r}, laps={len(self.laps)})")
+
+
+class DriverIndex:
+    def __init__(self, aliases=None):
+        self.ids = {}          # normalized key -> driver id
+        self.names = []        # driver id -> display name
+        self.keys = []         # driver id -> its own key
+        self.grams = {}        # trigram -> {driver id, ...}
+        self.seasons = []      # driver id -> [DriverSession, ...]
+        self.sessions = defaultdict(list)   # (round, class, session) -> [DriverSession, ...]
+        self.proposed = {}     # lap-chart spelling -> driver name, from join()
+        for alias, driver in (aliases or {}).items():
+            self.alias(alias, self.add(driver))
+
+    def __len__(self):
+        return len(self.names)
+
+    def resolve(self, name):
+        """Driver id for name, or None."""
+        return self.ids.get(normalize(name))
+
+    def add(self, name):
+        """Driver id for name, adding a new driver if it is not known."""
+        key = normalize(name)
+        driver_id = self.ids.get(key)
+        if driver_id is None:
+            driver_id = self.ids[key] = len(self.names)
+            self.names.append(name)
+            self.keys.append(key)
+            self.seasons.append([])
+            for gram in trigrams(key):
+                self.grams.setdefault(gram, set()).add(driver_id)
+        return driver_id
+
+    def alias(self, name, driver_id):
+        self.ids[normalize(name)] = driver_id
+
+    def candidates(self, name, limit=5, threshold=CANDIDATE_THRESHOLD):
+        """[(similarity, driver id), ...] for the drivers closest to name."""
+        query = trigrams(normalize(name))
+        shared = Counter()
+        for gram in query:
+            for driver_id in self.grams.get(gram, ()):
+                shared[driver_id] += 1
+        scored = []
+        for driver_id, n in shared.items():
+            score = n / (len(query) + len(trigrams(self.keys[driver_id])) - n)
+            if score >= threshold:
+                scored.append((score, driver_id))
+        scored.sort(key=lambda s: (-s[0], s[1]))
+        return scored[:limit]
+
+    def history(self, name):
+        """A driver's DriverSessions by date and round; [] if unknown."""
+        driver_id = self.resolve(name)
+        return self.seasons[driver_id] if driver_id is not None else []
+
+    def duplicates(self, threshold=MATCH_THRESHOLD):
+        """[(similarity, name, name), ...] of distinct drivers with close names."""
+        pairs = []
+        for driver_id, key in enumerate(self.keys):
+            for score, other in self.candidates(key, limit=None, threshold=threshold):
+                if other > driver_id:
+                    pairs.append((score, self.names[driver_id], self.names[other]))
+        return sorted(pairs, reverse=True)
+
+    def _record(self, ds):
+        self.seasons[ds.driver_id].append(ds)
+        self.sessions[ds.key].append(ds)
+        return ds
+
+    def join(self, results, series):
+        """
+        Join model.ResultRows to model.LapSeries. Returns the
+        DriverSessions in file order: results first, then lap series that
+        had no result.
+        """
+        results = list(results)
+        coded = {r.session.key for r in results if r.class_code}
+        build = defaultdict(list)
+        by_key = defaultdict(list)
+        rows = []
+        for r in results:
+            key = r.session.key
+            if key in coded and not r.class_code:
+                continue
+            ds = DriverSession(r.session, r.driver, self.add(r.driver), result=r)
+            build[(*key, ds.driver_id)].append(ds)
+            by_key[key].append(ds)
+            rows.append(ds)
+
+        matched = set()
+        unmatched = defaultdict(list)
+        for s in series:
+            key = s.session.key
+            driver_id = self.resolve(s.driver)
+            waiting = build.get((*key, driver_id)) if driver_id is not None else None
+            if waiting:
+                ds = waiting.pop(0)
+                ds.laps = s.laps
+                matched.add(id(ds))
+            else:
+                unmatched[key].append(s)
+
+        extra = []
+        for key, pending in unmatched.items():
+            open_rows = [ds for ds in by_key[key] if id(ds) not in matched]
+            for s in pending:
+                best = None
+                for ds in open_rows:
+                    a, b = trigrams(normalize(s.driver)), trigrams(self.keys[ds.driver_id])
+                    score = len(a & b) / len(a | b)
+                    if score >= MATCH_THRESHOLD and (best is None or score > best[0]):
+                        best = (score, ds)
+                if best is not None:
+                    ds = best[1]
+                    open_rows.remove(ds)
+                    self.proposed[s.driver] = self.names[ds.driver_id]
+                    ds.laps = s.laps
+                    continue
+                extra.append(DriverSession(s.session, s.driver, self.add(s.driver), laps=s.laps))
+
+        joined = [self._record(ds) for ds in rows + extra]
+        for driver_id in {ds.driver_id for ds in joined}:
+            self.seasons[driver_id].sort(key=season_order)
+        return joined
+
+
+def load(data_dir):
+    """DriverIndex of data_dir with its results and laps joined."""
+    index = DriverIndex(read_aliases(os.path.join(data_dir, ALIASES_NAME)))
+    loader = Loader()
+    store = open_store(data_dir)
+    index.join(loader.results(os.path.join(data_dir, RESULTS_NAME)),
+               (loader.series(*fields) for fields in store))
+    return index
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog='python3 -m alphatiming.drivers')
+    ap.add_argument('name', nargs='*', help="driver to show")
+    ap.add_argument('--duplicates', action='store_true',
+                    help="list distinct drivers whose names are close")
+    ap.add_argument('--proposed', action='store_true',
+                    help="list lap-chart spellings paired with a result by similarity")
+    args = ap.parse_args(argv)
+
+    data_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    index = load(data_dir)
+
+    if args.duplicates:
+        for score, a, b in index.duplicates():
+            print(f"  {score:.2f}  {a}  /  {b}")
+        return 0
+
+    if args.proposed:
+        # Ready to paste into brkc-aliases.csv once checked
+        writer = csv.writer(sys.stdout)
+        writer.writerow(['Alias', 'Driver'])
+        writer.writerows(sorted(index.proposed.items()))
+        return 0
+
+    if not args.name:
+        for driver_id, name in sorted(enumerate(index.names), key=lambda d: d[1].lower()):
+            print(f"  {name:30s} {len(index.seasons[driver_id]):3d} sessions")
+        return 0
+
+    name = ' '.join(args.name)
+    season = index.history(name)
+    if not season:
+        print(f"No driver {name!r}", file=sys.stderr)
+        for score, driver_id in index.candidates(name):
+            print(f"  did you mean {index.names[driver_id]!r}? ({score:.2f})", file=sys.stderr)
+        return 1
+    for ds in season:
+        timed = [ms for ms in ds.laps if ms > 0]
+        best = format_lap(min(timed)) if timed else ''
+        pos = f"P{ds.pos}" if ds.pos else ds.status or '-'
+        print(f"  {ds.round:8s} {ds.class_name:28s} {ds.session:3s} {pos:5s}"
+              f" #{ds.kart:4s} {ds.class_code:8s} {len(ds.laps):3d} laps {best:>8s}  {ds.team}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
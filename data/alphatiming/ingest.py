@@ -0,0 +1,392 @@
+"""
+Incremental, idempotent ingest into the BRKC CSVs.
+
+data/brkc-manifest.json records every session that has been ingested:
+
+    { "<session_id>": {"event_id": ..., "round": ..., "date": ...,
+                       "class": ..., "session_type": ...,
+                       "hash": <sha256 of the parsed rows or null>,
+                       "results": <row count>, "laptimes": <row count>,
+                       "fetched": <unix time>} }
+
+Sessions already in the manifest are not fetched again, so re-running a
+scraper is a no-op and adding a session costs one fetch plus its rows at
+the end of each CSV. Sessions that came back empty are recorded too (with
+zero rows) so they are not retried on every run.
+
+Parsed rows are spooled to an unnamed temp file as sessions arrive and
+only read back, one row at a time, by commit(), so memory stays flat
+however many sessions a run has. The CSVs are served as they are, so
+they are never written in place: each is staged in a temp file that is
+renamed over it once complete and fsynced (csvfiles.atomic_write). When
+a commit only adds sessions the old file is byte-copied ahead of the new
+rows (csvfiles.staged_append); only when a changed session's old rows
+must go are its rows parsed and filtered. Readers see the old file or
+the new one, and a crash never leaves a half-written CSV.
+
+Lap times are added to the long lap file (brkc-laptimes-long.csv, see
+longlaps.py). The wide brkc-laptimes.csv is not touched; regenerate it
+with `python3 -m alphatiming.longlaps wide` when it is needed.
+
+With rebuild=True the season is ingested from scratch into a staging
+directory (data/.cache/rebuild/) while the served files stay as they
+are; commit() moves the new results and long lap file over them, and the
+new manifest last. A rebuild that is abandoned (discard(), or the
+process stopping) leaves the served files untouched.
+
+The partitioned store (partitions.py, data/brkc/<season>/round-NN/) is
+kept in step: only the partitions that new or changed sessions fall in
+are rewritten. It is split from the CSVs when it has no catalog yet, or
+when the CSVs were started over.
+
+When the optional SQLite backend is enabled (sqlstore.py), every ingested
+session is also upserted there.
+
+With refresh=True (BRKC_REFRESH=1) every session is fetched again. Rows are
+only rewritten for sessions whose content hash changed; all other sessions
+are left alone. Rows carry no session id, so a changed session's old rows
+are dropped by (round, class, session) key, and that key is not unique
+(a class can have two practices in a round). Every other session sharing
+the key is re-added from the same batch; if any of them is not in the
+batch (its fetch failed, or it was not selected), the change is deferred
+instead: nothing under the key is touched and the session keeps its old
+manifest entry, so the next refresh tries again.
+
+commit() writes the results, the long lap file, the partitions and the
+SQLite store first and saves the manifest last, so a session is only
+recorded once all of its rows are on disk. Rows carry no session id, so
+when a session is missing from the manifest (a first run over existing
+CSVs, or a commit that failed part way) its key is looked up in the
+files. If no recorded session has that key, a session found in both the
+results and the long lap file is recorded as ingested with an unknown
+hash (and the partitions are split again in case they missed it). A
+session found in only one of them, or a key holding more rows than its
+recorded sessions account for, was written in part: every session under
+the key is fetched again and written as changed, replacing those rows.
+"""
+
+import csv
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from collections import Counter
+from itertools import groupby
+
+from .csvfiles import (
+    RESULTS_HEADER, atomic_write, csv_writer, iter_rows, parse_lap, result_row, row_key,
+    session_key, staged_append,
+)
+from . import sqlstore
+from .longlaps import LONG_NAME, append_series, ensure_long, iter_series
+from .metrics import METRICS
+from .partitions import PartitionStore, partition_of
+
+MANIFEST_NAME = "brkc-manifest.json"
+RESULTS_NAME = "brkc-results.csv"
+REBUILD_DIR = os.path.join(".cache", "rebuild")
+
+
+def content_hash(drivers, lt_data):
+    """Stable hash of a session's parsed results and lap times."""
+    payload = json.dumps([drivers, lt_data], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class Manifest:
+    def __init__(self, path):
+        self.path = path
+        self.sessions = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.sessions = json.load(f)
+
+    def __contains__(self, session_id):
+        return str(session_id) in self.sessions
+
+    def get(self, session_id):
+        return self.sessions.get(str(session_id))
+
+    def record(self, session, digest, results, laptimes, fetched=None):
+        round_name, date, event_id, session_id, class_name, session_type = session
+        self.sessions[str(session_id)] = {
+            'event_id': event_id, 'round': round_name, 'date': date,
+            'class': class_name, 'session_type': session_type,
+            'hash': digest, 'results': results, 'laptimes': laptimes,
+            'fetched': fetched if fetched is not None else int(time.time()),
+        }
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.sessions, f, indent=1, sort_keys=True)
+            f.write('\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+
+class Ingest:
+    """
+    Collects parsed sessions and writes them to the CSVs on commit().
+
+    Typical use (this is what Pipeline.run does, see pipeline.py):
+
+        ingest = Ingest(data_dir)
+        for session in ingest.pending(SESSIONS):
+            ...fetch and parse...
+            ingest.add(session, drivers, lt_data)
+        ingest.commit()
+    """
+
+    def __init__(self, data_dir, refresh=None, rebuild=False):
+        self.data_dir = data_dir
+        self.rebuild = rebuild
+        # Where the CSVs and manifest are written until commit()
+        self.work_dir = os.path.join(data_dir, REBUILD_DIR) if rebuild else data_dir
+        if rebuild:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+            os.makedirs(self.work_dir)
+        self.results_file = os.path.join(self.work_dir, RESULTS_NAME)
+        self.manifest = Manifest(os.path.join(self.work_dir, MANIFEST_NAME))
+        if refresh is None:
+            refresh = os.environ.get('BRKC_REFRESH') == '1'
+        self.refresh = refresh
+        # The CSVs are being started over, so every partition is rebuilt
+        self._fresh = rebuild or not os.path.exists(self.results_file)
+        self._parsed = []
+        self._spool = None
+        self._partial = set()
+        self.deferred = []
+
+    def _existing_keys(self):
+        """Counters of (result rows, lap series) per key in the files."""
+        results = Counter(row_key(r) for r in iter_rows(self.results_file))
+        laps = Counter((f[0], f[2], f[3]) for *f, _ in iter_series(ensure_long(self.work_dir)))
+        return results, laps
+
+    def _recorded_counts(self):
+        """(result rows, lap series) per key that the manifest accounts for; None if unknown."""
+        counts = {}
+        for m in self.manifest.sessions.values():
+            key = (m['round'], m['class'], m['session_type'])
+            have = counts.get(key, (0, 0))
+            if have is None or m['results'] is None:
+                counts[key] = None
+            else:
+                counts[key] = (have[0] + m['results'], have[1] + m['laptimes'])
+        return counts
+
+    def pending(self, sessions):
+        """Sessions that need fetching, in their original order."""
+        sessions = list(sessions)
+        if self.refresh:
+            return sessions
+        known = recorded = None
+        todo = set()
+        partial = set()
+        for session in sessions:
+            if session[3] in self.manifest:
+                continue
+            if known is None:
+                known, recorded = self._existing_keys(), self._recorded_counts()
+            key = session_key(session)
+            found = (known[0][key], known[1][key])
+            if key in recorded:
+                # Other sessions share the key: rows beyond theirs were left
+                # by a commit that stopped before saving the manifest
+                if recorded[key] is not None and (found[0] > recorded[key][0]
+                                                  or found[1] > recorded[key][1]):
+                    partial.add(key)
+            elif found[0] and found[1]:
+                # Ingested before the manifest existed, or by a commit
+                # that stopped before saving it
+                self.manifest.record(session, None, None, None, fetched=0)
+                self._fresh = True
+                continue
+            elif found[0] or found[1]:
+                # Only part of it was written
+                partial.add(key)
+            todo.add(session[3])
+        # A partly written key's rows are replaced as a whole, so every
+        # session under it is fetched again and written as changed
+        self._partial = {s[3] for s in sessions if session_key(s) in partial}
+        todo |= self._partial
+        return [s for s in sessions if s[3] in todo]
+
+    def add(self, session, drivers, lt_data):
+        """
+        Queue a parsed session. Returns 'new', 'changed' or 'unchanged'.
+        An empty session (no drivers and no laps) is recorded but not written.
+
+        The session's rows go straight to the spool file, so memory does
+        not grow with the number of sessions in a run.
+        """
+        digest = content_hash(drivers, lt_data)
+        prev = self.manifest.get(session[3])
+        if session[3] in self._partial:
+            status = 'changed'
+        elif prev is None:
+            status = 'new'
+        elif prev.get('hash') == digest:
+            status = 'unchanged'
+        else:
+            status = 'changed'
+        if self._spool is None:
+            self._spool = tempfile.TemporaryFile('w+', newline='', encoding='utf-8',
+                                                 dir=self.data_dir)
+        writer = csv_writer(self._spool)
+        sid = session[3]
+        writer.writerows(['R', sid, *result_row(session, d)] for d in drivers)
+        writer.writerows(['L', sid, name, *laps] for name, laps in lt_data.items())
+        self._parsed.append((status, session, digest, len(drivers), len(lt_data)))
+        return status
+
+    def add_empty(self, session):
+        self.add(session, [], {})
+
+    def _spooled(self):
+        """Yield (session id, kind, row) back from the spool, in add() order."""
+        if self._spool is None:
+            return
+        self._spool.seek(0)
+        for kind, sid, *row in csv.reader(self._spool):
+            yield int(sid), kind, row
+
+    def _spooled_sessions(self):
+        """Yield (session, drivers, lt_data, digest) for every queued session."""
+        rows = groupby(self._spooled(), key=lambda r: r[0])
+        pending = next(rows, None)
+        sids = {s[3] for _, s, _, _, _ in self._parsed}
+        for _, session, digest, _, _ in self._parsed:
+            drivers, lt_data = [], {}
+            # Skip the rows of sessions dropped from the batch (deferred)
+            while pending is not None and pending[0] != session[3] and pending[0] not in sids:
+                pending = next(rows, None)
+            if pending is not None and pending[0] == session[3]:
+                for _, kind, row in pending[1]:
+                    if kind == 'R':
+                        drivers.append(dict(zip(sqlstore.RESULT_FIELDS, row[4:])))
+                    else:
+                        lt_data[row[0]] = row[1:]
+                pending = next(rows, None)
+            yield session, drivers, lt_data, digest
+
+    def commit(self):
+        """Write queued sessions and save the manifest. Returns rows written."""
+        changed_keys = {
+            session_key(s) for status, s, _, _, _ in self._parsed
+            if status == 'changed'
+        }
+        # Dropping a key takes every session filed under it; only do that
+        # when all of them are in this batch to be written back.
+        batch = {s[3] for _, s, _, _, _ in self._parsed}
+        for sid, m in self.manifest.sessions.items():
+            key = (m['round'], m['class'], m['session_type'])
+            if key in changed_keys and int(sid) not in batch:
+                changed_keys.discard(key)
+        self.deferred = [s for status, s, _, _, _ in self._parsed
+                         if status == 'changed' and session_key(s) not in changed_keys]
+        if self.deferred:
+            deferred = {s[3] for s in self.deferred}
+            self._parsed = [p for p in self._parsed if p[1][3] not in deferred]
+        # A changed session's old rows are removed by key, which takes any
+        # other session sharing that key with it. Re-add those as well.
+        to_write = {
+            s[3] for status, s, _, _, _ in self._parsed
+            if status == 'new' or session_key(s) in changed_keys
+        }
+        n_results = sum(n for _, s, _, n, _ in self._parsed if s[3] in to_write)
+        n_laps = sum(n for _, s, _, _, n in self._parsed if s[3] in to_write)
+
+        if n_results or changed_keys:
+            self._write_results(changed_keys, to_write)
+        if n_laps or changed_keys:
+            self._write_laps(changed_keys, to_write)
+        if self.rebuild:
+            self._publish()
+        self._write_partitions(changed_keys, to_write, bool(n_results or n_laps or changed_keys))
+        if sqlstore.enabled(self.data_dir):
+            with sqlstore.SQLiteStore(os.path.join(self.data_dir, sqlstore.DB_NAME)) as db:
+                db.upsert_sessions(self._spooled_sessions())
+
+        now = int(time.time())
+        for _, session, digest, n_drivers, n_series in self._parsed:
+            self.manifest.record(session, digest, n_drivers, n_series, now)
+        self.manifest.save()
+        self._close()
+        return n_results, n_laps
+
+    def _publish(self):
+        """Move a rebuild's files over the served ones; the manifest follows in commit()."""
+        if not os.path.exists(self.results_file):
+            with atomic_write(self.results_file) as f:
+                csv_writer(f).writerow(RESULTS_HEADER)
+        ensure_long(self.work_dir)
+        for name in (RESULTS_NAME, LONG_NAME):
+            os.replace(os.path.join(self.work_dir, name), os.path.join(self.data_dir, name))
+        self.work_dir = self.data_dir
+        self.results_file = os.path.join(self.data_dir, RESULTS_NAME)
+        self.manifest.path = os.path.join(self.data_dir, MANIFEST_NAME)
+
+    def discard(self):
+        """Drop the queued sessions without writing anything."""
+        self._close()
+
+    def _close(self):
+        self._parsed = []
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+        if self.rebuild:
+            shutil.rmtree(os.path.join(self.data_dir, REBUILD_DIR), ignore_errors=True)
+
+    def _write_results(self, drop_keys, sids):
+        """
+        Add the new rows after a copy of the results; when drop_keys is
+        set, stream the old results less those keys instead.
+        """
+        if not drop_keys:
+            with staged_append(self.results_file, RESULTS_HEADER) as f:
+                csv_writer(f).writerows(self._spooled_results(sids))
+            return
+        with atomic_write(self.results_file) as f:
+            writer = csv_writer(f)
+            writer.writerow(RESULTS_HEADER)
+            writer.writerows(r for r in iter_rows(self.results_file) if row_key(r) not in drop_keys)
+            writer.writerows(self._spooled_results(sids))
+
+    def _spooled_results(self, sids):
+        for sid, kind, row in self._spooled():
+            if kind == 'R' and sid in sids:
+                yield row
+
+    def _spooled_series(self, sids):
+        """(round, date, class, session, driver, laps_ms) for the spooled laps of sids."""
+        sessions = {s[3]: s for _, s, _, _, _ in self._parsed}
+        for sid, kind, row in self._spooled():
+            if kind == 'L' and sid in sids:
+                round_name, date, _, _, class_name, session_type = sessions[sid]
+                yield (round_name, date, class_name, session_type, row[0],
+                       [parse_lap(t) for t in row[1:]])
+
+    def _write_laps(self, drop_keys, sids):
+        """Add the new laps to the long lap file (see longlaps.py)."""
+        append_series(ensure_long(self.work_dir), self._spooled_series(sids), drop=drop_keys)
+
+    def _write_partitions(self, drop_keys, sids, wrote):
+        """Rewrite the partitions this commit touched (see partitions.py)."""
+        store = PartitionStore(self.data_dir)
+        if self._fresh or not store.exists():
+            written = store.build(self.results_file, ensure_long(self.data_dir))
+            self._fresh = False
+        elif wrote:
+            names = store.holding(drop_keys) | {
+                partition_of(s[0], s[1]) for _, s, _, _, _ in self._parsed if s[3] in sids}
+            written = store.update(names, drop_keys, lambda: self._spooled_results(sids),
+                                   lambda: self._spooled_series(sids))
+        else:
+            written = []
+        METRICS.inc('partitions_written', len(written))
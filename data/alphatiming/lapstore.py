@@ -0,0 +1,240 @@
+"""
+Columnar lap time store.
+
+Every lap is an int32 millisecond count (0 = no time recorded) in one flat
+array. A "series" is one driver in one session; offsets[i]:offsets[i+1] is
+the slice of laps belonging to series i. The round, date, class, session
+and driver of each series are dictionary-encoded: one int32 code column
+per field plus a list of distinct values.
+
+On disk (data/brkc-laps.bin, little-endian):
+
+    header   '<8sIII'  magic, n_laps, n_series, dict_len
+    laps     int32[n_laps]
+    offsets  uint32[n_series + 1]
+    codes    int32[n_series] for each of COLUMNS, in order
+    dict     dict_len bytes of UTF-8 JSON {column: [values, ...]}
+
+LapStore.load() maps the file and exposes the arrays as memoryviews over
+the mapping, so scanning every lap of a season needs no parsing and no
+copy. The store is derived from the append-only long lap file (see
+longlaps.py) and rebuilt by open_store() whenever that file is newer.
+brkc-laptimes.csv can be exported from it with write_wide_csv.
+
+    python3 -m alphatiming.lapstore import   # build the store from the long file
+    python3 -m alphatiming.lapstore export   # rewrite brkc-laptimes.csv from the store
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from .csvfiles import atomic_write, csv_writer, format_lap, laptimes_header
+from .longlaps import ensure_long, iter_series
+
+MAGIC = b'BRKCLAP1'
+HEADER = struct.Struct('<8sIII')
+COLUMNS = ('round', 'date', 'class', 'session', 'driver')
+STORE_NAME = "brkc-laps.bin"
+
+
+class LapStore:
+    def __init__(self):
+        self.laps = array('i')
+        self.offsets = array('I', [0])
+        self.codes = {c: array('i') for c in COLUMNS}
+        self.values = {c: [] for c in COLUMNS}
+        self._lookup = {c: {} for c in COLUMNS}
+        self._mmap = None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def readonly(self):
+        return self._mmap is not None
+
+    def _code(self, column, value):
+        lookup = self._lookup[column]
+        code = lookup.get(value)
+        if code is None:
+            code = lookup[value] = len(self.values[column])
+            self.values[column].append(value)
+        return code
+
+    def add(self, round_name, date, class_name, session_type, driver, laps_ms):
+        """Append one driver-session. laps_ms is an iterable of ints."""
+        if self.readonly:
+            raise ValueError("store was loaded memory-mapped; load(path, mmap_file=False) to modify it")
+        for column, value in zip(COLUMNS, (round_name, date, class_name, session_type, driver)):
+            self.codes[column].append(self._code(column, value))
+        self.laps.extend(laps_ms)
+        self.offsets.append(len(self.laps))
+
+    def series_laps(self, i):
+        return self.laps[self.offsets[i]:self.offsets[i + 1]]
+
+    def field(self, column, i):
+        return self.values[column][self.codes[column][i]]
+
+    def __iter__(self):
+        """Yield (round, date, class, session, driver, laps) per series."""
+        values = [self.values[c] for c in COLUMNS]
+        codes = [self.codes[c] for c in COLUMNS]
+        offsets, laps = self.offsets, self.laps
+        for i in range(len(self)):
+            yield (*(v[c[i]] for v, c in zip(values, codes)), laps[offsets[i]:offsets[i + 1]])
+
+    def max_laps(self):
+        offsets = self.offsets
+        return max((offsets[i + 1] - offsets[i] for i in range(len(self))), default=0)
+
+    def drop(self, keys):
+        """
+        Return a new store without the series whose (round, class, session)
+        is in keys.
+        """
+        out = LapStore()
+        for round_name, date, class_name, session_type, driver, laps in self:
+            if (round_name, class_name, session_type) not in keys:
+                out.add(round_name, date, class_name, session_type, driver, laps)
+        return out
+
+    def save(self, path):
+        payload = json.dumps(self.values, separators=(',', ':')).encode('utf-8')
+        parts = [self.laps, self.offsets] + [self.codes[c] for c in COLUMNS]
+        if sys.byteorder != 'little':
+            parts = [array(a.typecode, a) for a in parts]
+            for a in parts:
+                a.byteswap()
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(self.laps), len(self), len(payload)))
+            for a in parts:
+                f.write(a.tobytes() if isinstance(a, array) else bytes(a))
+            f.write(payload)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, mmap_file=True):
+        """
+        Load a store. With mmap_file=True the lap, offset and code columns
+        are memoryviews over a read-only mapping of the file; otherwise
+        they are copied into arrays so the store can be modified.
+        """
+        store = cls()
+        with open(path, 'rb') as f:
+            if mmap_file and sys.byteorder == 'little':
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                store._mmap = buf
+            else:
+                buf = f.read()
+        magic, n_laps, n_series, dict_len = HEADER.unpack_from(buf, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a lap store")
+
+        view = memoryview(buf)
+        pos = HEADER.size
+
+        def take(typecode, count):
+            nonlocal pos
+            size = 4 * count
+            chunk = view[pos:pos + size]
+            pos += size
+            if store._mmap is not None:
+                return chunk.cast(typecode)
+            a = array(typecode)
+            a.frombytes(chunk)
+            if sys.byteorder != 'little':
+                a.byteswap()
+            return a
+
+        store.laps = take('i', n_laps)
+        store.offsets = take('I', n_series + 1)
+        store.codes = {c: take('i', n_series) for c in COLUMNS}
+        store.values = json.loads(bytes(view[pos:pos + dict_len]).decode('utf-8'))
+        store._lookup = {c: {v: i for i, v in enumerate(store.values[c])} for c in COLUMNS}
+        return store
+
+    def close(self):
+        if self._mmap is not None:
+            # Drop the views before closing the mapping they point into
+            self.laps = self.offsets = None
+            self.codes = {}
+            self._mmap.close()
+            self._mmap = None
+
+    def as_numpy(self):
+        """(laps, offsets) as NumPy arrays sharing this store's memory."""
+        import numpy as np
+        return (np.frombuffer(self.laps, dtype='<i4'),
+                np.frombuffer(self.offsets, dtype='<u4'))
+
+    @classmethod
+    def from_series(cls, series):
+        """Build from (round, date, class, session, driver, laps_ms) tuples."""
+        store = cls()
+        for *fields, laps in series:
+            store.add(*fields, laps)
+        return store
+
+    def wide_rows(self, width=None):
+        if width is None:
+            width = self.max_laps()
+        for *fields, laps in self:
+            row = fields + [format_lap(ms) for ms in laps]
+            row.extend([''] * (width - len(laps)))
+            yield row
+
+    def write_wide_csv(self, path):
+        """Export in the legacy wide brkc-laptimes.csv layout."""
+        width = self.max_laps()
+        with atomic_write(path) as f:
+            writer = csv_writer(f)
+            writer.writerow(laptimes_header(width))
+            writer.writerows(self.wide_rows(width))
+
+
+def open_store(data_dir, writable=False):
+    """
+    Load data_dir's lap store, (re)building it from the long lap file when
+    the store is missing or older than that file. A missing long file is
+    first converted from brkc-laptimes.csv.
+    """
+    store_path = os.path.join(data_dir, STORE_NAME)
+    long_path = ensure_long(data_dir)
+    stale = (not os.path.exists(store_path)
+             or os.path.getmtime(long_path) > os.path.getmtime(store_path))
+    if stale:
+        store = LapStore.from_series(iter_series(long_path))
+        store.save(store_path)
+        return store
+    return LapStore.load(store_path, mmap_file=not writable)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    data_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    store_path = os.path.join(data_dir, STORE_NAME)
+    csv_path = os.path.join(data_dir, "brkc-laptimes.csv")
+    command = argv[0] if argv else 'import'
+    if command == 'import':
+        if os.path.exists(store_path):
+            os.remove(store_path)
+        store = open_store(data_dir)
+        print(f"{len(store)} series, {len(store.laps)} laps -> {store_path}")
+    elif command == 'export':
+        store = LapStore.load(store_path)
+        store.write_wide_csv(csv_path)
+        print(f"{len(store)} series -> {csv_path}")
+    else:
+        print("usage: python3 -m alphatiming.lapstore [import|export]")
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
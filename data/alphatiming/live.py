@@ -0,0 +1,284 @@
+"""
+Race-day live mode: follow the running sessions of an event lap by lap.
+
+Every watched session's laptimes tab is polled through the HTTP cache, so
+an unchanged page costs a conditional request and a 304. Polls always
+revalidate (ttl=0): a session page can sit unchanged for a long time
+before the session starts, and would otherwise be served fresh from the
+cache. Each session has
+its own poll interval. Once a session has laps it is polled every
+MIN_INTERVAL until it settles, so no lap waits behind a backed-off
+interval; a session that has not started yet, or has settled, backs off
+by BACKOFF on every unchanged poll, up to MAX_INTERVAL, so it costs
+little.
+
+A changed page is parsed with parse_laptimes_ms and diffed against the
+previous snapshot. Only the difference is emitted:
+
+  data/live/live-log.jsonl   append-only, one JSON event per line:
+                             {"type": "lap", "sid", "driver", "lap", "ms", ...}
+                             {"type": "positions", "sid", "changes": [...]}
+                             {"type": "finished", "sid", ...}
+  data/live/live.json        current running order of every watched
+                             session, replaced atomically; the site polls it
+
+Positions are worked out from the lap data alone (most laps, then least
+total time), so the result tab is not fetched until the session is over.
+A session with laps whose page has not changed for FINISH_AFTER seconds has
+settled: it is ingested through the normal pipeline (CSVs, standings and
+bundles). The timing pages carry no end-of-session marker, and a red flag
+looks the same as a finish, so a settled session stays on the watch list:
+if its laps change again (the session restarted) it is polled at
+MIN_INTERVAL again and, once it settles, ingested again with refresh, so
+its rows are replaced as a changed session. Every REDISCOVER seconds the
+pages of the events being watched are crawled again to pick up sessions
+as they appear; all selected events are crawled only while none of them
+has shown a session yet.
+
+    python3 -m alphatiming.pipeline --live [--round 6] [--type H1,H2,F]
+"""
+
+import hashlib
+import json
+import os
+import time
+
+from .client import fetch_url
+from .csvfiles import format_lap, session_key
+from .fetch import DEFAULT_RATE, TokenBucket, session_url
+from .ingest import Ingest
+from .parse import parse_laptimes_ms
+from .retry import FetchError
+
+LIVE_DIR = "live"
+LOG_NAME = "live-log.jsonl"
+STATE_NAME = "live.json"
+
+MIN_INTERVAL = 3.0
+MAX_INTERVAL = 30.0
+BACKOFF = 1.5
+FINISH_AFTER = 180.0
+REDISCOVER = 120.0
+
+
+def completed(ms):
+    """Laps completed: trailing laps without a time are not run yet."""
+    n = len(ms)
+    while n and ms[n - 1] <= 0:
+        n -= 1
+    return n
+
+
+def running_order(laps):
+    """[driver, ...] by most laps completed, then least total time."""
+    def key(item):
+        driver, ms = item
+        return (-completed(ms), sum(ms), driver)
+    return [driver for driver, _ in sorted(laps.items(), key=key)]
+
+
+class WatchedSession:
+    __slots__ = ('session', 'interval', 'next_poll', 'digest', 'laps', 'order',
+                 'changed_at', 'polls', 'updates', 'ingested')
+
+    def __init__(self, session, now):
+        self.session = session
+        self.interval = MIN_INTERVAL
+        self.next_poll = now
+        self.digest = None
+        self.laps = {}
+        self.order = []
+        self.changed_at = None
+        self.polls = 0
+        self.updates = 0
+        self.ingested = None   # digest of the page last ingested
+
+    @property
+    def started(self):
+        return bool(self.laps)
+
+    def settled(self, now):
+        return self.started and now - self.changed_at >= FINISH_AFTER
+
+    def due_ingest(self, now):
+        """Settled with laps that have not been ingested yet."""
+        return self.settled(now) and self.ingested != self.digest
+
+    def schedule(self, now, changed):
+        if changed or (self.started and not self.settled(now)):
+            self.interval = MIN_INTERVAL
+        else:
+            self.interval = min(MAX_INTERVAL, self.interval * BACKOFF)
+        self.next_poll = now + self.interval
+
+    def diff(self, laps, now):
+        """Update the snapshot; returns (new lap events, position changes)."""
+        new_laps = []
+        for driver, ms in laps.items():
+            seen = completed(self.laps.get(driver, ()))
+            for n in range(seen, len(ms)):
+                if ms[n] > 0:
+                    new_laps.append({'driver': driver, 'lap': n + 1, 'ms': ms[n],
+                                     'time': format_lap(ms[n])})
+        order = running_order(laps)
+        before = {d: i for i, d in enumerate(self.order, 1)}
+        changes = [
+            {'driver': d, 'from': before.get(d), 'to': i}
+            for i, d in enumerate(order, 1) if before.get(d) != i
+        ]
+        self.laps = {d: list(ms) for d, ms in laps.items()}
+        self.order = order
+        self.changed_at = now
+        self.updates += 1
+        return new_laps, changes
+
+    def state(self):
+        round_name, _, event_id, session_id, class_name, session_type = self.session
+        board = []
+        for pos, driver in enumerate(self.order, 1):
+            ms = self.laps[driver]
+            timed = [t for t in ms if t > 0]
+            n = completed(ms)
+            board.append({
+                'pos': pos, 'driver': driver, 'laps': n,
+                'last': format_lap(ms[n - 1]) if n else '',
+                'best': format_lap(min(timed)) if timed else '',
+            })
+        return {'sid': session_id, 'event': event_id, 'round': round_name,
+                'class': class_name, 'session': session_type,
+                'status': ('finished' if self.ingested is not None and self.ingested == self.digest
+                           else 'running' if self.started else 'waiting'),
+                'board': board}
+
+
+class LiveWatcher:
+    """
+    Poll a set of sessions, ingesting each one whenever it settles.
+
+    sessions_source(event_ids) is called every REDISCOVER seconds and
+    returns the SESSIONS tuples that may be live, crawling the pages of
+    event_ids again (all events when it is None); sessions already
+    ingested are skipped. event_ids are the events of every session
+    watched so far.
+    """
+
+    def __init__(self, data_dir, sessions_source, rate=DEFAULT_RATE, fetch=None,
+                 ingest=True, log=print, clock=time.time, sleep=time.sleep):
+        self.data_dir = data_dir
+        self.sessions_source = sessions_source
+        self.bucket = TokenBucket(rate)
+        self.fetch = fetch
+        self.ingest = ingest
+        self.log = log
+        self.clock = clock
+        self.sleep = sleep
+        self.watched = {}
+        self.seen = {}         # session id -> SESSIONS tuple, every one discovered
+        self.events = set()
+        self.live_dir = os.path.join(data_dir, LIVE_DIR)
+        os.makedirs(self.live_dir, exist_ok=True)
+        self.log_path = os.path.join(self.live_dir, LOG_NAME)
+        self.state_path = os.path.join(self.live_dir, STATE_NAME)
+        self._next_discover = 0.0
+
+    def emit(self, event):
+        with open(self.log_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(event, separators=(',', ':')) + '\n')
+
+    def write_state(self, now):
+        state = {'updated': now, 'sessions': [
+            w.state() for w in sorted(self.watched.values(), key=lambda w: w.session[3])
+        ]}
+        tmp = self.state_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(state, f, separators=(',', ':'))
+        os.replace(tmp, self.state_path)
+
+    def discover(self, now):
+        manifest = Ingest(self.data_dir).manifest
+        for session in self.sessions_source(set(self.events) or None):
+            sid = session[3]
+            self.seen[sid] = session
+            if sid in self.watched or sid in manifest:
+                continue
+            self.watched[sid] = WatchedSession(session, now)
+            self.events.add(session[2])
+        self._next_discover = now + REDISCOVER
+
+    def poll(self, watched, now):
+        """Poll one session; returns True if its laps changed."""
+        event_id, session_id = watched.session[2], watched.session[3]
+        self.bucket.acquire()
+        watched.polls += 1
+        try:
+            url = session_url(event_id, session_id, 'laptimes')
+            html = self.fetch(url) if self.fetch else fetch_url(url, ttl=0)
+        except FetchError as exc:
+            self.log(f"sid={session_id}: {exc}")
+            return False
+        digest = hashlib.sha256(html.encode('utf-8')).digest()
+        if not html or digest == watched.digest:
+            return False
+        watched.digest = digest
+        laps = parse_laptimes_ms(html)
+        if not laps:
+            return False
+
+        new_laps, changes = watched.diff(laps, now)
+        for lap in new_laps:
+            self.emit(dict(lap, type='lap', t=now, sid=session_id))
+        if changes:
+            self.emit({'type': 'positions', 't': now, 'sid': session_id,
+                       'order': watched.order, 'changes': changes})
+        label = f"{watched.session[4]} {watched.session[5]} (sid={session_id})"
+        self.log(f"{label}: {len(new_laps)} new laps, {len(changes)} position changes")
+        return True
+
+    def finish(self, watched, now):
+        """
+        Ingest a settled session. It stays watched: if it restarts, it is
+        ingested again once it settles, replacing these rows.
+        """
+        session_id = watched.session[3]
+        self.emit({'type': 'finished', 't': now, 'sid': session_id, 'order': watched.order})
+        watched.ingested = watched.digest
+        if self.ingest:
+            from .pipeline import Pipeline
+            # Rows are replaced by (round, class, session) key, so sessions
+            # sharing the key are fetched with it (see ingest.py)
+            key = session_key(watched.session)
+            batch = [s for s in self.seen.values() if session_key(s) == key]
+            Pipeline(self.data_dir, fetch=self.fetch, log=self.log, refresh=True).run(batch)
+
+    def step(self):
+        """Poll every session that is due. Returns seconds until the next one."""
+        now = self.clock()
+        if now >= self._next_discover:
+            self.discover(now)
+        changed = False
+        for watched in sorted(self.watched.values(), key=lambda w: w.next_poll):
+            if watched.next_poll > now:
+                break
+            updated = self.poll(watched, now)
+            changed = changed or updated
+            now = self.clock()
+            watched.schedule(now, updated)
+            if watched.due_ingest(now):
+                self.finish(watched, now)
+                changed = True
+        if changed:
+            self.write_state(now)
+        due = min((w.next_poll for w in self.watched.values()), default=now + MAX_INTERVAL)
+        return max(0.0, min(due, self._next_discover) - now)
+
+    def run(self, until=None):
+        """Poll until interrupted (or until the clock passes `until`)."""
+        self.discover(self.clock())
+        self.write_state(self.clock())
+        self.log(f"Watching {len(self.watched)} sessions")
+        try:
+            while until is None or self.clock() < until:
+                self.sleep(self.step())
+        except KeyboardInterrupt:
+            self.log("Stopped")
+        self.write_state(self.clock())
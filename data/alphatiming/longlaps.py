@@ -0,0 +1,201 @@
+"""
+Long-format lap times: data/brkc-laptimes-long.csv.
+
+One row per lap:
+
+    Round,Date,Class,Session,Driver,Lap,Ms
+
+Laps with no recorded time are left out; Lap keeps the original lap
+number. Rows are only ever added at the end: the scrapers add a session
+by adding its laps, whatever their count, so the file's shape does not
+depend on the season-wide widest session. The file is served, so it is
+never written in place: new laps go after a byte copy of it in a temp
+file (csvfiles.staged_append), and when rows have to be dropped (a
+changed session, drop_keys) the old rows are streamed through instead.
+Either way the temp file is renamed into place, so readers and an
+interrupted write only ever see a complete file.
+
+The wide brkc-laptimes.csv (one L1..Ln column per lap) is produced from it
+when needed:
+
+    python3 -m alphatiming.longlaps wide   # long -> brkc-laptimes.csv
+    python3 -m alphatiming.longlaps long   # brkc-laptimes.csv -> long
+"""
+
+import csv
+import os
+import sys
+
+from .csvfiles import (
+    atomic_write, csv_writer, format_lap, iter_rows, laptimes_header, parse_lap, row_key,
+    staged_append,
+)
+
+LONG_NAME = "brkc-laptimes-long.csv"
+LONG_HEADER = ['Round', 'Date', 'Class', 'Session', 'Driver', 'Lap', 'Ms']
+
+
+class LongLapWriter:
+    """
+    Streaming writer for a new long lap file (wide_to_long writes one to a
+    temp path and renames it into place).
+
+        with LongLapWriter(path) as w:
+            w.write_series(round_name, date, class_name, session_type, driver, laps_ms)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.rows = 0
+        self._file = None
+        self._writer = None
+
+    def __enter__(self):
+        new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self._file = open(self.path, 'a', newline='', encoding='utf-8')
+        self._writer = csv_writer(self._file)
+        if new:
+            self._writer.writerow(LONG_HEADER)
+        return self
+
+    def __exit__(self, *exc):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = self._writer = None
+
+    def write_series(self, round_name, date, class_name, session_type, driver, laps_ms):
+        fields = (round_name, date, class_name, session_type, driver)
+        for lap, ms in enumerate(laps_ms, 1):
+            if ms > 0:
+                self._writer.writerow((*fields, lap, ms))
+                self.rows += 1
+
+
+def iter_series(path):
+    """
+    Yield (round, date, class, session, driver, laps_ms) from the long file.
+
+    A series is a run of consecutive rows with the same five fields and
+    increasing lap numbers, so two sessions that share a key (e.g. two
+    "Kid Kart" practices in one round) stay separate.
+    """
+    try:
+        f = open(path, 'r', newline='', encoding='utf-8')
+    except FileNotFoundError:
+        return
+    with f:
+        reader = csv.reader(f)
+        next(reader, None)
+        fields = None
+        laps = []
+        last_lap = 0
+        for row in reader:
+            lap = int(row[5])
+            if fields is None or row[:5] != fields or lap <= last_lap:
+                if fields is not None:
+                    yield (*fields, laps)
+                fields = row[:5]
+                laps = []
+            laps.extend([0] * (lap - len(laps) - 1))
+            laps.append(int(row[6]))
+            last_lap = lap
+        if fields is not None:
+            yield (*fields, laps)
+
+
+def drop_keys(path, keys):
+    """Rewrite the long file without rows whose (round, class, session) is in keys."""
+    append_series(path, (), drop=keys)
+
+
+def append_series(path, series, drop=()):
+    """
+    Add (round, date, class, session, driver, laps_ms) series to the end
+    of the long file. Without drop the old file is copied as it is; with
+    drop, existing rows whose key is in drop are left out. Either way the
+    result is written to a temp file that replaces the long file. Returns
+    lap rows added.
+    """
+    rows = 0
+    if not drop:
+        with staged_append(path, LONG_HEADER) as dst:
+            writer = csv_writer(dst)
+            for *fields, laps_ms in series:
+                for lap, ms in enumerate(laps_ms, 1):
+                    if ms > 0:
+                        writer.writerow((*fields, lap, ms))
+                        rows += 1
+        return rows
+    with atomic_write(path) as dst:
+        writer = csv_writer(dst)
+        writer.writerow(LONG_HEADER)
+        writer.writerows(r for r in iter_rows(path) if row_key(r) not in drop)
+        for *fields, laps_ms in series:
+            for lap, ms in enumerate(laps_ms, 1):
+                if ms > 0:
+                    writer.writerow((*fields, lap, ms))
+                    rows += 1
+    return rows
+
+
+def long_to_wide(long_path, wide_path):
+    """
+    Write the legacy wide layout from the long file. Returns series count.
+    Two streaming passes (the first only finds the width), so memory does
+    not grow with the season.
+    """
+    width = max((len(s[5]) for s in iter_series(long_path)), default=0)
+    count = 0
+    with atomic_write(wide_path) as f:
+        writer = csv_writer(f)
+        writer.writerow(laptimes_header(width))
+        for *fields, laps in iter_series(long_path):
+            writer.writerow(fields + [format_lap(ms) for ms in laps] + [''] * (width - len(laps)))
+            count += 1
+    return count
+
+
+def wide_to_long(wide_path, long_path):
+    """
+    Convert a legacy wide laptimes CSV to the long file. Returns lap rows.
+    A missing wide file gives an empty long file.
+    """
+    tmp = long_path + '.tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    with LongLapWriter(tmp) as w:
+        for row in iter_rows(wide_path):
+            w.write_series(*row[:5], [parse_lap(t) for t in row[5:]])
+    os.replace(tmp, long_path)
+    return w.rows
+
+
+def ensure_long(data_dir):
+    """Path of data_dir's long lap file, converting it from the wide CSV if missing."""
+    long_path = os.path.join(data_dir, LONG_NAME)
+    if not os.path.exists(long_path):
+        wide_to_long(os.path.join(data_dir, "brkc-laptimes.csv"), long_path)
+    return long_path
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    data_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    long_path = os.path.join(data_dir, LONG_NAME)
+    wide_path = os.path.join(data_dir, "brkc-laptimes.csv")
+    command = argv[0] if argv else 'wide'
+    if command == 'wide':
+        n = long_to_wide(long_path, wide_path)
+        print(f"{n} series -> {wide_path}")
+    elif command == 'long':
+        n = wide_to_long(wide_path, long_path)
+        print(f"{n} laps -> {long_path}")
+    else:
+        print("usage: python3 -m alphatiming.longlaps [wide|long]")
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
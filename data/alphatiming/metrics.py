@@ -0,0 +1,172 @@
+"""
+Run metrics for the scrapers.
+
+METRICS is the process-wide registry. The client, cache and pipeline add
+to it as they work:
+
+  counters     http_requests, http_bytes (on the wire), http_bytes_decoded,
+               http_retries (stale keep-alive connections),
+               fetch_retries and fetch_errors (each also per failure kind,
+               e.g. fetch_retries_server), circuit_opens,
+               concurrency_decreases, cache_hits, cache_misses,
+               rows_parsed, rows_heuristic (mapped without a header),
+               rows_skipped (sub-headers and rows without a driver),
+               laps_parsed, sessions_skipped, sessions_failed, rows_written,
+               partitions_written
+  histograms   http_request_seconds by tab (result / laptimes / event)
+  stages       wall time of each pipeline stage, from its first item to
+               its last (fetch and parse overlap), plus write and export
+
+At the end of a run the pipeline writes the registry as a JSON report and
+in the Prometheus text format (run.json / run.prom in the report
+directory), so a slow race-day run can be looked at afterwards.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th observation."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets + (float('inf'),), self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def as_dict(self):
+        return {'count': self.count, 'sum': round(self.sum, 6),
+                'p50': self.quantile(0.5), 'p95': self.quantile(0.95),
+                'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], self.counts))}
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.counters = {}
+            self.histograms = {}
+            self.stages = {}
+
+    def inc(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, value, label=''):
+        with self._lock:
+            hist = self.histograms.get((name, label))
+            if hist is None:
+                hist = self.histograms[(name, label)] = Histogram()
+            hist.observe(value)
+
+    def span(self, stage, start, end):
+        """Widen stage's wall-time span to cover [start, end] (perf_counter values)."""
+        with self._lock:
+            first, last, busy = self.stages.get(stage, (start, end, 0.0))
+            self.stages[stage] = (min(first, start), max(last, end), busy + end - start)
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.span(stage, start, time.perf_counter())
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self.counters)
+            stages = {name: {'wall_seconds': round(last - first, 6), 'busy_seconds': round(busy, 6)}
+                      for name, (first, last, busy) in self.stages.items()}
+            histograms = {}
+            for (name, label), hist in sorted(self.histograms.items()):
+                histograms.setdefault(name, {})[label or 'all'] = hist.as_dict()
+        lookups = counters.get('cache_hits', 0) + counters.get('cache_misses', 0)
+        return {
+            'started': self.started,
+            'elapsed_seconds': round(time.time() - self.started, 6),
+            'stages': stages,
+            'counters': counters,
+            'cache_hit_ratio': round(counters.get('cache_hits', 0) / lookups, 4) if lookups else None,
+            'histograms': histograms,
+        }
+
+    def prometheus(self):
+        """The registry in the Prometheus text exposition format."""
+        snap = self.snapshot()
+        lines = []
+        for name, value in sorted(snap['counters'].items()):
+            lines.append(f"# TYPE brkc_{name}_total counter")
+            lines.append(f"brkc_{name}_total {value}")
+        if snap['cache_hit_ratio'] is not None:
+            lines.append("# TYPE brkc_cache_hit_ratio gauge")
+            lines.append(f"brkc_cache_hit_ratio {snap['cache_hit_ratio']}")
+        if snap['stages']:
+            lines.append("# TYPE brkc_stage_seconds gauge")
+            for stage, t in sorted(snap['stages'].items()):
+                lines.append(f'brkc_stage_seconds{{stage="{stage}"}} {t["wall_seconds"]}')
+        with self._lock:
+            hists = sorted(self.histograms.items())
+        for i, ((name, label), hist) in enumerate(hists):
+            if i == 0 or hists[i - 1][0][0] != name:
+                lines.append(f"# TYPE brkc_{name} histogram")
+            tag = f'tab="{label}"' if label else ''
+            cumulative = 0
+            for bound, n in zip(hist.buckets + ('+Inf',), hist.counts):
+                cumulative += n
+                le = f'{tag},le="{bound}"' if tag else f'le="{bound}"'
+                lines.append(f'brkc_{name}_bucket{{{le}}} {cumulative}')
+            tag = f'{{{tag}}}' if tag else ''
+            lines.append(f'brkc_{name}_sum{tag} {hist.sum:.6f}')
+            lines.append(f'brkc_{name}_count{tag} {hist.count}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, report_dir, extra=None):
+        """Write run.json and run.prom into report_dir; returns the JSON path."""
+        os.makedirs(report_dir, exist_ok=True)
+        report = self.snapshot()
+        if extra:
+            report.update(extra)
+        paths = []
+        for name, text in (('run.json', json.dumps(report, indent=1) + '\n'),
+                           ('run.prom', self.prometheus())):
+            path = os.path.join(report_dir, name)
+            tmp = path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp, path)
+            paths.append(path)
+        return paths[0]
+
+
+METRICS = Metrics()
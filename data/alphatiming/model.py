@@ -0,0 +1,153 @@
+"""
+Compact in-memory records for a season's results and laps.
+
+The CSVs are text, and a row of strings is a poor thing to hold a whole
+season (or several) in. These records parse every numeric field once, on
+load, and store laps as array('i') of milliseconds:
+
+  SessionInfo  NamedTuple (round, date, event_id, session_id, class_name,
+               session_type). It is a plain 6-tuple, so it can stand in
+               for the scrapers' SESSIONS tuples anywhere.
+  ResultRow    one brkc-results.csv row: pos (int, 0 when not
+               classified) and status ('DNS' / 'DNF' / 'DSQ'), laps,
+               avg_mph, best_ms and best_on as numbers; gap as it was
+               written, since it mixes times and "1 Lap".
+  LapSeries    one driver's laps in one session.
+
+Records use __slots__ and share their strings: a Loader interns round,
+date, class, team, driver, kart and class-code values, and hands out one
+SessionInfo per session, so a row costs one small object plus its
+numbers. Sessions read from the CSVs have no event or session id (None).
+"""
+
+import sys
+from array import array
+from typing import NamedTuple
+
+from .csvfiles import iter_rows, parse_lap
+from .longlaps import iter_series
+
+STATUSES = ('DNS', 'DNF', 'DSQ')
+
+
+class SessionInfo(NamedTuple):
+    round: str
+    date: str
+    event_id: int
+    session_id: int
+    class_name: str
+    session_type: str
+
+    @property
+    def key(self):
+        """(round, class, session_type), as csvfiles.session_key()"""
+        return (self.round, self.class_name, self.session_type)
+
+
+class ResultRow:
+    __slots__ = ('session', 'pos', 'status', 'kart', 'driver', 'class_code', 'laps',
+                 'avg_mph', 'gap', 'best_ms', 'best_on', 'team')
+
+    def __init__(self, session, pos, status, kart, driver, class_code, laps,
+                 avg_mph, gap, best_ms, best_on, team):
+        self.session = session
+        self.pos = pos
+        self.status = status
+        self.kart = kart
+        self.driver = driver
+        self.class_code = class_code
+        self.laps = laps
+        self.avg_mph = avg_mph
+        self.gap = gap
+        self.best_ms = best_ms
+        self.best_on = best_on
+        self.team = team
+
+    @property
+    def classified(self):
+        return self.pos > 0
+
+    def __repr__(self):
+        return (f"ResultRow({self.session.key!r}, pos={self.pos or self.status!r}, "
+                f"driver={self.driver!r}, laps={self.laps})")
+
+
+class LapSeries:
+    __slots__ = ('session', 'driver', 'laps')
+
+    def __init__(self, session, driver, laps):
+        self.session = session
+        self.driver = driver
+        self.laps = laps
+
+    @property
+    def best_ms(self):
+        return min((ms for ms in self.laps if ms > 0), default=0)
+
+    def __len__(self):
+        return len(self.laps)
+
+    def __repr__(self):
+        return f"LapSeries({self.session.key!r}, {self.driver!r}, {len(self.laps)} laps)"
+
+
+def _int(text):
+    return int(text) if text.isdigit() else 0
+
+
+def _mph(text):
+    try:
+        return float(text.split()[0]) if text else 0.0
+    except ValueError:
+        return 0.0
+
+
+class Loader:
+    """Builds records, sharing strings and SessionInfos between them."""
+
+    def __init__(self):
+        self._sessions = {}
+
+    def session(self, round_name, date, class_name, session_type, event_id=None, session_id=None):
+        key = (round_name, date, class_name, session_type, event_id, session_id)
+        info = self._sessions.get(key)
+        if info is None:
+            intern = sys.intern
+            info = self._sessions[key] = SessionInfo(
+                intern(round_name), intern(date), event_id, session_id,
+                intern(class_name), intern(session_type))
+        return info
+
+    def result(self, row):
+        """ResultRow from a brkc-results.csv row."""
+        intern = sys.intern
+        round_name, date, class_name, session_type, pos, kart, driver, class_code, \
+            laps, speed, gap, best, best_on, team = row
+        return ResultRow(
+            self.session(round_name, date, class_name, session_type),
+            _int(pos), intern(pos) if pos in STATUSES else '',
+            intern(kart), intern(driver), intern(class_code), _int(laps), _mph(speed),
+            intern(gap), parse_lap(best), _int(best_on), intern(team))
+
+    def series(self, round_name, date, class_name, session_type, driver, laps_ms):
+        laps = laps_ms if isinstance(laps_ms, array) else array('i', laps_ms)
+        return LapSeries(self.session(round_name, date, class_name, session_type),
+                         sys.intern(driver), laps)
+
+    def results(self, path, offset=0):
+        """Stream ResultRows from a brkc-results.csv (from byte offset, see iter_rows)."""
+        for row in iter_rows(path, offset):
+            yield self.result(row)
+
+    def lap_series(self, long_path):
+        """Stream LapSeries from the long lap file."""
+        for fields in iter_series(long_path):
+            yield self.series(*fields)
+
+
+def load_results(path, loader=None):
+    return list((loader or Loader()).results(path))
+
+
+def load_lap_series(long_path, loader=None):
+    return list((loader or Loader()).lap_series(long_path))
@@ -0,0 +1,348 @@
+"""
+Parsers for Alpha Timing session pages.
+
+parse_results walks the at-session-results-table in a single pass: one
+regex finditer over the tags inside the table, collecting the text between
+them, and handing each <tr> off as soon as its closing tag is seen. Nothing
+before the table or after its closing tag is scanned.
+
+Cells are mapped to fields through the table's <th> header row: the header
+is turned into a column map once (cached by its labels) and every row is
+then read by index. Rows under a header that is not recognised, or whose
+cell count does not match it, fall back to the content heuristics in
+driver_from_cells.
+
+parse_batch is the unit of work of the pipeline's parse stage: a worker
+process is handed several fetched (result, laptimes) page pairs per call,
+so the IPC round trip is paid per batch rather than per session.
+"""
+
+import re
+from array import array
+from functools import lru_cache
+
+from .csvfiles import format_lap
+
+TABLE_START = '<table class="at-session-results-table"'
+
+_TAG = re.compile(r'<(/?)([A-Za-z][A-Za-z0-9]*)[^>]*>')
+_NAME = re.compile(r'^[A-Za-z][A-Za-z\s\.\'-]{3,}$')
+_LAP_TIME = re.compile(r'^\d+:\d+\.\d+$')
+_ALPHA = re.compile(r'^[A-Za-z]')
+_DATASET = re.compile(r'\{label:"([^"]+)"[^}]*data:\[([^\]]*)\]')
+_COLSPAN = re.compile(r'colspan\s*=\s*["\']?(\d+)', re.I)
+
+DRIVER_FIELDS = ('pos', 'no', 'name', 'cls', 'laps', 'avg_speed', 'gap',
+                 'best', 'best_on', 'team')
+
+# Header labels (lowercased, whitespace collapsed) for each driver field
+HEADER_LABELS = {
+    'pos': ('pos', 'pos.', 'position'),
+    'no': ('no', 'no.', '#', 'kart', 'kart#', 'kart #', 'kart no', 'kart no.', 'number'),
+    'name': ('name', 'driver', 'driver name', 'competitor'),
+    'cls': ('cls', 'class'),
+    'laps': ('laps',),
+    'avg_speed': ('avg speed', 'avg. speed', 'average speed', 'speed', 'avg'),
+    'gap': ('gap', 'diff', 'behind'),
+    'best': ('best', 'best lap', 'best tm', 'best time', 'fastest lap'),
+    'best_on': ('best on', 'best on lap', 'on lap', 'on', 'lap no', 'in lap'),
+    'team': ('team',),
+}
+_LABEL_FIELD = {label: field for field, labels in HEADER_LABELS.items() for label in labels}
+
+DNS_MARKERS = ('DNS', 'DNF', 'DSQ')
+
+
+def iter_table_rows(html):
+    """
+    Yield (cells, is_header) for every <tr> of the first results table.
+    Cell text has tags removed and whitespace collapsed.
+    """
+    start = html.find(TABLE_START)
+    if start < 0:
+        return
+    start = html.find('>', start)
+    if start < 0:
+        return
+
+    in_row = False
+    in_cell = False
+    is_header = False
+    cells = []
+    parts = []
+    span = 1
+    pos = start + 1
+
+    for m in _TAG.finditer(html, pos):
+        if in_cell:
+            parts.append(html[pos:m.start()])
+        pos = m.end()
+        closing, tag = m.group(1), m.group(2).lower()
+
+        if tag == 'td' or tag == 'th':
+            if closing:
+                if in_cell:
+                    cells.append(' '.join(''.join(parts).split()))
+                    if span > 1:
+                        cells.extend([''] * (span - 1))
+                    in_cell = False
+            elif in_row:
+                span = 1
+                if tag == 'th':
+                    is_header = True
+                    # Pad spanning header cells so labels line up with <td>s
+                    colspan = _COLSPAN.search(m.group(0))
+                    if colspan:
+                        span = int(colspan.group(1))
+                in_cell = True
+                parts = []
+        elif tag == 'tr':
+            if closing:
+                if in_row:
+                    yield cells, is_header
+                in_row = False
+            else:
+                in_row = True
+                in_cell = False
+                is_header = False
+                cells = []
+        elif tag == 'table' and closing:
+            return
+
+
+def is_subheader(cells):
+    """Rows like "Full Result" or "206 MINI/Cadet Result" between drivers."""
+    if len(cells) <= 2:
+        return True
+    if any('Result' in c for c in cells[:2]):
+        return True
+    return cells[0] == '' and any('Result' in c for c in cells)
+
+
+def driver_from_cells(cells):
+    """
+    Map one result row to a driver dict, or None if no name is found.
+
+    Table structure (13 cols typically):
+    [0] Pos, [1] pos-change, [2] Kart#, [3] Name, [4] Cls,
+    [5] Laps, [6] empty, [7] Avg Speed, [8] Gap, [9] Best Lap,
+    [10] Best On Lap, [11] empty/team-icon, [12] Team
+
+    But sometimes fewer columns (no Cls, no Team, etc.)
+    Key identifiers: MPH in avg speed, M:SS.SSS in best lap
+    """
+    driver = dict.fromkeys(DRIVER_FIELDS, '')
+
+    # Find anchor fields
+    mph_idx = None
+    for i, c in enumerate(cells):
+        if 'MPH' in c:
+            mph_idx = i
+            break
+
+    # Find name (first cell with 2+ alpha words)
+    name_idx = None
+    for i, c in enumerate(cells):
+        if ' ' in c and _NAME.match(c):
+            name_idx = i
+            break
+
+    if name_idx is None:
+        # Maybe DNS/DNF entry with just a name
+        for i, c in enumerate(cells):
+            if _NAME.match(c):
+                name_idx = i
+                break
+
+    if name_idx is not None:
+        driver['name'] = cells[name_idx]
+        driver['pos'] = cells[0] if cells[0] else ''
+
+        # Kart# is right before name (skip pos-change between pos and kart#)
+        if name_idx >= 2:
+            driver['no'] = cells[name_idx - 1]
+        elif name_idx == 1:
+            driver['no'] = cells[0]
+
+        # Class is right after name (if present)
+        if name_idx + 1 < len(cells):
+            cls_val = cells[name_idx + 1]
+            if cls_val and not cls_val.isdigit() and 'MPH' not in cls_val:
+                driver['cls'] = cls_val
+
+    if mph_idx is not None:
+        driver['avg_speed'] = cells[mph_idx]
+        # Laps is 1-2 cells before MPH
+        for back in [1, 2]:
+            idx = mph_idx - back
+            if idx >= 0 and cells[idx].isdigit():
+                driver['laps'] = cells[idx]
+                break
+        # Gap is right after MPH: a number, "X Laps", or empty for leader
+        if mph_idx + 1 < len(cells):
+            driver['gap'] = cells[mph_idx + 1]
+
+    # Best lap: M:SS.SSS pattern, best on lap is the next cell
+    for i, c in enumerate(cells):
+        if _LAP_TIME.match(c):
+            driver['best'] = c
+            if i + 1 < len(cells) and cells[i + 1].isdigit():
+                driver['best_on'] = cells[i + 1]
+            break
+
+    # Team: last non-empty cell if it's text, else second-to-last
+    if cells[-1] and _ALPHA.match(cells[-1]) and cells[-1] != driver['name']:
+        driver['team'] = cells[-1]
+    elif len(cells) >= 2 and cells[-2] and _ALPHA.match(cells[-2]) and cells[-2] != driver['name'] and cells[-2] != driver['cls']:
+        driver['team'] = cells[-2]
+
+    # Handle DNS/DNF
+    if not mph_idx:
+        for c in cells:
+            if c in DNS_MARKERS:
+                driver['pos'] = c
+                driver['laps'] = '0'
+                break
+
+    return driver if driver['name'] else None
+
+
+@lru_cache(maxsize=64)
+def column_map(header):
+    """
+    Map a header row (tuple of labels) to ((field, index), ...), or None
+    when the layout is not recognised. A layout must at least name the
+    Pos and Name columns.
+    """
+    found = {}
+    for i, label in enumerate(header):
+        field = _LABEL_FIELD.get(' '.join(label.lower().split()))
+        if field is not None and field not in found:
+            found[field] = i
+    if 'pos' not in found or 'name' not in found:
+        return None
+    return tuple(found.items())
+
+
+def driver_from_map(cells, cmap):
+    """Map one result row to a driver dict by header column indexes."""
+    driver = dict.fromkeys(DRIVER_FIELDS, '')
+    for field, i in cmap:
+        driver[field] = cells[i]
+    if not driver['name']:
+        return None
+    if not driver['avg_speed']:
+        for c in cells:
+            if c in DNS_MARKERS:
+                driver['pos'] = c
+                driver['laps'] = '0'
+                break
+    return driver
+
+
+def iter_results(html, use_header=True, stats=None):
+    """
+    Yield driver dicts from a result page as rows are tokenized.
+    use_header=False skips the header column map and uses only heuristics.
+    If stats is a dict, 'heuristic' and 'skipped' row counts are added to it.
+    """
+    cmap = None
+    width = 0
+    heuristic = skipped = 0
+    for cells, is_header in iter_table_rows(html):
+        if is_header:
+            if use_header:
+                cmap = column_map(tuple(cells))
+                width = len(cells)
+            continue
+        if not cells or is_subheader(cells):
+            skipped += 1
+            continue
+        if cmap is not None and len(cells) == width:
+            driver = driver_from_map(cells, cmap)
+        else:
+            driver = driver_from_cells(cells)
+            heuristic += 1
+        if driver is not None:
+            yield driver
+        else:
+            skipped += 1
+    if stats is not None:
+        stats['heuristic'] = stats.get('heuristic', 0) + heuristic
+        stats['skipped'] = stats.get('skipped', 0) + skipped
+
+
+def parse_results(html, use_header=True):
+    """Parse result table. Returns list of dicts."""
+    return list(iter_results(html, use_header))
+
+
+def parse_laptimes(html):
+    """Parse laptimes from the chart JS data embedded in the page.
+    Returns dict: { driver_name: [lap_time_strings] }
+    """
+    drivers = {}
+    for name, data_str in _DATASET.findall(html):
+        if not data_str.strip():
+            continue
+        laps = [format_lap(ms) for ms in _laps_ms(data_str)]
+        if any(laps):
+            drivers[name] = laps
+    return drivers
+
+
+def _laps_ms(data_str):
+    laps = array('i')
+    for val in data_str.split(','):
+        try:
+            secs = float(val.strip())
+        except (ValueError, TypeError):
+            secs = 0
+        laps.append(round(secs * 1000) if secs > 0 else 0)
+    return laps
+
+
+def parse_laptimes_ms(html):
+    """Like parse_laptimes, but laps are array('i') of milliseconds (0 = none)."""
+    drivers = {}
+    for name, data_str in _DATASET.findall(html):
+        if not data_str.strip():
+            continue
+        laps = _laps_ms(data_str)
+        if any(laps):
+            drivers[name] = laps
+    return drivers
+
+
+def parse_session(pages):
+    """(result_html, laptimes_html) -> (drivers, lt_data)"""
+    result_html, laptimes_html = pages
+    return parse_results(result_html), parse_laptimes(laptimes_html)
+
+
+def parse_session_stats(pages):
+    """Like parse_session, plus a dict of row counts from iter_results."""
+    result_html, laptimes_html = pages
+    stats = {}
+    drivers = list(iter_results(result_html, stats=stats))
+    return drivers, parse_laptimes(laptimes_html), stats
+
+
+# Below this many sessions the pool start-up costs more than it saves
+MIN_PARALLEL = 8
+
+
+def parse_batch(batch):
+    """
+    Parse a list of (result_html, laptimes_html) pairs in one call. Returns
+    a list of (drivers, lt_data, stats, error) in the same order; a session
+    whose pages fail to parse gets its exception as error, and the rest of
+    the batch is unaffected.
+    """
+    out = []
+    for pages in batch:
+        try:
+            out.append((*parse_session_stats(pages), None))
+        except Exception as exc:
+            out.append((None, None, None, exc))
+    return out
@@ -0,0 +1,332 @@
+"""
+Partitioned season store: one directory per series, season and round.
+
+    data/brkc/catalog.json
+    data/brkc/2025/round-04/results.csv   brkc-results.csv layout
+    data/brkc/2025/round-04/laps.csv      long lap layout (longlaps.py)
+
+A row's partition comes from its Round and Date columns: the season is the
+year of the date and the round directory is the round number, so no list
+of rounds has to be kept anywhere. Within a partition rows keep the order
+they have in the season files.
+
+catalog.json describes every partition:
+
+    { "series": "brkc", "version": <12 hex digits>,
+      "partitions": { "2025/round-04": {
+          "season": "2025", "rounds": [...], "classes": [...],
+          "sessions": [...], "dates": [first, last], "results": <rows>,
+          "series": <lap series>, "laps": <lap rows>, "drivers": <count>,
+          "bytes": <size>, "hash": <sha256 of both files> } } }
+
+select() prunes on those stats (season, round, class, date range), so a
+reader only opens the partitions a query can touch. version changes
+whenever any partition's hash does; it is what caches key on.
+
+Ingest.commit() keeps the store in step with the season files: only the
+partitions that received new or changed sessions are rewritten (update()),
+and a partition whose content comes out identical is left alone. When the
+catalog is missing, or the season files were started over (--rebuild),
+build() splits the season files into partitions, again replacing only the
+partitions whose hash changed and removing any that are now empty. The
+season files stay the ones the site serves.
+
+    python3 -m alphatiming.partitions [stats]   # the catalog
+    python3 -m alphatiming.partitions build     # split the season files
+    python3 -m alphatiming.partitions verify    # check every partition's hash
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+
+from .csvfiles import RESULTS_HEADER, csv_writer, iter_rows, round_no, row_key
+from .longlaps import LONG_HEADER, ensure_long, iter_series
+
+SERIES = "brkc"
+CATALOG_NAME = "catalog.json"
+RESULTS_FILE = "results.csv"
+LAPS_FILE = "laps.csv"
+VERSION_LEN = 12
+
+
+def partition_of(round_name, date):
+    """('Round 4', '2025-10-11') -> '2025/round-04'"""
+    n = round_no(round_name)
+    name = f"round-{n:02d}" if n else re.sub(r'[^a-z0-9]+', '-', round_name.lower()).strip('-')
+    return f"{date[:4] or 'undated'}/{name}"
+
+
+def _hash_files(paths):
+    h = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                h.update(chunk)
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def partition_stats(results_path, laps_path):
+    """Catalog entry for a partition's two files."""
+    rounds, classes, sessions, dates, drivers = set(), set(), set(), set(), set()
+    n_results = n_laps = n_series = 0
+    for row in iter_rows(results_path):
+        n_results += 1
+        rounds.add(row[0])
+        dates.add(row[1])
+        classes.add(row[2])
+        sessions.add(row[3])
+        drivers.add(row[6])
+    last = None
+    for row in iter_rows(laps_path):
+        n_laps += 1
+        rounds.add(row[0])
+        dates.add(row[1])
+        classes.add(row[2])
+        sessions.add(row[3])
+        drivers.add(row[4])
+        # Same boundary rule as longlaps.iter_series
+        if last is None or row[:5] != last[:5] or int(row[5]) <= int(last[5]):
+            n_series += 1
+        last = row
+    dates.discard('')
+    return {
+        'season': min(dates)[:4] if dates else '',
+        'rounds': sorted(rounds), 'classes': sorted(classes), 'sessions': sorted(sessions),
+        'dates': [min(dates), max(dates)] if dates else [],
+        'results': n_results, 'series': n_series, 'laps': n_laps, 'drivers': len(drivers),
+        'bytes': os.path.getsize(results_path) + os.path.getsize(laps_path),
+        'hash': _hash_files((results_path, laps_path)),
+    }
+
+
+class PartitionStore:
+    """The partitions of one series under data_dir/<series>/."""
+
+    def __init__(self, data_dir, series=SERIES):
+        self.series = series
+        self.root = os.path.join(data_dir, series)
+        self.catalog_path = os.path.join(self.root, CATALOG_NAME)
+        self.partitions = {}
+        if os.path.exists(self.catalog_path):
+            with open(self.catalog_path, 'r', encoding='utf-8') as f:
+                self.partitions = json.load(f)['partitions']
+
+    def exists(self):
+        return os.path.exists(self.catalog_path)
+
+    @property
+    def version(self):
+        h = hashlib.sha256()
+        for name in sorted(self.partitions):
+            h.update(f"{name}={self.partitions[name]['hash']}\n".encode('utf-8'))
+        return h.hexdigest()[:VERSION_LEN]
+
+    def paths(self, name):
+        directory = os.path.join(self.root, *name.split('/'))
+        return os.path.join(directory, RESULTS_FILE), os.path.join(directory, LAPS_FILE)
+
+    def select(self, seasons=None, rounds=None, classes=None, date_from=None, date_to=None):
+        """
+        Names of the partitions that can hold matching rows, in season and
+        round order. rounds are numbers or names ('4', 'Round 4').
+        """
+        seasons = {str(s) for s in seasons} if seasons else None
+        rounds = {round_no(str(r)) for r in rounds} if rounds else None
+        classes = set(classes) if classes else None
+        names = []
+        for name, p in self.partitions.items():
+            if seasons and p['season'] not in seasons:
+                continue
+            if rounds and not rounds & {round_no(r) for r in p['rounds']}:
+                continue
+            if classes and not classes & set(p['classes']):
+                continue
+            if date_from and p['dates'] and p['dates'][1] < date_from:
+                continue
+            if date_to and p['dates'] and p['dates'][0] > date_to:
+                continue
+            names.append(name)
+        return sorted(names, key=lambda n: (n.split('/')[0], round_no(n.split('/')[-1]), n))
+
+    def iter_results(self, names=None, **filters):
+        """Stream result rows of the named (or selected) partitions."""
+        for name in self.select(**filters) if names is None else names:
+            for row in iter_rows(self.paths(name)[0]):
+                if self._matches(row[0], row[1], row[2], filters):
+                    yield row
+
+    def iter_series(self, names=None, **filters):
+        """Stream (round, date, class, session, driver, laps_ms) like longlaps.iter_series."""
+        for name in self.select(**filters) if names is None else names:
+            for s in iter_series(self.paths(name)[1]):
+                if self._matches(s[0], s[1], s[2], filters):
+                    yield s
+
+    @staticmethod
+    def _matches(round_name, date, class_name, filters):
+        if filters.get('rounds') and round_no(round_name) not in {
+                round_no(str(r)) for r in filters['rounds']}:
+            return False
+        if filters.get('classes') and class_name not in filters['classes']:
+            return False
+        if filters.get('date_from') and date < filters['date_from']:
+            return False
+        if filters.get('date_to') and date > filters['date_to']:
+            return False
+        return True
+
+    def _commit(self, name, tmp_results, tmp_laps):
+        """
+        Put a partition's freshly written temp files in place, unless they
+        are identical to what is there. Returns True if it was rewritten.
+        """
+        results_path, laps_path = self.paths(name)
+        stats = partition_stats(tmp_results, tmp_laps)
+        if not stats['results'] and not stats['laps']:
+            os.remove(tmp_results)
+            os.remove(tmp_laps)
+            self.remove(name)
+            return False
+        old = self.partitions.get(name)
+        if old is not None and old['hash'] == stats['hash'] and os.path.exists(results_path):
+            os.remove(tmp_results)
+            os.remove(tmp_laps)
+            return False
+        os.replace(tmp_results, results_path)
+        os.replace(tmp_laps, laps_path)
+        self.partitions[name] = stats
+        return True
+
+    def remove(self, name):
+        if self.partitions.pop(name, None) is not None:
+            shutil.rmtree(os.path.dirname(self.paths(name)[0]), ignore_errors=True)
+
+    def _open(self, name):
+        """Temp writers for a partition's two files, headers written."""
+        results_path, laps_path = self.paths(name)
+        os.makedirs(os.path.dirname(results_path), exist_ok=True)
+        files = (open(results_path + '.tmp', 'w', newline='', encoding='utf-8'),
+                 open(laps_path + '.tmp', 'w', newline='', encoding='utf-8'))
+        writers = (csv_writer(files[0]), csv_writer(files[1]))
+        writers[0].writerow(RESULTS_HEADER)
+        writers[1].writerow(LONG_HEADER)
+        return files, writers
+
+    def build(self, results_path, long_path):
+        """
+        Split the season files into partitions. Returns the names of the
+        partitions rewritten.
+        """
+        open_parts = {}
+
+        def writers(row):
+            name = partition_of(row[0], row[1])
+            if name not in open_parts:
+                open_parts[name] = self._open(name)
+            return open_parts[name][1]
+
+        try:
+            for row in iter_rows(results_path):
+                writers(row)[0].writerow(row)
+            for row in iter_rows(long_path):
+                writers(row)[1].writerow(row)
+        finally:
+            for files, _ in open_parts.values():
+                for f in files:
+                    f.close()
+        written = [name for name in sorted(open_parts)
+                   if self._commit(name, *(p + '.tmp' for p in self.paths(name)))]
+        for name in set(self.partitions) - set(open_parts):
+            self.remove(name)
+        self.save()
+        return written
+
+    def update(self, names, drop, results, series):
+        """
+        Rewrite the named partitions: their rows less those whose key is
+        in drop, then the rows of results() and series() that belong to
+        them. results and series are callables returning fresh iterators
+        of result rows and (round, date, class, session, driver, laps_ms),
+        read once per partition. Returns the names rewritten.
+        """
+        written = []
+        for name in sorted(names):
+            results_path, laps_path = self.paths(name)
+            (rf, lf), (rw, lw) = self._open(name)
+            with rf, lf:
+                rw.writerows(r for r in iter_rows(results_path) if row_key(r) not in drop)
+                rw.writerows(r for r in results() if partition_of(r[0], r[1]) == name)
+                lw.writerows(r for r in iter_rows(laps_path) if row_key(r) not in drop)
+                for *fields, laps_ms in series():
+                    if partition_of(fields[0], fields[1]) == name:
+                        lw.writerows((*fields, lap, ms) for lap, ms in enumerate(laps_ms, 1) if ms > 0)
+            if self._commit(name, results_path + '.tmp', laps_path + '.tmp'):
+                written.append(name)
+        self.save()
+        return written
+
+    def holding(self, keys):
+        """Partitions whose catalog says they may hold rows with these (round, class, session) keys."""
+        return {name for name, p in self.partitions.items()
+                for round_name, class_name, session_type in keys
+                if round_name in p['rounds'] and class_name in p['classes']
+                and session_type in p['sessions']}
+
+    def save(self):
+        os.makedirs(self.root, exist_ok=True)
+        catalog = {'series': self.series, 'version': self.version,
+                   'partitions': {name: self.partitions[name] for name in sorted(self.partitions)}}
+        tmp = self.catalog_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(catalog, f, indent=1, sort_keys=True)
+            f.write('\n')
+        os.replace(tmp, self.catalog_path)
+
+    def verify(self):
+        """Names of partitions whose files no longer match the catalog."""
+        bad = []
+        for name, p in sorted(self.partitions.items()):
+            paths = self.paths(name)
+            if not all(os.path.exists(path) for path in paths) or _hash_files(paths) != p['hash']:
+                bad.append(name)
+        return bad
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    data_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    store = PartitionStore(data_dir)
+    command = argv[0] if argv else 'stats'
+
+    if command == 'stats':
+        if not store.exists():
+            print("no catalog; run: python3 -m alphatiming.partitions build", file=sys.stderr)
+            return 1
+        for name in store.select():
+            p = store.partitions[name]
+            print(f"  {name:18s} {' - '.join(p['dates']):23s} {p['results']:5d} results "
+                  f"{p['series']:5d} series {p['laps']:6d} laps  {len(p['classes']):2d} classes  "
+                  f"{p['hash'][:VERSION_LEN]}")
+        print(f"{len(store.partitions)} partitions, version {store.version}")
+    elif command == 'build':
+        written = store.build(os.path.join(data_dir, "brkc-results.csv"), ensure_long(data_dir))
+        print(f"{len(store.partitions)} partitions ({len(written)} written) -> {store.root}")
+    elif command == 'verify':
+        bad = store.verify()
+        for name in bad:
+            print(f"  {name} does not match the catalog")
+        print("OK" if not bad else f"{len(bad)} bad partitions")
+        return 1 if bad else 0
+    else:
+        print('\n'.join(__doc__.strip().splitlines()[-3:]), file=sys.stderr)
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
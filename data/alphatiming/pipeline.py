@@ -0,0 +1,464 @@
+"""
+Staged scrape pipeline shared by every rebuild path.
+
+    discover -> fetch -> parse -> merge -> export
+
+Each stage runs in its own worker threads and hands work to the next one
+through a bounded queue. At most `window` sessions are between the source
+and the merge at any time: when parsing or merging falls behind, fetching
+stops issuing requests instead of piling pages up in memory.
+
+  fetch   fetch_workers threads on the shared keep-alive client, all behind
+          one token bucket (rate requests/sec to the timing host) and the
+          host's retry / circuit breaker / adaptive limit (retry.py). A
+          session whose pages still fail is reported and left out of the
+          manifest, so the next run fetches it again
+  parse   parse_workers processes (BRKC_PARSE_WORKERS or the CPU count),
+          handed whatever has been fetched in batches (parse.parse_batch)
+          so the IPC round trip is paid per batch, not per session; at
+          most two batches per worker are queued before fetching waits.
+          With one worker or a short run, pages are parsed in a thread in
+          this process. A session whose pages fail to parse is reported
+          like a failed fetch
+  merge   a single consumer that puts sessions back in input order and
+          hands them to Ingest, so the CSV layout does not depend on
+          which request finished first
+  export  Ingest.commit(), then the wide brkc-laptimes.csv is regenerated
+          from the long lap file when laps were written, the championship
+          standings when results were, and the site's JSON shards
+
+build-csv.py, scrape-r2r3.py and scrape-practice.py only supply their
+SESSIONS lists. The command line form discovers sessions from
+brkc-events.csv (see discover.py):
+
+    python3 -m alphatiming.pipeline [--round 4 --round 5] [--type H1,H2,F]
+        [--event ID] [--refresh | --rebuild] [--fetch-workers N]
+        [--parse-workers N] [--rate R] [--window N] [--report-dir DIR]
+        [--profile cprofile|tracemalloc] [--replay | --live]
+"""
+
+import argparse
+import cProfile
+import os
+import queue
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+from .archive import Archive
+from .bundles import write_bundles
+from .client import fetch_url
+from .fetch import DEFAULT_RATE, DEFAULT_WORKERS, TABS, TokenBucket, session_url
+from .ingest import Ingest
+from .longlaps import LONG_NAME, long_to_wide
+from .metrics import METRICS
+from .parse import MIN_PARALLEL, parse_batch
+from .retry import FetchError
+from .standings import write_standings
+
+DATA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_WINDOW = 16
+DEFAULT_REPORT_DIR = os.path.join(DATA_DIR, ".cache", "reports")
+PROFILERS = ('cprofile', 'tracemalloc')
+
+
+def has_data(drivers, lt_data):
+    return bool(lt_data) or any(d.get('laps', '0') not in ('', '0') for d in drivers)
+
+
+def session_label(session):
+    round_name, date, event_id, session_id, class_name, session_type = session
+    return f"{round_name} - {class_name} {session_type} (sid={session_id})"
+
+
+class Pipeline:
+    """
+    Fetch, parse and ingest a list of sessions into data_dir.
+
+        Pipeline(data_dir).run(SESSIONS)
+
+    With rebuild=True every session is ingested from scratch into a
+    staging directory (see ingest.py) and the served CSVs, long lap file
+    and manifest are only replaced once every session has been fetched
+    and parsed; if any failed, or the run is stopped, they are left as
+    they were. The partitioned store (partitions.py) is then split again,
+    replacing only partitions whose content changed. Otherwise sessions
+    already in the manifest are skipped (all are refetched with refresh).
+
+    Every run writes a metrics report (run.json and run.prom, see
+    metrics.py) to report_dir (BRKC_REPORT_DIR, default data/.cache/reports).
+    profile='cprofile' (BRKC_PROFILE) profiles the parse stage into
+    parse.prof there, parsing in this process; profile='tracemalloc' adds
+    the peak and the top allocation sites of the run to the report.
+
+    Pages fetched from the timing site are kept in the raw page archive
+    (archive.py) unless archive=False or BRKC_ARCHIVE=0; pages served by
+    any other fetch function are not archived unless archive=True.
+    """
+
+    def __init__(self, data_dir=DATA_DIR, fetch_workers=DEFAULT_WORKERS,
+                 parse_workers=None, rate=DEFAULT_RATE, window=DEFAULT_WINDOW,
+                 refresh=None, rebuild=False, fetch=None, log=print,
+                 report_dir=None, profile=None, archive=None):
+        if parse_workers is None:
+            parse_workers = int(os.environ.get('BRKC_PARSE_WORKERS', 0)) or os.cpu_count() or 1
+        if report_dir is None:
+            report_dir = os.environ.get('BRKC_REPORT_DIR', DEFAULT_REPORT_DIR)
+        if profile is None:
+            profile = os.environ.get('BRKC_PROFILE') or None
+        if profile not in (None,) + PROFILERS:
+            raise ValueError(f"profile must be one of {PROFILERS}, not {profile!r}")
+        self.data_dir = data_dir
+        self.fetch_workers = max(1, fetch_workers)
+        self.parse_workers = max(1, parse_workers)
+        self.rate = rate
+        self.window = max(1, window)
+        self.refresh = refresh
+        self.rebuild = rebuild
+        self.fetch = fetch or fetch_url
+        self.log = log
+        self.report_dir = report_dir
+        self.profile = profile
+        if archive is None:
+            archive = self.fetch is fetch_url and os.environ.get('BRKC_ARCHIVE') != '0'
+        self.archive = Archive(data_dir) if archive else None
+        self.failed = []
+        self._profiler = None
+
+    def run(self, sessions):
+        """Run every stage; returns (result rows, laptime rows) written."""
+        METRICS.reset()
+        self.failed = []
+        if self.profile == 'tracemalloc':
+            tracemalloc.start()
+        os.makedirs(self.data_dir, exist_ok=True)
+        ingest = Ingest(self.data_dir, refresh=self.refresh, rebuild=self.rebuild)
+        pending = ingest.pending(sessions)
+        if not self.rebuild:
+            self.log(f"{len(sessions) - len(pending)} of {len(sessions)} sessions already ingested")
+
+        try:
+            for session, drivers, lt_data in self.stream(pending):
+                with METRICS.timer('merge'):
+                    label = session_label(session)
+                    if not has_data(drivers, lt_data):
+                        self.log(f"{label}: skipped (no data)")
+                        METRICS.inc('sessions_skipped')
+                        ingest.add_empty(session)
+                        continue
+                    status = ingest.add(session, drivers, lt_data)
+                self.log(f"{label}: {len(drivers)} results, {len(lt_data)} laptimes entries ({status})")
+        except BaseException:
+            ingest.discard()
+            raise
+
+        if self.rebuild and self.failed:
+            # Publishing now would serve a season with holes in it
+            ingest.discard()
+            self.log(f"\n{len(self.failed)} sessions could not be fetched or parsed; the rebuild"
+                     f" was not published and the served files are unchanged:")
+            for session, exc in self.failed:
+                self.log(f"  {session_label(session)}: {exc}")
+            self._write_report(len(sessions), len(pending))
+            if self.archive is not None:
+                self.archive.close()
+            return 0, 0
+
+        with METRICS.timer('write'):
+            n_results, n_laptimes = ingest.commit()
+        METRICS.inc('rows_written', n_results + n_laptimes)
+        self.log(f"\nWrote {n_results} result rows and {n_laptimes} laptime rows")
+        for session in ingest.deferred:
+            self.log(f"{session_label(session)}: changed, but not rewritten because another"
+                     f" session with the same round, class and type is not in this run")
+        if self.failed:
+            self.log(f"{len(self.failed)} sessions could not be fetched or parsed and were not recorded;"
+                     f" run again to retry them:")
+            for session, exc in self.failed:
+                self.log(f"  {session_label(session)}: {exc}")
+
+        # Export stage
+        with METRICS.timer('export'):
+            if n_laptimes or self.rebuild:
+                long_to_wide(os.path.join(self.data_dir, LONG_NAME),
+                             os.path.join(self.data_dir, "brkc-laptimes.csv"))
+            if n_results or self.rebuild:
+                write_standings(self.data_dir)
+            if n_results or n_laptimes or self.rebuild:
+                write_bundles(self.data_dir)
+        self._write_report(len(sessions), len(pending))
+        if self.archive is not None:
+            self.archive.close()
+        return n_results, n_laptimes
+
+    def _write_report(self, n_sessions, n_pending):
+        extra = {'sessions': n_sessions, 'fetched': n_pending,
+                 'failed': [{'sid': s[3], 'error': str(e)} for s, e in self.failed]}
+        if self.profile == 'tracemalloc':
+            current, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics('lineno')[:10]
+            tracemalloc.stop()
+            extra['tracemalloc'] = {
+                'peak_bytes': peak, 'current_bytes': current,
+                'top': [{'where': str(stat.traceback), 'bytes': stat.size, 'count': stat.count}
+                        for stat in top],
+            }
+        if self._profiler is not None:
+            os.makedirs(self.report_dir, exist_ok=True)
+            self._profiler.dump_stats(os.path.join(self.report_dir, 'parse.prof'))
+            self._profiler = None
+        path = METRICS.write(self.report_dir, extra)
+        self.log(f"Run report: {path}")
+
+    def stream(self, sessions):
+        """
+        Yield (session, drivers, lt_data) in input order while later
+        sessions are still being fetched and parsed.
+        """
+        sessions = list(sessions)
+        total = len(sessions)
+        if not total:
+            return
+        window = threading.BoundedSemaphore(self.window)
+        stop = threading.Event()
+        fetch_q = queue.Queue(self.window)
+        parse_q = queue.Queue(self.window)
+        merge_q = queue.Queue(self.window)
+        bucket = TokenBucket(self.rate)
+        progress = iter(range(1, total + 1))
+        progress_lock = threading.Lock()
+
+        pool = None
+        if self.profile == 'cprofile':
+            self._profiler = cProfile.Profile()
+        elif self.parse_workers > 1 and total >= MIN_PARALLEL:
+            workers = min(self.parse_workers, total)
+            pool = ProcessPoolExecutor(max_workers=workers)
+            chunk = max(1, self.window // workers)
+            futures_q = queue.Queue(2 * workers)
+
+        def source():
+            for seq, session in enumerate(sessions):
+                window.acquire()
+                if stop.is_set():
+                    window.release()
+                    break
+                fetch_q.put((seq, session))
+            for _ in range(self.fetch_workers):
+                fetch_q.put(None)
+
+        def fetcher():
+            while True:
+                item = fetch_q.get()
+                if item is None:
+                    return
+                seq, session = item
+                started = time.perf_counter()
+                try:
+                    pages = []
+                    for tab in TABS:
+                        bucket.acquire()
+                        pages.append(self.fetch(session_url(session[2], session[3], tab)))
+                    if self.archive is not None:
+                        for tab, page in zip(TABS, pages):
+                            if page:
+                                self.archive.put(session[2], session[3], tab, page)
+                    result = (seq, session, tuple(pages), None)
+                except Exception as exc:
+                    result = (seq, session, None, exc)
+                METRICS.span('fetch', started, time.perf_counter())
+                with progress_lock:
+                    self.log(f"[{next(progress)}/{total}] {session_label(session)}")
+                parse_q.put(result)
+
+        def finish(seq, session, drivers, lt_data, stats, exc):
+            parsed = None
+            if exc is None:
+                parsed = (drivers, lt_data)
+                METRICS.inc('rows_parsed', len(drivers))
+                METRICS.inc('rows_heuristic', stats.get('heuristic', 0))
+                METRICS.inc('rows_skipped', stats.get('skipped', 0))
+                METRICS.inc('laps_parsed', sum(len(laps) for laps in lt_data.values()))
+            merge_q.put((seq, session, parsed, exc))
+
+        def parser():
+            while True:
+                item = parse_q.get()
+                if item is None:
+                    return
+                seq, session, pages, exc = item
+                if exc is not None:
+                    finish(seq, session, None, None, None, exc)
+                    continue
+                started = time.perf_counter()
+                if self._profiler is not None:
+                    result, = self._profiler.runcall(parse_batch, [pages])
+                else:
+                    result, = parse_batch([pages])
+                METRICS.span('parse', started, time.perf_counter())
+                finish(seq, session, *result)
+
+        def batcher():
+            # Submit whatever has been fetched so far, up to `chunk` sessions
+            # per call; futures_q is bounded, so this waits when the pool is busy
+            done = False
+            while not done:
+                batch = [parse_q.get()]
+                while len(batch) < chunk:
+                    try:
+                        batch.append(parse_q.get_nowait())
+                    except queue.Empty:
+                        break
+                if None in batch:
+                    done = True
+                    batch = batch[:batch.index(None)]
+                todo = []
+                for seq, session, pages, exc in batch:
+                    if exc is not None:
+                        finish(seq, session, None, None, None, exc)
+                    else:
+                        todo.append((seq, session, pages))
+                if todo:
+                    future = pool.submit(parse_batch, [pages for _, _, pages in todo])
+                    futures_q.put((todo, future, time.perf_counter()))
+            futures_q.put(None)
+
+        def drainer():
+            while True:
+                item = futures_q.get()
+                if item is None:
+                    return
+                todo, future, started = item
+                try:
+                    results = future.result()
+                except Exception as exc:
+                    results = [(None, None, None, exc)] * len(todo)
+                METRICS.span('parse', started, time.perf_counter())
+                for (seq, session, _), result in zip(todo, results):
+                    finish(seq, session, *result)
+
+        def close_fetch(threads):
+            for t in threads:
+                t.join()
+            parse_q.put(None)
+
+        fetchers = [threading.Thread(target=fetcher, daemon=True) for _ in range(self.fetch_workers)]
+        threads = (
+            [threading.Thread(target=source, daemon=True)] + fetchers
+            + ([threading.Thread(target=batcher, daemon=True),
+                threading.Thread(target=drainer, daemon=True)] if pool is not None
+               else [threading.Thread(target=parser, daemon=True)])
+            + [threading.Thread(target=close_fetch, args=(fetchers,), daemon=True)]
+        )
+        for t in threads:
+            t.start()
+
+        # Merge stage: reorder into input order
+        done = {}
+        next_seq = 0
+        try:
+            while next_seq < total:
+                seq, session, parsed, exc = merge_q.get()
+                done[seq] = (session, parsed, exc)
+                while next_seq in done:
+                    session, parsed, exc = done.pop(next_seq)
+                    next_seq += 1
+                    window.release()
+                    if exc is not None:
+                        # Not handed to Ingest, so it stays pending for the next run
+                        METRICS.inc('sessions_failed')
+                        self.failed.append((session, exc))
+                        kind = exc.kind if isinstance(exc, FetchError) else type(exc).__name__
+                        self.log(f"{session_label(session)}: FAILED ({kind})")
+                        continue
+                    drivers, lt_data = parsed
+                    yield session, drivers, lt_data
+        finally:
+            stop.set()
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+
+def select(sessions, rounds=None, types=None):
+    """Keep sessions whose round ("4" or "Round 4") and type are listed."""
+    if rounds:
+        wanted = {r if r.lower().startswith('round') else f"Round {r}" for r in rounds}
+        wanted = {w.lower() for w in wanted}
+        sessions = [s for s in sessions if s[0].lower() in wanted]
+    if types:
+        types = {t.upper() for t in types}
+        sessions = [s for s in sessions if s[5] in types]
+    return sessions
+
+
+def main(argv=None):
+    from .discover import discover, read_events
+
+    ap = argparse.ArgumentParser(prog='python3 -m alphatiming.pipeline',
+                                 description="Scrape BRKC sessions into the data/ CSVs.")
+    ap.add_argument('--round', action='append', default=[],
+                    help="round to include, e.g. 4 or 'Round 4' (repeatable, or comma-separated)")
+    ap.add_argument('--type', action='append', default=[],
+                    help="session types to include: P, Q, H1, H2, PF, F (repeatable, or comma-separated)")
+    ap.add_argument('--event', action='append', type=int, default=[],
+                    help="only sessions of this event id (repeatable)")
+    ap.add_argument('--refresh', action='store_true', help="refetch sessions already ingested")
+    ap.add_argument('--rebuild', action='store_true',
+                    help="ingest every session from scratch, then replace the CSVs")
+    ap.add_argument('--rediscover', action='store_true', help="crawl event pages again")
+    ap.add_argument('--fetch-workers', type=int, default=DEFAULT_WORKERS)
+    ap.add_argument('--parse-workers', type=int, default=None)
+    ap.add_argument('--rate', type=float, default=DEFAULT_RATE, help="requests/sec to the timing host")
+    ap.add_argument('--window', type=int, default=DEFAULT_WINDOW, help="max sessions in flight")
+    ap.add_argument('--report-dir', default=None,
+                    help="where run.json / run.prom go (default data/.cache/reports)")
+    ap.add_argument('--profile', choices=PROFILERS, default=None,
+                    help="profile the parse stage (cprofile) or memory (tracemalloc)")
+    ap.add_argument('--replay', action='store_true',
+                    help="parse archived pages instead of fetching them (see archive.py)")
+    ap.add_argument('--live', action='store_true',
+                    help="follow running sessions lap by lap until interrupted (see live.py)")
+    args = ap.parse_args(argv)
+
+    rounds = [r.strip() for arg in args.round for r in arg.split(',') if r.strip()]
+    types = [t.strip() for arg in args.type for t in arg.split(',') if t.strip()]
+    if args.rebuild and (rounds or types):
+        ap.error("--rebuild rewrites every round; use --refresh with --round/--type")
+
+    events = read_events()
+    if args.event:
+        events = [e for e in events if e[2] in args.event]
+
+    if args.live:
+        from .live import LiveWatcher
+        def source(event_ids):
+            return select(discover(events, refresh=event_ids or True), rounds, types)
+        LiveWatcher(DATA_DIR, source, rate=args.rate).run()
+        return 0
+
+    sessions = select(discover(events, refresh=args.rediscover), rounds, types)
+    options = {}
+    if args.replay:
+        # Every archived session is parsed again; only those whose rows
+        # came out different are rewritten (unless --rebuild)
+        archive = Archive(DATA_DIR)
+        sessions = [s for s in sessions if archive.has_session(s[2], s[3])]
+        options = {'fetch': archive.replay_fetch, 'rate': 1e9, 'archive': False,
+                   'refresh': None if args.rebuild else True}
+    if not sessions:
+        print("No sessions selected")
+        return 1
+    options.setdefault('refresh', args.refresh or None)
+    pipeline = Pipeline(fetch_workers=args.fetch_workers, parse_workers=args.parse_workers,
+                        rate=options.pop('rate', args.rate), window=args.window,
+                        rebuild=args.rebuild, report_dir=args.report_dir, profile=args.profile,
+                        **options)
+    pipeline.run(sessions)
+    print("Done!")
+    return 1 if pipeline.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
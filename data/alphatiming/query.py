@@ -0,0 +1,502 @@
+"""
+Questions over the BRKC data: a driver's history, class leaderboards,
+session results and head-to-head records.
+
+    from alphatiming.query import Query
+
+    q = Query()
+    q.driver("Aiden Harbaugh")
+    q.leaderboard("T4 Junior", round=4)
+    q.leaderboards("T4 Junior")                # fastest laps per round
+    q.session(4, "T4 Junior", "F")
+    q.head_to_head("Ashlyn Taylor", "Lucas Mccrone")
+
+Queries only read the partitioned store (partitions.py); the pipeline
+keeps it up to date, and `python3 -m alphatiming.partitions build` splits
+it from the season CSVs. Without a catalog Query() raises
+FileNotFoundError. Three secondary indexes keep a query to the partitions
+it needs:
+
+  driver   data/brkc/index.json lists the drivers of every partition,
+           keyed by partition hash, so only partitions whose hash changed
+           are read again to bring it up to date
+  class    the catalog's class lists and its round and session type
+  session  lists. A class matches the class names equal to it, ignoring
+           case; when there are none, the combined classes it is one
+           '/'-separated part of ("T4 Junior" in "206/T4 Junior"). With
+           fuzzy=True (--fuzzy) it matches any class name containing it
+
+A partition is loaded once (model records joined by drivers.DriverIndex,
+which indexes its rows by driver and by session, plus a class index) and
+kept in a small LRU. Answers are kept in an LRU keyed by the query and
+its arguments. Both are dropped when the catalog's version changes; that
+is checked with one stat() of catalog.json per query, so a repeat query
+is a dict lookup. Answers are lists and dicts of plain values (JSON-ready)
+shared between callers, so treat them as read-only.
+
+    python3 -m alphatiming.query driver NAME [--season 2025]
+    python3 -m alphatiming.query leaderboard CLASS [--round 4] [--type Q,F] [--per-round] [--fuzzy]
+    python3 -m alphatiming.query session ROUND CLASS TYPE [--json]
+    python3 -m alphatiming.query h2h NAME NAME
+    python3 -m alphatiming.query serve [--port 8765]   # the same as JSON over HTTP
+"""
+
+import argparse
+import json
+import os
+import sys
+from collections import OrderedDict, defaultdict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from .csvfiles import format_lap, round_no
+from .drivers import ALIASES_NAME, DriverIndex, normalize, read_aliases
+from .longlaps import iter_series
+from .model import Loader
+from .partitions import PartitionStore
+
+INDEX_NAME = "index.json"
+CACHE_SIZE = 256
+PARTITION_CACHE = 8
+DEFAULT_PORT = 8765
+
+
+def class_label(class_name):
+    """'206 Mini/Cadet ' -> '206 mini/cadet', for comparing class names."""
+    return ' '.join(class_name.lower().split())
+
+
+def best_ms(ds):
+    """Best lap of a DriverSession: its fastest recorded lap, else the result's."""
+    timed = [ms for ms in ds.laps if ms > 0]
+    if timed:
+        return min(timed)
+    return ds.result.best_ms if ds.result else 0
+
+
+def session_row(ds, season):
+    best = best_ms(ds)
+    return {
+        'season': season, 'round': ds.round, 'date': ds.date, 'class': ds.class_name,
+        'session': ds.session, 'pos': ds.pos, 'status': ds.status, 'driver': ds.driver,
+        'kart': ds.kart, 'class_code': ds.class_code, 'team': ds.team,
+        'laps': len(ds.laps) or (ds.result.laps if ds.result else 0),
+        'best_ms': best, 'best': format_lap(best),
+    }
+
+
+class Partition:
+    """One loaded partition: its DriverSessions indexed by driver, session and class."""
+
+    def __init__(self, store, name, aliases):
+        results_path, laps_path = store.paths(name)
+        loader = Loader()
+        self.name = name
+        self.hash = store.partitions[name]['hash']
+        self.season = store.partitions[name]['season']
+        self.index = DriverIndex(aliases)
+        self.index.join(loader.results(results_path),
+                        (loader.series(*fields) for fields in iter_series(laps_path)))
+        self.by_class = defaultdict(list)
+        for sessions in self.index.sessions.values():
+            for ds in sessions:
+                self.by_class[ds.class_name].append(ds)
+
+    def drivers(self):
+        return [self.index.names[i] for i in range(len(self.index)) if self.index.seasons[i]]
+
+    def history(self, name):
+        return self.index.history(name)
+
+
+class Query:
+    def __init__(self, data_dir=None, cache_size=CACHE_SIZE):
+        if data_dir is None:
+            data_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.data_dir = data_dir
+        self.cache_size = cache_size
+        self.aliases = read_aliases(os.path.join(data_dir, ALIASES_NAME))
+        self.hits = self.misses = 0
+        self._cache = OrderedDict()
+        self._partitions = OrderedDict()
+        self._stamp = None
+        self._check()
+
+    # -- data version -----------------------------------------------------
+
+    def _check(self):
+        """Reload the catalog and driver index if catalog.json changed."""
+        store = PartitionStore(self.data_dir) if self._stamp is None else self.store
+        try:
+            stamp = os.stat(store.catalog_path).st_mtime_ns
+        except FileNotFoundError:
+            raise FileNotFoundError(
+                f"{store.catalog_path}: no catalog; run the pipeline or"
+                f" python3 -m alphatiming.partitions build") from None
+        if stamp == self._stamp:
+            return
+        self.store = PartitionStore(self.data_dir)
+        self.version = self.store.version
+        self._stamp = stamp
+        self._cache.clear()
+        for name in [n for n, p in self._partitions.items()
+                     if self.store.partitions.get(n, {}).get('hash') != p.hash]:
+            del self._partitions[name]
+        self._load_index()
+
+    def _load_index(self):
+        path = os.path.join(self.store.root, INDEX_NAME)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)['partitions']
+        except (OSError, ValueError, KeyError):
+            saved = {}
+        index = {}
+        for name, p in self.store.partitions.items():
+            entry = saved.get(name)
+            if entry is None or entry['hash'] != p['hash']:
+                entry = {'hash': p['hash'], 'drivers': self.partition(name).drivers()}
+            index[name] = entry
+        if index != saved:
+            # Other queries may be refreshing it too; each writes its own temp
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'version': self.version, 'partitions': index}, f,
+                          indent=1, sort_keys=True, ensure_ascii=False)
+                f.write('\n')
+            os.replace(tmp, path)
+
+        self.directory = DriverIndex(self.aliases)
+        self.driver_partitions = defaultdict(set)
+        for name, entry in index.items():
+            for driver in entry['drivers']:
+                self.driver_partitions[self.directory.add(driver)].add(name)
+
+    def partition(self, name):
+        p = self._partitions.get(name)
+        if p is None:
+            p = self._partitions[name] = Partition(self.store, name, self.aliases)
+            while len(self._partitions) > PARTITION_CACHE:
+                self._partitions.popitem(last=False)
+        else:
+            self._partitions.move_to_end(name)
+        return p
+
+    def _cached(self, key, compute):
+        value = self._cache.get(key)
+        if value is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = self._cache[key] = compute()
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return value
+
+    def cache_info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._cache),
+                'partitions': len(self._partitions), 'version': self.version}
+
+    # -- pruning ------------------------------------------------------------
+
+    def _driver_names(self, name, season):
+        """(driver id, partitions in order) for a driver name; id None if unknown."""
+        driver_id = self.directory.resolve(name)
+        if driver_id is None:
+            return None, []
+        names = self.driver_partitions[driver_id]
+        return driver_id, [n for n in self.store.select(seasons=season and [season]) if n in names]
+
+    def _classes(self, class_name, names, fuzzy=False):
+        """Class names in the catalog of names that match class_name (see the module docstring)."""
+        wanted = class_label(class_name)
+        classes = {c for n in names for c in self.store.partitions[n]['classes']}
+        if fuzzy:
+            return {c for c in classes if wanted in class_label(c)}
+        exact = {c for c in classes if class_label(c) == wanted}
+        return exact or {c for c in classes
+                         if wanted in (class_label(part) for part in c.split('/'))}
+
+    def _driver_key(self, name):
+        driver_id = self.directory.resolve(name)
+        return driver_id if driver_id is not None else normalize(name)
+
+    def suggest(self, name, limit=5):
+        """Known driver names close to name."""
+        return [self.directory.names[i] for _, i in self.directory.candidates(name, limit)]
+
+    # -- queries ------------------------------------------------------------
+
+    def driver(self, name, season=None):
+        """Every session of a driver, by date: [session_row, ...]; [] if unknown."""
+        self._check()
+        return self._cached(('driver', self._driver_key(name), season),
+                            lambda: self._driver(name, season))
+
+    def _driver(self, name, season):
+        _, names = self._driver_names(name, season)
+        rows = []
+        for n in names:
+            p = self.partition(n)
+            rows.extend(session_row(ds, p.season) for ds in p.history(name))
+        rows.sort(key=lambda r: (r['date'], round_no(r['round'])))
+        return rows
+
+    def leaderboard(self, class_name, season=None, round=None, types=None, limit=None, fuzzy=False):
+        """
+        Fastest lap per driver in the matching sessions of a class, fastest
+        first: [{'pos', 'driver', 'best_ms', 'best', 'gap_ms', 'round',
+        'class', 'session', 'kart', 'team'}, ...]
+        """
+        self._check()
+        types = tuple(sorted(types)) if types else None
+        key = ('leaderboard', class_label(class_name), season, round and round_no(str(round)),
+               types, limit, fuzzy)
+        return self._cached(key, lambda: self._leaderboard(class_name, season, round, types, limit,
+                                                           fuzzy))
+
+    def _leaderboard(self, class_name, season, round, types, limit, fuzzy):
+        names = self.store.select(seasons=season and [season], rounds=round and [round])
+        classes = self._classes(class_name, names, fuzzy)
+        best = {}
+        for n in self.store.select(seasons=season and [season], rounds=round and [round],
+                                   classes=classes):
+            p = self.partition(n)
+            for c in classes:
+                for ds in p.by_class.get(c, ()):
+                    if types and ds.session not in types:
+                        continue
+                    ms = best_ms(ds)
+                    driver_id = self._driver_key(ds.driver)
+                    if ms and (driver_id not in best or ms < best[driver_id][0]):
+                        best[driver_id] = (ms, ds)
+        board = []
+        leader = None
+        for ms, ds in sorted(best.values(), key=lambda b: (b[0], b[1].driver)):
+            leader = leader or ms
+            board.append({'pos': len(board) + 1, 'driver': ds.driver, 'best_ms': ms,
+                          'best': format_lap(ms), 'gap_ms': ms - leader, 'round': ds.round,
+                          'class': ds.class_name, 'session': ds.session, 'kart': ds.kart,
+                          'team': ds.team})
+        return board[:limit] if limit else board
+
+    def leaderboards(self, class_name, season=None, types=None, limit=None, fuzzy=False):
+        """{round: leaderboard} for every round the class ran in."""
+        self._check()
+        names = self.store.select(seasons=season and [season])
+        rounds = sorted({r for n in self.store.select(seasons=season and [season],
+                                                      classes=self._classes(class_name, names, fuzzy))
+                         for r in self.store.partitions[n]['rounds']}, key=round_no)
+        return {r: self.leaderboard(class_name, season, r, types, limit, fuzzy) for r in rounds}
+
+    def session(self, round, class_name, session_type, season=None):
+        """
+        Result order of one session: [session_row, ...]. Two sessions
+        sharing the key (e.g. two practices of a class) are both listed.
+        """
+        self._check()
+        key = ('session', round_no(str(round)), class_name, session_type.upper(), season)
+        return self._cached(key, lambda: self._session(round, class_name, session_type.upper(), season))
+
+    def _session(self, round, class_name, session_type, season):
+        rows = []
+        for n in self.store.select(seasons=season and [season], rounds=[round], classes=[class_name]):
+            p = self.partition(n)
+            for key, sessions in p.index.sessions.items():
+                if round_no(key[0]) == round_no(str(round)) and key[1:] == (class_name, session_type):
+                    rows.extend(session_row(ds, p.season) for ds in sessions)
+        return rows
+
+    def head_to_head(self, a, b, season=None):
+        """
+        Sessions both drivers ran in, with who finished ahead and who was
+        faster: {'a', 'b', 'sessions': [...], 'a_ahead', 'b_ahead',
+        'a_faster', 'b_faster'}
+        """
+        self._check()
+        key = ('h2h', self._driver_key(a), self._driver_key(b), season)
+        return self._cached(key, lambda: self._head_to_head(a, b, season))
+
+    def _head_to_head(self, a, b, season):
+        _, a_names = self._driver_names(a, season)
+        _, b_names = self._driver_names(b, season)
+        summary = {'a': a, 'b': b, 'sessions': [],
+                   'a_ahead': 0, 'b_ahead': 0, 'a_faster': 0, 'b_faster': 0}
+        for n in [n for n in a_names if n in set(b_names)]:
+            p = self.partition(n)
+            theirs = defaultdict(list)
+            for ds in p.history(b):
+                theirs[ds.key].append(ds)
+            for mine in p.history(a):
+                if not theirs.get(mine.key):
+                    continue
+                other = theirs[mine.key].pop(0)
+                row = {'round': mine.round, 'date': mine.date, 'class': mine.class_name,
+                       'session': mine.session, 'a_pos': mine.pos, 'b_pos': other.pos,
+                       'a_best_ms': best_ms(mine), 'b_best_ms': best_ms(other)}
+                if row['a_pos'] and row['b_pos']:
+                    summary['a_ahead' if row['a_pos'] < row['b_pos'] else 'b_ahead'] += 1
+                if row['a_best_ms'] and row['b_best_ms'] and row['a_best_ms'] != row['b_best_ms']:
+                    summary['a_faster' if row['a_best_ms'] < row['b_best_ms'] else 'b_faster'] += 1
+                summary['sessions'].append(row)
+        return summary
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """
+    GET /driver?name=&season=            /leaderboard?class=&round=&type=&season=&limit=&fuzzy=1
+        /session?round=&class=&type=      /h2h?a=&b=&season=      /version
+    """
+
+    query = None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        args = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        q = self.query
+        season = args.get('season')
+        try:
+            if url.path == '/driver':
+                body = q.driver(args['name'], season)
+            elif url.path == '/leaderboard':
+                types = [t for t in args.get('type', '').upper().split(',') if t]
+                body = q.leaderboard(args['class'], season, args.get('round'), types,
+                                     int(args['limit']) if args.get('limit') else None,
+                                     args.get('fuzzy') == '1')
+            elif url.path == '/session':
+                body = q.session(args['round'], args['class'], args['type'], season)
+            elif url.path == '/h2h':
+                body = q.head_to_head(args['a'], args['b'], season)
+            elif url.path == '/version':
+                q._check()
+                body = q.cache_info()
+            else:
+                return self._send(404, {'error': f"no such query: {url.path}"})
+        except KeyError as e:
+            return self._send(400, {'error': f"missing parameter {e}"})
+        except ValueError as e:
+            return self._send(400, {'error': str(e)})
+        self._send(200, body)
+
+    def _send(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def serve(query, host='127.0.0.1', port=DEFAULT_PORT):
+    handler = type('Handler', (QueryHandler,), {'query': query})
+    server = HTTPServer((host, port), handler)
+    print(f"Serving BRKC queries on http://{host}:{server.server_port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def print_rows(rows):
+    for r in rows:
+        pos = f"P{r['pos']}" if r['pos'] else r['status'] or '-'
+        print(f"  {r['round']:8s} {r['class']:28s} {r['session']:3s} {pos:5s} "
+              f"{r['driver']:24s} #{r['kart']:4s} {r['laps']:3d} laps {r['best']:>8s}")
+
+
+def print_board(board):
+    for e in board:
+        gap = f"+{e['gap_ms'] / 1000:.3f}" if e['gap_ms'] else ''
+        print(f"  {e['pos']:3d}. {e['driver']:24s} {e['best']:>8s} {gap:>8s}  "
+              f"{e['round']} {e['session']}  #{e['kart']}")
+
+
+def main(argv=None):
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--season', default=None, help="only this season, e.g. 2025")
+    common.add_argument('--json', action='store_true', help="print the answer as JSON")
+    ap = argparse.ArgumentParser(prog='python3 -m alphatiming.query')
+    sub = ap.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('driver', parents=[common], help="a driver's sessions")
+    p.add_argument('name', nargs='+')
+    p = sub.add_parser('leaderboard', parents=[common], help="fastest lap per driver in a class")
+    p.add_argument('class_name', nargs='+', metavar='class')
+    p.add_argument('--round', default=None)
+    p.add_argument('--type', default='', help="session types, e.g. Q,F")
+    p.add_argument('--limit', type=int, default=None)
+    p.add_argument('--per-round', action='store_true', help="one leaderboard per round")
+    p.add_argument('--fuzzy', action='store_true', help="match every class name containing CLASS")
+    p = sub.add_parser('session', parents=[common], help="one session's results")
+    p.add_argument('round')
+    p.add_argument('class_name', metavar='class')
+    p.add_argument('type')
+    p = sub.add_parser('h2h', parents=[common], help="two drivers' shared sessions")
+    p.add_argument('a')
+    p.add_argument('b')
+    p = sub.add_parser('serve', help="answer the same queries as JSON over HTTP")
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=DEFAULT_PORT)
+    args = ap.parse_args(argv)
+
+    try:
+        q = Query()
+    except FileNotFoundError as exc:
+        print(exc, file=sys.stderr)
+        return 1
+    if args.command == 'serve':
+        serve(q, args.host, args.port)
+        return 0
+
+    if args.command == 'driver':
+        name = ' '.join(args.name)
+        answer = q.driver(name, args.season)
+        if not answer and not args.json:
+            print(f"No driver {name!r}", file=sys.stderr)
+            for other in q.suggest(name):
+                print(f"  did you mean {other!r}?", file=sys.stderr)
+            return 1
+        show = print_rows
+    elif args.command == 'leaderboard':
+        class_name = ' '.join(args.class_name)
+        types = [t for t in args.type.upper().split(',') if t]
+        if args.per_round:
+            answer = q.leaderboards(class_name, args.season, types, args.limit, args.fuzzy)
+
+            def show(boards):
+                for round_name, board in boards.items():
+                    print(round_name)
+                    print_board(board)
+        else:
+            answer = q.leaderboard(class_name, args.season, args.round, types, args.limit,
+                                   args.fuzzy)
+            show = print_board
+    elif args.command == 'session':
+        answer = q.session(args.round, args.class_name, args.type, args.season)
+        show = print_rows
+    else:
+        answer = q.head_to_head(args.a, args.b, args.season)
+
+        def show(h2h):
+            for r in h2h['sessions']:
+                print(f"  {r['round']:8s} {r['class']:28s} {r['session']:3s} "
+                      f"P{r['a_pos'] or '-'} vs P{r['b_pos'] or '-'}  "
+                      f"{format_lap(r['a_best_ms']):>8s} vs {format_lap(r['b_best_ms']):>8s}")
+            print(f"{h2h['a']} ahead {h2h['a_ahead']}, {h2h['b']} ahead {h2h['b_ahead']}; "
+                  f"faster lap {h2h['a_faster']} - {h2h['b_faster']}")
+
+    if args.json:
+        json.dump(answer, sys.stdout, indent=1, ensure_ascii=False)
+        print()
+    else:
+        show(answer)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
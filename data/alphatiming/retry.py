@@ -0,0 +1,256 @@
+"""
+Failure handling for requests to the timing host.
+
+Every failed request is classified (FetchError.kind):
+
+  timeout      no response within the client's read/connect timeout
+  connection   refused, reset, closed mid-response, bad status line
+  server       HTTP 5xx
+  throttled    HTTP 429 (its Retry-After is honoured)
+  decode       a body that would not decompress (usually truncated)
+  client       any other HTTP 4xx - the page does not exist
+  offline      BRKC_OFFLINE=1 and the page is not cached
+  circuit      the host's circuit breaker is open
+
+Everything but client and offline is retried, up to MAX_ATTEMPTS, after a
+jittered exponential delay: a uniformly random wait between 0 and
+BASE_DELAY * 2**attempt, capped at MAX_DELAY, so threads that failed
+together do not retry together.
+
+Each host has a HostGuard holding two pieces of shared state:
+
+  CircuitBreaker  after BREAKER_THRESHOLD retryable failures in a row the
+                  circuit opens and requests wait BREAKER_COOLDOWN seconds
+                  instead of hitting the host; one probe request is then
+                  let through, and its outcome closes or reopens it.
+  AdaptiveLimit   AIMD concurrency limit on requests in flight. It grows
+                  by 1/limit per success (about +1 per round of requests)
+                  and halves on a retryable failure or a response slower
+                  than SLOW_FACTOR times the running average, at most once
+                  per DECREASE_INTERVAL.
+
+So a struggling server sees fewer, slower requests from us instead of a
+run that writes sessions full of empty pages.
+"""
+
+import http.client
+import random
+import socket
+import threading
+import time
+import zlib
+from urllib.parse import urlsplit
+
+from .metrics import METRICS
+
+MAX_ATTEMPTS = 5
+BASE_DELAY = 0.5
+MAX_DELAY = 30.0
+
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 30.0
+
+MIN_LIMIT = 1
+MAX_LIMIT = 8
+SLOW_FACTOR = 3.0
+DECREASE_INTERVAL = 2.0
+
+RETRYABLE = ('timeout', 'connection', 'server', 'throttled', 'decode', 'circuit')
+
+
+class FetchError(Exception):
+    """A request that failed, with its failure class (see above)."""
+
+    def __init__(self, kind, url, detail='', retry_after=None):
+        super().__init__(f"{kind} error fetching {url}" + (f": {detail}" if detail else ''))
+        self.kind = kind
+        self.url = url
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self):
+        return self.kind in RETRYABLE
+
+
+def classify(exc, url):
+    """FetchError for an exception raised by the client or cache."""
+    if isinstance(exc, FetchError):
+        return exc
+    if isinstance(exc, (socket.timeout, TimeoutError)):
+        kind = 'timeout'
+    elif isinstance(exc, zlib.error):
+        kind = 'decode'
+    elif isinstance(exc, (OSError, http.client.HTTPException)):
+        kind = 'connection'
+    else:
+        raise exc
+    return FetchError(kind, url, f"{type(exc).__name__}: {exc}")
+
+
+def check_status(resp):
+    """Raise a FetchError for a response that is not a success."""
+    status = resp.status
+    if 200 <= status < 300:
+        return resp
+    if status == 429:
+        raise FetchError('throttled', resp.url, "HTTP 429",
+                         retry_after=_retry_after(resp.headers.get('retry-after')))
+    if status >= 500 or status == 408:
+        raise FetchError('server', resp.url, f"HTTP {status}",
+                         retry_after=_retry_after(resp.headers.get('retry-after')))
+    raise FetchError('client', resp.url, f"HTTP {status}")
+
+
+def _retry_after(value):
+    try:
+        return min(MAX_DELAY, max(0.0, float(value)))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff(attempt, base=BASE_DELAY, cap=MAX_DELAY, rand=random.random):
+    """Full-jitter delay before retry number `attempt` (0-based)."""
+    return rand() * min(cap, base * 2 ** attempt)
+
+
+class CircuitBreaker:
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN, clock=time.monotonic):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return 'closed'
+            return 'half-open' if self.clock() - self.opened_at >= self.cooldown else 'open'
+
+    def allow(self):
+        """0 if a request may go ahead, else seconds until it might."""
+        with self._lock:
+            if self.opened_at is None:
+                return 0.0
+            wait = self.opened_at + self.cooldown - self.clock()
+            if wait > 0:
+                return wait
+            if self.probing:
+                # Somebody else's probe is in flight; check back shortly
+                return min(self.cooldown, BASE_DELAY)
+            self.probing = True
+            return 0.0
+
+    def record(self, ok):
+        with self._lock:
+            if ok:
+                self.failures = 0
+                self.opened_at = None
+            else:
+                self.failures += 1
+                if self.probing or self.failures >= self.threshold:
+                    if self.opened_at is None or self.probing:
+                        METRICS.inc('circuit_opens')
+                    self.opened_at = self.clock()
+            self.probing = False
+
+
+class AdaptiveLimit:
+    def __init__(self, initial=4, min_limit=MIN_LIMIT, max_limit=MAX_LIMIT, clock=time.monotonic):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.clock = clock
+        self.in_flight = 0
+        self.latency = None
+        self._last_decrease = float('-inf')
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, seconds, ok):
+        """Finish a request that took `seconds`; ok=False for a retryable failure."""
+        with self._cond:
+            self.in_flight -= 1
+            slow = ok and self.latency is not None and seconds > SLOW_FACTOR * self.latency
+            if ok:
+                # Slow samples count too, so the baseline follows a server
+                # that has got slower for good
+                self.latency = seconds if self.latency is None else 0.8 * self.latency + 0.2 * seconds
+            if ok and not slow:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            else:
+                now = self.clock()
+                if now - self._last_decrease >= DECREASE_INTERVAL:
+                    self._last_decrease = now
+                    self.limit = max(self.min_limit, self.limit / 2)
+                    METRICS.inc('concurrency_decreases')
+            self._cond.notify_all()
+
+
+class HostGuard:
+    __slots__ = ('breaker', 'limit')
+
+    def __init__(self):
+        self.breaker = CircuitBreaker()
+        self.limit = AdaptiveLimit()
+
+
+_guards = {}
+_guards_lock = threading.Lock()
+
+
+def guard_for(url):
+    """The shared HostGuard of url's host."""
+    host = urlsplit(url).netloc
+    with _guards_lock:
+        guard = _guards.get(host)
+        if guard is None:
+            guard = _guards[host] = HostGuard()
+        return guard
+
+
+def call(request, url, attempts=MAX_ATTEMPTS, sleep=time.sleep):
+    """
+    Run request() (which fetches url) under url's host guard, retrying
+    retryable failures. Returns its result or raises the last FetchError.
+    """
+    guard = guard_for(url)
+    for attempt in range(attempts):
+        wait = guard.breaker.allow()
+        if wait:
+            err = FetchError('circuit', url, f"circuit open for {wait:.1f}s", retry_after=wait)
+        else:
+            guard.limit.acquire()
+            started = time.perf_counter()
+            try:
+                result = request()
+            except Exception as exc:
+                elapsed = time.perf_counter() - started
+                try:
+                    err = classify(exc, url)
+                except Exception:
+                    guard.limit.release(elapsed, True)
+                    guard.breaker.record(True)
+                    raise
+                guard.limit.release(elapsed, not err.retryable)
+                guard.breaker.record(not err.retryable)
+            else:
+                guard.limit.release(time.perf_counter() - started, True)
+                guard.breaker.record(True)
+                return result
+        if not err.retryable or attempt == attempts - 1:
+            raise err
+        METRICS.inc('fetch_retries')
+        METRICS.inc(f'fetch_retries_{err.kind}')
+        delay = backoff(attempt)
+        if err.retry_after is not None:
+            delay = max(delay, err.retry_after)
+        sleep(delay)
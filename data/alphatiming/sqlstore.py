@@ -0,0 +1,283 @@
+"""
+Optional SQLite backend for the BRKC data (data/brkc.sqlite).
+
+Tables:
+    sessions(session_id, event_id, round, round_no, date, class,
+             session_type, hash, seq)
+    results(session_id, row, pos, kart, driver, class_code, laps,
+            avg_speed, gap, best, best_on, team)
+    laps(session_id, driver, series, lap, ms)
+
+Sessions are upserted with INSERT ... ON CONFLICT in one transaction per
+batch, so ingesting new sessions costs O(new rows) whatever the size of
+the database, and re-ingesting an unchanged session is a no-op. The CSVs
+can be regenerated from it in a stable ORDER BY (round, practice first,
+ingest order).
+
+Ingest writes to it when BRKC_SQLITE=1 or the file already exists.
+
+    python3 -m alphatiming.sqlstore import   # load the current CSVs
+    python3 -m alphatiming.sqlstore export   # regenerate the CSVs
+"""
+
+import os
+import sqlite3
+import sys
+from itertools import groupby
+
+from .csvfiles import (
+    RESULTS_HEADER, atomic_write, csv_writer, format_lap, laptimes_header, parse_lap,
+    read_rows, round_no, row_key,
+)
+from .longlaps import LONG_HEADER, ensure_long, iter_series
+
+DB_NAME = "brkc.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id   INTEGER PRIMARY KEY,
+    event_id     INTEGER,
+    round        TEXT NOT NULL,
+    round_no     INTEGER NOT NULL,
+    date         TEXT,
+    class        TEXT NOT NULL,
+    session_type TEXT NOT NULL,
+    hash         TEXT,
+    seq          INTEGER NOT NULL,
+    gen          INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS results (
+    session_id INTEGER NOT NULL REFERENCES sessions ON DELETE CASCADE,
+    row        INTEGER NOT NULL,
+    pos TEXT, kart TEXT, driver TEXT, class_code TEXT, laps TEXT,
+    avg_speed TEXT, gap TEXT, best TEXT, best_on TEXT, team TEXT,
+    gen        INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (session_id, row)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS laps (
+    session_id INTEGER NOT NULL REFERENCES sessions ON DELETE CASCADE,
+    driver     TEXT NOT NULL,
+    series     INTEGER NOT NULL,
+    lap        INTEGER NOT NULL,
+    ms         INTEGER NOT NULL,
+    gen        INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (session_id, driver, lap)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS sessions_round_class_type ON sessions (round, class, session_type);
+CREATE INDEX IF NOT EXISTS results_driver ON results (driver);
+CREATE INDEX IF NOT EXISTS laps_driver ON laps (driver);
+"""
+
+RESULT_FIELDS = ('pos', 'no', 'name', 'cls', 'laps', 'avg_speed', 'gap',
+                 'best', 'best_on', 'team')
+
+UPSERT_SESSION = """
+INSERT INTO sessions (session_id, event_id, round, round_no, date, class, session_type, hash, seq, gen)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (session_id) DO UPDATE SET
+    event_id = excluded.event_id, round = excluded.round,
+    round_no = excluded.round_no, date = excluded.date,
+    class = excluded.class, session_type = excluded.session_type,
+    hash = excluded.hash, gen = excluded.gen
+"""
+UPSERT_RESULT = """
+INSERT INTO results (session_id, row, pos, kart, driver, class_code, laps,
+                     avg_speed, gap, best, best_on, team, gen)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (session_id, row) DO UPDATE SET
+    pos = excluded.pos, kart = excluded.kart, driver = excluded.driver,
+    class_code = excluded.class_code, laps = excluded.laps,
+    avg_speed = excluded.avg_speed, gap = excluded.gap, best = excluded.best,
+    best_on = excluded.best_on, team = excluded.team, gen = excluded.gen
+"""
+UPSERT_LAP = """
+INSERT INTO laps (session_id, driver, series, lap, ms, gen) VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (session_id, driver, lap) DO UPDATE SET
+    series = excluded.series, ms = excluded.ms, gen = excluded.gen
+"""
+
+# Practice sessions sort before the competitive sessions of their round
+ORDER_SESSIONS = "s.round_no, s.session_type <> 'P', s.seq"
+
+
+class SQLiteStore:
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def session_hashes(self):
+        return dict(self.conn.execute("SELECT session_id, hash FROM sessions"))
+
+    def upsert_sessions(self, parsed):
+        """
+        Upsert an iterable of (session, drivers, lt_data, digest) in one
+        transaction. Sessions whose stored hash equals digest are skipped.
+        Returns the number of sessions written.
+        """
+        known = self.session_hashes()
+        written = 0
+        with self.conn:
+            cur = self.conn.cursor()
+            gen, seq = cur.execute(
+                "SELECT COALESCE(MAX(gen), 0) + 1, COALESCE(MAX(seq), 0) FROM sessions"
+            ).fetchone()
+            for session, drivers, lt_data, digest in parsed:
+                round_name, date, event_id, session_id, class_name, session_type = session
+                if digest is not None and known.get(session_id) == digest:
+                    continue
+                seq += 1
+                # Rows imported from the CSVs have synthetic negative ids;
+                # the real session replaces them.
+                cur.execute(
+                    "DELETE FROM sessions WHERE session_id < 0 AND round = ? AND class = ? AND session_type = ?",
+                    (round_name, class_name, session_type),
+                )
+                self._write_session(cur, gen, seq, session, digest, drivers, lt_data)
+                written += 1
+        return written
+
+    def _write_session(self, cur, gen, seq, session, digest, drivers, lt_data):
+        round_name, date, event_id, session_id, class_name, session_type = session
+        cur.execute(UPSERT_SESSION, (session_id, event_id, round_name, round_no(round_name),
+                                     date, class_name, session_type, digest, seq, gen))
+        cur.executemany(UPSERT_RESULT, (
+            (session_id, i, *(d.get(f, '') for f in RESULT_FIELDS), gen)
+            for i, d in enumerate(drivers)
+        ))
+        cur.executemany(UPSERT_LAP, (
+            (session_id, name, series, lap, ms, gen)
+            for series, (name, laps) in enumerate(lt_data.items())
+            for lap, ms in enumerate((parse_lap(t) if isinstance(t, str) else t for t in laps), 1)
+            if ms > 0
+        ))
+        # Anything not rewritten in this generation is gone from the source
+        cur.execute("DELETE FROM results WHERE session_id = ? AND gen <> ?", (session_id, gen))
+        cur.execute("DELETE FROM laps WHERE session_id = ? AND gen <> ?", (session_id, gen))
+
+    def import_csvs(self, data_dir):
+        """
+        Load brkc-results.csv and the long lap file. CSV rows have no
+        session id, so each run of rows with the same Round/Class/Session
+        becomes a session with a synthetic negative id.
+        """
+        _, rows = read_rows(os.path.join(data_dir, "brkc-results.csv"))
+        series = list(iter_series(ensure_long(data_dir)))
+
+        sessions = {}
+        order = []
+        for key, group in groupby(rows, key=row_key):
+            group = list(group)
+            sessions.setdefault(key, []).append((group[0][1], group, {}))
+            order.append((key, len(sessions[key]) - 1))
+        # Lap series follow the same session order as result rows, so the
+        # n-th session with a key in one file is the n-th in the other.
+        seen = {}
+        prev = None
+        for *fields, laps in series:
+            key = (fields[0], fields[2], fields[3])
+            if key != prev or fields[4] in sessions[key][n][2]:
+                # A new run of this key, or the same driver again
+                n = seen.get(key, 0)
+                seen[key] = n + 1
+                prev = key
+                if n >= len(sessions.setdefault(key, [])):
+                    sessions[key].append((fields[1], [], {}))
+                    order.append((key, n))
+            sessions[key][n][2][fields[4]] = laps
+
+        parsed = []
+        for sid, (key, n) in enumerate(order, 1):
+            date, result_rows, lt_data = sessions[key][n]
+            round_name, class_name, session_type = key
+            drivers = [dict(zip(RESULT_FIELDS, r[4:])) for r in result_rows]
+            parsed.append(((round_name, date, None, -sid, class_name, session_type),
+                           drivers, lt_data, None))
+
+        with self.conn:
+            cur = self.conn.cursor()
+            cur.execute("DELETE FROM sessions WHERE session_id < 0")
+            gen, seq = cur.execute(
+                "SELECT COALESCE(MAX(gen), 0) + 1, COALESCE(MAX(seq), 0) FROM sessions"
+            ).fetchone()
+            for i, (session, drivers, lt_data, digest) in enumerate(parsed, seq + 1):
+                self._write_session(cur, gen, i, session, digest, drivers, lt_data)
+        return len(parsed)
+
+    def export_results_csv(self, path):
+        query = f"""
+            SELECT s.round, s.date, s.class, s.session_type, r.pos, r.kart, r.driver,
+                   r.class_code, r.laps, r.avg_speed, r.gap, r.best, r.best_on, r.team
+            FROM results r JOIN sessions s USING (session_id)
+            ORDER BY {ORDER_SESSIONS}, r.row
+        """
+        with atomic_write(path) as f:
+            writer = csv_writer(f)
+            writer.writerow(RESULTS_HEADER)
+            writer.writerows(self.conn.execute(query))
+
+    def iter_series(self):
+        """Yield (round, date, class, session, driver, laps_ms) in export order."""
+        query = f"""
+            SELECT s.session_id, s.round, s.date, s.class, s.session_type, l.driver, l.lap, l.ms
+            FROM laps l JOIN sessions s USING (session_id)
+            ORDER BY {ORDER_SESSIONS}, l.series, l.lap
+        """
+        for (_, *fields), group in groupby(self.conn.execute(query), key=lambda r: r[:6]):
+            laps = []
+            for *_, lap, ms in group:
+                laps.extend([0] * (lap - len(laps) - 1))
+                laps.append(ms)
+            yield (*fields, laps)
+
+    def export_laptimes(self, wide_path, long_path):
+        width = self.conn.execute(
+            "SELECT COALESCE(MAX(n), 0) FROM (SELECT MAX(lap) AS n FROM laps GROUP BY session_id, series)"
+        ).fetchone()[0]
+        with atomic_write(wide_path) as wide, atomic_write(long_path) as long_:
+            wide_writer, long_writer = csv_writer(wide), csv_writer(long_)
+            wide_writer.writerow(laptimes_header(width))
+            long_writer.writerow(LONG_HEADER)
+            for *fields, laps in self.iter_series():
+                wide_writer.writerow(fields + [format_lap(ms) for ms in laps] + [''] * (width - len(laps)))
+                long_writer.writerows((*fields, lap, ms) for lap, ms in enumerate(laps, 1) if ms > 0)
+
+
+def enabled(data_dir):
+    return (os.environ.get('BRKC_SQLITE') == '1'
+            or os.path.exists(os.path.join(data_dir, DB_NAME)))
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    data_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    command = argv[0] if argv else ''
+    with SQLiteStore(os.path.join(data_dir, DB_NAME)) as db:
+        if command == 'import':
+            n = db.import_csvs(data_dir)
+            print(f"Imported {n} sessions into {db.path}")
+        elif command == 'export':
+            db.export_results_csv(os.path.join(data_dir, "brkc-results.csv"))
+            db.export_laptimes(os.path.join(data_dir, "brkc-laptimes.csv"),
+                               os.path.join(data_dir, "brkc-laptimes-long.csv"))
+            print(f"Exported CSVs from {db.path}")
+        else:
+            print("usage: python3 -m alphatiming.sqlstore [import|export]")
+            return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,407 @@
+"""
+Championship standings: best 10 of 14 race results count.
+
+Every H1, H2, PF and F session is a race. Finishing positions are turned
+into points per championship class, and each driver keeps a min-heap of
+their BEST_OF highest scores, so adding a race result is O(log k) and the
+running total never has to be recomputed from the whole season.
+
+Championship classes come from the Class Code column. Result pages list
+the overall order (with class codes) and then one table per class (without
+them); when a session has class codes, the coded rows are used and class
+positions are counted within each code. Sessions run as a single class
+have no codes. Such a session is one complete class table, so all of its
+drivers score in one class: the code each driver carries in a coded
+session of the same round and class name, or else the code most of its
+drivers carry in coded sessions whose class name covers this one ("T4
+Junior" in "206/T4 Junior"; drivers often race more than one class, so
+codes from unrelated sessions do not count). Only when none of them has
+such a code is the session's own class name used, mapped through
+SESSION_CLASSES where it is known to be a single coded class. Codes learned later (a
+coded final after uncoded heats) move the earlier uncoded results over.
+
+DNS rows score nothing. Positions past the end of the points scale score
+zero. The scale is read from data/brkc-points.csv (Pos,Points), or the
+file given with --points; without one the PLACEHOLDER_POINTS below are
+used, which are not the club's confirmed scale.
+
+write_standings() is incremental. The Standings state is kept in
+data/.cache/standings-state.json with the size of brkc-results.csv it
+covers and a SHA-256 of those bytes. Ingest only adds rows at the end of
+that file when it adds sessions (the file is replaced, but its old bytes
+are copied as they are), so while the digest still matches the next run
+scores only the rows after that offset. When the rows before it changed
+(a changed session, --rebuild, another points scale) every race is scored
+again.
+
+    python3 -m alphatiming.standings [--rebuild] [--points FILE] [CLASS ...]   # print tables, write brkc-standings.json
+"""
+
+import csv
+import hashlib
+import heapq
+import json
+import os
+import re
+import sys
+from collections import Counter, defaultdict
+from itertools import groupby
+
+from .drivers import normalize
+from .model import Loader
+
+STANDINGS_NAME = "brkc-standings.json"
+POINTS_NAME = "brkc-points.csv"
+STATE_NAME = os.path.join(".cache", "standings-state.json")
+STATE_VERSION = 1
+SCORING_SESSIONS = ('H1', 'H2', 'PF', 'F')
+BEST_OF = 10
+SEASON_RACES = 14
+
+# Single-class session names -> the championship class they score in
+SESSION_CLASSES = {
+    'T4 Junior': 'T4JR',
+    '206 Junior': '206JR',
+    'Piston Kup/Bambino': 'Piston Cup/Bambino',
+}
+
+# Points by class finishing position. PLACEHOLDER: not the club's scale,
+# which has not been confirmed; put the real one in brkc-points.csv
+PLACEHOLDER_POINTS = (50, 45, 42, 40) + tuple(range(39, 0, -1))
+
+
+def class_words(class_name):
+    """'206/T4 Junior' -> {'206', 't4', 'junior'}"""
+    return set(re.findall(r'[a-z0-9]+', class_name.lower()))
+
+
+def points_for(pos, points=PLACEHOLDER_POINTS):
+    if pos < 1 or pos > len(points):
+        return 0
+    return points[pos - 1]
+
+
+def read_points(path):
+    """(points for 1st, 2nd, ...) from a Pos,Points CSV; None if there is none."""
+    try:
+        with open(path, 'r', newline='', encoding='utf-8') as f:
+            rows = {int(row['Pos']): int(row['Points']) for row in csv.DictReader(f)}
+    except FileNotFoundError:
+        return None
+    if sorted(rows) != list(range(1, len(rows) + 1)):
+        raise ValueError(f"{path}: Pos must run 1, 2, 3, ... without gaps")
+    return tuple(rows[pos] for pos in range(1, len(rows) + 1))
+
+
+class DriverScore:
+    __slots__ = ('driver', 'kart', 'team', 'races', 'heap', 'total', 'wins', 'best_finish')
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.kart = ''
+        self.team = ''
+        self.races = {}
+        self.heap = []
+        self.total = 0
+        self.wins = 0
+        self.best_finish = 0
+
+    def push(self, points, k):
+        """Keep the k best scores; O(log k)."""
+        heap = self.heap
+        if len(heap) < k:
+            heapq.heappush(heap, points)
+            self.total += points
+        elif points > heap[0]:
+            self.total += points - heapq.heapreplace(heap, points)
+
+    def rebuild(self, k):
+        self.heap = heapq.nlargest(k, (p for p, _ in self.races.values()))
+        heapq.heapify(self.heap)
+        self.total = sum(self.heap)
+        positions = [pos for _, pos in self.races.values() if pos]
+        self.wins = positions.count(1)
+        self.best_finish = min(positions, default=0)
+
+
+class Standings:
+    """
+    Running standings for every class.
+
+        s = Standings()
+        s.add_session('Round 4', 'F', rows)   # model.ResultRows of one session
+        s.table('T4JR')
+    """
+
+    def __init__(self, best_of=BEST_OF, points=PLACEHOLDER_POINTS):
+        self.best_of = best_of
+        self.points = tuple(points)
+        self.classes = {}
+        self.codes = defaultdict(dict)           # driver key -> {class name: {code: races}}
+        self.round_codes = defaultdict(dict)     # (round, class name) -> {driver key: code}
+        self.uncoded = []                        # [race, class name, rows, {driver: class}]
+
+    def add_result(self, class_name, race, driver, pos, kart='', team=''):
+        """
+        Record one driver's class finishing position (0 for DNS) in race.
+        Re-adding a race that is already recorded replaces its result.
+        """
+        drivers = self.classes.setdefault(class_name, {})
+        score = drivers.get(driver)
+        if score is None:
+            score = drivers[driver] = DriverScore(driver)
+        score.kart = kart or score.kart
+        score.team = team or score.team
+        points = points_for(pos, self.points)
+        replaced = race in score.races
+        score.races[race] = (points, pos)
+        if replaced:
+            score.rebuild(self.best_of)
+            return
+        score.push(points, self.best_of)
+        if pos == 1:
+            score.wins += 1
+        if pos and (not score.best_finish or pos < score.best_finish):
+            score.best_finish = pos
+
+    def remove_result(self, class_name, race, driver):
+        drivers = self.classes.get(class_name, {})
+        score = drivers.get(driver)
+        if score is None or score.races.pop(race, None) is None:
+            return
+        if score.races:
+            score.rebuild(self.best_of)
+        else:
+            del drivers[driver]
+            if not drivers:
+                del self.classes[class_name]
+
+    def _score(self, race, rows, classes):
+        """rows: (driver, pos, kart, team); positions are counted within each class."""
+        next_pos = {}
+        for driver, pos, kart, team in rows:
+            class_name = classes[driver]
+            if pos:
+                pos = next_pos.get(class_name, 1)
+                next_pos[class_name] = pos + 1
+            self.add_result(class_name, race, driver, pos, kart, team)
+
+    def _resolve(self, round_name, class_name, rows):
+        """{driver: championship class} for the rows of an uncoded session."""
+        same_round = self.round_codes.get((round_name, class_name), {})
+        words = class_words(class_name)
+        votes = Counter()
+        for driver, _, _, _ in rows:
+            key = normalize(driver)
+            code = same_round.get(key)
+            if code is None:
+                carried = Counter()
+                for coded_class, codes in self.codes.get(key, {}).items():
+                    if words <= class_words(coded_class):
+                        carried.update(codes)
+                if carried:
+                    code = min(carried.items(), key=lambda c: (-c[1], c[0]))[0]
+            if code is not None:
+                votes[code] += 1
+        if votes:
+            session_class = min(votes.items(), key=lambda v: (-v[1], v[0]))[0]
+        else:
+            session_class = SESSION_CLASSES.get(class_name, class_name)
+        return {driver: same_round.get(normalize(driver), session_class)
+                for driver, _, _, _ in rows}
+
+    def add_session(self, round_name, session_type, rows):
+        """Score one session's ResultRows. Non-race sessions are ignored."""
+        if session_type not in SCORING_SESSIONS or not rows:
+            return
+        race = (round_name, session_type)
+        class_name = rows[0].session.class_name
+        coded = [r for r in rows if r.class_code]
+        if not coded:
+            plain = [(r.driver, r.pos, r.kart, r.team) for r in rows]
+            classes = self._resolve(round_name, class_name, plain)
+            self.uncoded.append([race, class_name, plain, classes])
+            self._score(race, plain, classes)
+            return
+
+        learned = set()
+        same_round = self.round_codes[(round_name, class_name)]
+        for r in coded:
+            key = normalize(r.driver)
+            codes = self.codes[key].setdefault(class_name, {})
+            codes[r.class_code] = codes.get(r.class_code, 0) + 1
+            same_round[key] = r.class_code
+            learned.add(key)
+        self._score(race, [(r.driver, r.pos, r.kart, r.team) for r in coded],
+                    {r.driver: r.class_code for r in coded})
+        self._reclassify(learned)
+
+    def _reclassify(self, learned):
+        """Move uncoded results whose drivers' codes just became known."""
+        for entry in self.uncoded:
+            race, class_name, rows, classes = entry
+            if not any(normalize(driver) in learned for driver, _, _, _ in rows):
+                continue
+            resolved = self._resolve(race[0], class_name, rows)
+            if resolved == classes:
+                continue
+            for driver, old in classes.items():
+                self.remove_result(old, race, driver)
+            entry[3] = resolved
+            self._score(race, rows, resolved)
+
+    def table(self, class_name):
+        """Ranked rows for one class: points, then wins, then best finish."""
+        drivers = self.classes.get(class_name, {}).values()
+        ranked = sorted(drivers, key=lambda s: (-s.total, -s.wins, s.best_finish or 999, s.driver))
+        table = []
+        for rank, s in enumerate(ranked, 1):
+            table.append({
+                'rank': rank, 'driver': s.driver, 'kart': s.kart, 'team': s.team,
+                'points': s.total, 'races': len(s.races),
+                'counted': len(s.heap), 'dropped': len(s.races) - len(s.heap),
+                'wins': s.wins,
+            })
+        return table
+
+    def tables(self):
+        return {c: self.table(c) for c in sorted(self.classes)}
+
+    def add_results(self, results):
+        """Score a stream of ResultRows, one session (run of rows with one key) at a time."""
+        for _, run in groupby(results, key=lambda r: r.session.key):
+            run = list(run)
+            self.add_session(run[0].session.round, run[0].session.session_type, run)
+
+    @classmethod
+    def from_results_csv(cls, path, best_of=BEST_OF, points=PLACEHOLDER_POINTS):
+        """Standings for every race in a brkc-results.csv."""
+        standings = cls(best_of, points)
+        standings.add_results(Loader().results(path))
+        return standings
+
+    def state(self):
+        """The standings as plain JSON values (see from_state)."""
+        return {
+            'best_of': self.best_of,
+            'points': list(self.points),
+            'classes': {c: {d: [s.kart, s.team, [[*race, p, pos] for race, (p, pos) in s.races.items()]]
+                            for d, s in drivers.items()}
+                        for c, drivers in self.classes.items()},
+            'codes': self.codes,
+            'round_codes': [[*key, codes] for key, codes in self.round_codes.items()],
+            'uncoded': self.uncoded,
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        standings = cls(state['best_of'], state['points'])
+        for class_name, drivers in state['classes'].items():
+            for driver, (kart, team, races) in drivers.items():
+                score = standings.classes.setdefault(class_name, {})[driver] = DriverScore(driver)
+                score.kart, score.team = kart, team
+                score.races = {(r, t): (p, pos) for r, t, p, pos in races}
+                score.rebuild(standings.best_of)
+        standings.codes.update(state['codes'])
+        for round_name, class_name, codes in state['round_codes']:
+            standings.round_codes[(round_name, class_name)] = codes
+        standings.uncoded = [[tuple(race), class_name, [tuple(r) for r in rows], classes]
+                             for race, class_name, rows, classes in state['uncoded']]
+        return standings
+
+
+def prefix_digest(path, size):
+    """SHA-256 hex digest of the first size bytes of path."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while size > 0:
+            chunk = f.read(min(size, 1 << 20))
+            if not chunk:
+                break
+            digest.update(chunk)
+            size -= len(chunk)
+    return digest.hexdigest()
+
+
+def load_state(path, results_path, results_size, points):
+    """(Standings, offset) saved for results_path; (None, 0) if it no longer applies."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None, 0
+    offset = state.get('offset', 0)
+    if (state.get('version') != STATE_VERSION or offset > results_size
+            or state.get('best_of') != BEST_OF
+            or state.get('points') != list(points)
+            or state.get('digest') != prefix_digest(results_path, offset)):
+        return None, 0
+    return Standings.from_state(state), offset
+
+
+def write_standings(data_dir, rebuild=False, points_path=None):
+    """
+    Bring brkc-standings.json up to date with brkc-results.csv, scoring
+    only the rows added since the last call unless rebuild. The points
+    scale is read from points_path (default brkc-points.csv). Returns the
+    Standings.
+    """
+    points = (read_points(points_path or os.path.join(data_dir, POINTS_NAME))
+              or PLACEHOLDER_POINTS)
+    results_path = os.path.join(data_dir, "brkc-results.csv")
+    state_path = os.path.join(data_dir, STATE_NAME)
+    try:
+        st = os.stat(results_path)
+    except FileNotFoundError:
+        st = None
+    standings, offset = ((None, 0) if rebuild or st is None
+                         else load_state(state_path, results_path, st.st_size, points))
+    if standings is None:
+        standings, offset = Standings(points=points), 0
+    if st is not None and st.st_size > offset:
+        standings.add_results(Loader().results(results_path, offset))
+
+    path = os.path.join(data_dir, STANDINGS_NAME)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'best_of': standings.best_of, 'races': SEASON_RACES,
+                   'placeholder_points': points is PLACEHOLDER_POINTS,
+                   'classes': standings.tables()}, f, indent=1)
+        f.write('\n')
+    os.replace(tmp, path)
+
+    if st is not None:
+        state = dict(standings.state(), version=STATE_VERSION, offset=st.st_size,
+                     digest=prefix_digest(results_path, st.st_size))
+        os.makedirs(os.path.dirname(state_path), exist_ok=True)
+        with open(state_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(state, f, separators=(',', ':'))
+        os.replace(state_path + '.tmp', state_path)
+    return standings
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    rebuild = '--rebuild' in argv
+    argv = [a for a in argv if a != '--rebuild']
+    points_path = None
+    if '--points' in argv:
+        i = argv.index('--points')
+        points_path = argv[i + 1]
+        if not os.path.exists(points_path):
+            sys.exit(f"{points_path}: no such file")
+        del argv[i:i + 2]
+    data_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    standings = write_standings(data_dir, rebuild=rebuild, points_path=points_path)
+    if standings.points == PLACEHOLDER_POINTS:
+        print(f"Using the placeholder points scale: no {POINTS_NAME}", file=sys.stderr)
+    for class_name in argv or sorted(standings.classes):
+        print(f"\n{class_name}")
+        for r in standings.table(class_name):
+            print(f"  {r['rank']:3d}  {r['driver']:30s} {r['points']:4d} pts"
+                  f"  ({r['counted']}/{r['races']} races, {r['wins']} wins)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
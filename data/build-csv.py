@@ -5,16 +5,13 @@ Fetches result and laptimes tabs from Alpha Timing.
 Outputs two CSVs:
   - data/brkc-results.csv  (session standings)
   - data/brkc-laptimes.csv (individual lap times per driver per session)
+plus the long-format lap file data/brkc-laptimes-long.csv it is exported
+from, and the ingest manifest data/brkc-manifest.json.
 """
 
-import csv
-import re
-import subprocess
 import os
-import time
 
-UA = "Mozilla/5.0"
-BASE = "https://results.alphatiming.co.uk/lorainohiokartplex/e"
+from alphatiming.pipeline import Pipeline
 
 SESSIONS = []
 
@@ -65,266 +62,11 @@ for sid, cls, stype in [
     SESSIONS.append(("Round 6", "2025-11-02", 327161, sid, cls, stype))
 
 
-def fetch_url(url):
-    result = subprocess.run(
-        ["curl", "-sL", "-A", UA, url],
-        capture_output=True, text=True, timeout=30
-    )
-    return result.stdout
-
-
-def parse_results(html):
-    """Parse result table. Returns list of dicts."""
-    drivers = []
-
-    # Find the results table
-    table_match = re.findall(
-        r'<table class="at-session-results-table"[^>]*>([\s\S]*?)</table>', html
-    )
-    if not table_match:
-        return drivers
-
-    table = table_match[0]
-    rows = re.findall(r'<tr[^>]*>([\s\S]*?)</tr>', table)
-
-    for row in rows:
-        # Skip header rows (th elements)
-        if '<th' in row:
-            continue
-
-        tds = re.findall(r'<td[^>]*>([\s\S]*?)</td>', row)
-        if not tds:
-            continue
-
-        # Clean each cell
-        cells = []
-        for td in tds:
-            text = re.sub(r'<[^>]+>', '', td).strip()
-            text = ' '.join(text.split())
-            cells.append(text)
-
-        # Skip sub-header rows like "Full Result", "206 MINI/Cadet Result", etc.
-        if len(cells) <= 2:
-            continue
-        if cells[0] in ('Full Result', '') and any('Result' in c for c in cells):
-            continue
-        # Skip if first cell has "Result" in it
-        if 'Result' in cells[0]:
-            continue
-
-        # Table structure (13 cols typically):
-        # [0] Pos, [1] pos-change, [2] Kart#, [3] Name, [4] Cls,
-        # [5] Laps, [6] empty, [7] Avg Speed, [8] Gap, [9] Best Lap,
-        # [10] Best On Lap, [11] empty/team-icon, [12] Team
-        #
-        # But sometimes fewer columns (no Cls, no Team, etc.)
-        # Key identifiers: MPH in avg speed, M:SS.SSS in best lap
-
-        driver = {
-            'pos': '', 'no': '', 'name': '', 'cls': '',
-            'laps': '', 'avg_speed': '', 'gap': '', 'best': '',
-            'best_on': '', 'team': ''
-        }
-
-        # Find anchor fields
-        mph_idx = None
-        for i, c in enumerate(cells):
-            if 'MPH' in c:
-                mph_idx = i
-                break
-
-        # Find name (first cell with 2+ alpha words)
-        name_idx = None
-        for i, c in enumerate(cells):
-            if re.match(r'^[A-Za-z][A-Za-z\s\.\'-]{3,}$', c) and ' ' in c:
-                name_idx = i
-                break
-
-        if name_idx is None:
-            # Maybe DNS/DNF entry with just a name
-            for i, c in enumerate(cells):
-                if re.match(r'^[A-Za-z][A-Za-z\s\.\'-]{3,}$', c):
-                    name_idx = i
-                    break
-
-        if name_idx is not None:
-            driver['name'] = cells[name_idx]
-
-            # Pos is typically cells[0]
-            driver['pos'] = cells[0] if cells[0] else ''
-
-            # Kart# is right before name (skip pos-change between pos and kart#)
-            if name_idx >= 2:
-                driver['no'] = cells[name_idx - 1]
-            elif name_idx == 1:
-                driver['no'] = cells[0]
-
-            # Class is right after name (if present)
-            if name_idx + 1 < len(cells):
-                cls_val = cells[name_idx + 1]
-                if cls_val and not cls_val.isdigit() and 'MPH' not in cls_val:
-                    driver['cls'] = cls_val
-
-        if mph_idx is not None:
-            driver['avg_speed'] = cells[mph_idx]
-            # Laps is 1-2 cells before MPH
-            for back in [1, 2]:
-                idx = mph_idx - back
-                if idx >= 0 and cells[idx].isdigit():
-                    driver['laps'] = cells[idx]
-                    break
-            # Gap is right after MPH
-            if mph_idx + 1 < len(cells):
-                gap = cells[mph_idx + 1]
-                # Gap is a number, "X Laps", or empty for leader
-                driver['gap'] = gap
-
-        # Best lap: M:SS.SSS pattern
-        for i, c in enumerate(cells):
-            if re.match(r'^\d+:\d+\.\d+$', c):
-                driver['best'] = c
-                # Best on lap is next cell
-                if i + 1 < len(cells) and cells[i + 1].isdigit():
-                    driver['best_on'] = cells[i + 1]
-                break
-
-        # Team: last non-empty cell if it's text
-        if cells[-1] and re.match(r'^[A-Za-z]', cells[-1]) and cells[-1] != driver['name']:
-            driver['team'] = cells[-1]
-        # Also check second-to-last
-        elif len(cells) >= 2 and cells[-2] and re.match(r'^[A-Za-z]', cells[-2]) and cells[-2] != driver['name'] and cells[-2] != driver['cls']:
-            driver['team'] = cells[-2]
-
-        # Handle DNS/DNF
-        if not mph_idx:
-            for c in cells:
-                if c in ('DNS', 'DNF', 'DSQ'):
-                    driver['pos'] = c
-                    driver['laps'] = '0'
-                    break
-
-        if driver['name']:
-            drivers.append(driver)
-
-    return drivers
-
-
-def parse_laptimes(html):
-    """Parse laptimes from the chart JS data embedded in the page.
-    Returns dict: { driver_name: [lap_time_strings] }
-    """
-    drivers = {}
-    datasets = re.findall(r'\{label:"([^"]+)"[^}]*data:\[([^\]]*)\]', html)
-
-    for name, data_str in datasets:
-        if not data_str.strip():
-            continue
-        laps = []
-        for val in data_str.split(','):
-            try:
-                secs = float(val.strip())
-                if secs > 0:
-                    mins = int(secs // 60)
-                    remainder = secs % 60
-                    laps.append(f"{mins}:{remainder:06.3f}")
-                else:
-                    laps.append("")
-            except (ValueError, TypeError):
-                laps.append("")
-        if any(laps):
-            drivers[name] = laps
-
-    return drivers
-
-
 def main():
     data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)))
-    os.makedirs(data_dir, exist_ok=True)
-
-    results_file = os.path.join(data_dir, "brkc-results.csv")
-    laptimes_file = os.path.join(data_dir, "brkc-laptimes.csv")
-
-    results_rows = []
-    laptimes_rows = []
-    max_laps = 0
-
-    total = len(SESSIONS)
-    for i, (round_name, date, event_id, session_id, class_name, session_type) in enumerate(SESSIONS):
-        print(f"[{i+1}/{total}] {round_name} - {class_name} {session_type} (sid={session_id})")
-
-        # Fetch result tab
-        result_html = fetch_url(f"{BASE}/{event_id}/s/{session_id}/result")
-        time.sleep(0.15)
-
-        # Fetch laptimes tab
-        laptimes_html = fetch_url(f"{BASE}/{event_id}/s/{session_id}/laptimes")
-        time.sleep(0.15)
-
-        # Parse results
-        drivers = parse_results(result_html)
-
-        # Check for data
-        has_data = any(d.get('laps', '0') not in ('', '0') for d in drivers)
-
-        # Parse lap times
-        lt_data = parse_laptimes(laptimes_html)
-        if lt_data:
-            has_data = True
-
-        if not has_data:
-            print(f"  -> Skipped (no data)")
-            continue
-
-        print(f"  -> {len(drivers)} results, {len(lt_data)} laptimes entries")
-
-        for d in drivers:
-            results_rows.append({
-                'round': round_name, 'date': date, 'class': class_name,
-                'session_type': session_type, **d
-            })
-
-        for driver_name, laps in lt_data.items():
-            lt_row = {
-                'round': round_name, 'date': date, 'class': class_name,
-                'session_type': session_type, 'driver': driver_name,
-            }
-            for j, lap in enumerate(laps):
-                lt_row[f'L{j+1}'] = lap
-            if len(laps) > max_laps:
-                max_laps = len(laps)
-            laptimes_rows.append(lt_row)
-
-    # Write results CSV
-    print(f"\nWriting {len(results_rows)} result rows to {results_file}")
-    with open(results_file, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow(['Round', 'Date', 'Class', 'Session', 'Pos', 'Kart#',
-                         'Driver', 'Class Code', 'Laps', 'Avg Speed', 'Gap',
-                         'Best Lap', 'Best On Lap', 'Team'])
-        for row in results_rows:
-            writer.writerow([
-                row.get('round'), row.get('date'), row.get('class'),
-                row.get('session_type'), row.get('pos'), row.get('no'),
-                row.get('name'), row.get('cls'), row.get('laps'),
-                row.get('avg_speed'), row.get('gap'), row.get('best'),
-                row.get('best_on'), row.get('team'),
-            ])
-
-    # Write laptimes CSV
-    print(f"Writing {len(laptimes_rows)} laptime rows to {laptimes_file}")
-    lap_headers = ['Round', 'Date', 'Class', 'Session', 'Driver'] + [f'L{i+1}' for i in range(max_laps)]
-    with open(laptimes_file, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow(lap_headers)
-        for row in laptimes_rows:
-            csv_row = [
-                row.get('round'), row.get('date'), row.get('class'),
-                row.get('session_type'), row.get('driver'),
-            ]
-            for j in range(max_laps):
-                csv_row.append(row.get(f'L{j+1}', ''))
-            writer.writerow(csv_row)
-
+    # Full rebuild from an empty manifest; the CSVs are only replaced once
+    # every session has come through
+    Pipeline(data_dir, rebuild=True).run(SESSIONS)
     print("Done!")
 
 